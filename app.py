@@ -1,422 +1,3602 @@
 # Temperature Monitoring Server with SendGrid Email Alerts
 # This file is self-contained for Render deployment
 
-from flask import Flask, jsonify, request
+from flask import Flask, Response, g, jsonify, request
 from flask_cors import CORS
 import os
 import requests
 import json
+import re
 import logging
+import logging.handlers
+import threading
+import time
+import atexit
+import queue
+import asyncio
+import struct
+import sqlite3
+import string
+import tempfile
+import fcntl
+import bisect
+import csv
+import io
+import hashlib
+import heapq
+import html
+import math
+import uuid
+from array import array
+from collections import OrderedDict, deque
+from collections.abc import Mapping
+from dataclasses import dataclass, field
 from datetime import datetime
-from pymodbus.client import ModbusTcpClient
-from pymodbus.exceptions import ModbusException
-
-# Configure comprehensive logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - [%(funcName)s] - %(message)s',
-    datefmt='%Y-%m-%d %H:%M:%S',
-    handlers=[
-        logging.StreamHandler(),  # Console output
-        logging.FileHandler('server.log')  # File output
-    ]
+from pymodbus.client import AsyncModbusTcpClient, ModbusTcpClient
+from pymodbus.exceptions import ModbusException, ModbusIOException
+
+try:  # optional: only needed for Parquet history export
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+# Configure logging: handlers write from a background QueueListener thread so
+# request handlers only pay for enqueueing the record, never for console/file I/O
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+LOG_FILE = os.getenv('LOG_FILE', 'server.log')
+LOG_MAX_BYTES = int(os.getenv('LOG_MAX_BYTES', 10 * 1024 * 1024))
+LOG_BACKUP_COUNT = int(os.getenv('LOG_BACKUP_COUNT', 5))
+
+_log_formatter = logging.Formatter(
+    '%(asctime)s - %(name)s - %(levelname)s - [%(funcName)s] - %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S'
 )
+_log_handlers = [logging.StreamHandler()]  # Console output
+if LOG_FILE:
+    _log_handlers.append(logging.handlers.RotatingFileHandler(  # File output
+        LOG_FILE, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding='utf-8'
+    ))
+for _handler in _log_handlers:
+    _handler.setFormatter(_log_formatter)
+
+log_queue = queue.SimpleQueue()
+log_listener = logging.handlers.QueueListener(log_queue, *_log_handlers, respect_handler_level=True)
+_queue_handler = logging.handlers.QueueHandler(log_queue)
+_queue_handler.setFormatter(logging.Formatter('%(message)s'))  # merge args only; real formatting happens in the listener
+logging.basicConfig(level=LOG_LEVEL, handlers=[_queue_handler])
+log_listener.start()
+atexit.register(log_listener.stop)
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 CORS(app)
-lastesttempeturedata = None
-
-# Store data for both PLCs
-plc_data = {
-    "PLC1": None,
-    "PLC2": None
-}
 
 # Configuration
 SENDGRID_API_KEY = os.getenv('SENDGRID_API_KEY')
+SENDGRID_API_URL = os.getenv('SENDGRID_API_URL', "https://api.sendgrid.com/v3/mail/send")
 ALERT_EMAIL = "paul.hung@se.com"
+# Default alert recipients (comma-separated); a PLC's registry "recipients" override them
+ALERT_RECIPIENTS = [email.strip() for email in os.getenv('ALERT_RECIPIENTS', ALERT_EMAIL).split(',') if email.strip()]
 
-# Threshold storage (in-memory for now, can be upgraded to database)
-threshold_config = {
-    "plc1_setpoint": 30.0,
-    "plc1_threshold": 30.0,
-    "plc2_setpoint": 32.0,
-    "plc2_threshold": 32.0
-}
+# Setpoint/threshold for PLCs registered without one (changes are persisted in CONFIG_DB)
+DEFAULT_SETPOINT = 30.0
+DEFAULT_THRESHOLD = 30.0
 
-# Manual temperature storage
-manual_temperatures = {
-    "PLC1": None,
-    "PLC2": None
+# Register map: field name -> {"address", "type", optional "scale", optional "writable"}
+# Types: int16, uint16, int32, uint32, float32 (32-bit types use two registers, high word first)
+# e.g. "setpoint": {"address": 8960, "type": "int16", "scale": 0.1, "writable": True}
+# Writable "setpoint"/"threshold" fields receive the server's values (see WriteBackEngine)
+DEFAULT_REGISTER_MAP = {
+    "temperature": {"address": 8959, "type": "uint16"}
 }
 
-# PLC configuration
-PLC_CONFIG = {
-    "PLC1": {"ip": "192.168.3.100", "port": 502, "slave_unit": 1},
-    "PLC2": {"ip": "192.168.3.101", "port": 502, "slave_unit": 1}
+# PLCs registered when there is no PLC_REGISTRY_FILE (see PlcRegistry)
+DEFAULT_PLCS = {
+    "PLC1": {"ip": "192.168.3.100", "port": 502, "slave_unit": 1, "setpoint": 30.0, "threshold": 30.0},
+    "PLC2": {"ip": "192.168.3.101", "port": 502, "slave_unit": 1, "setpoint": 32.0, "threshold": 32.0}
 }
 
-def read_plc_temperature(plc_id):
+# ============================================================================
+# METRICS
+# Prometheus text format counters/histograms at GET /metrics, cheap enough to stay on
+# ============================================================================
+
+METRICS_STRIPES = 16
+# Seconds; Modbus, HTTP and SendGrid latencies all fall between these
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_metrics = []
+_stripe_local = threading.local()
+_stripe_counter = iter(range(1 << 62))  # next() on it is atomic under the GIL
+
+
+def _stripe_index():
+    """Stripe of the calling thread, assigned round-robin on first use."""
+    index = getattr(_stripe_local, "index", None)
+    if index is None:
+        index = _stripe_local.index = next(_stripe_counter) % METRICS_STRIPES
+    return index
+
+
+class Counter:
     """
-    Read current temperature from PLC
+    Monotonic counter with labels.
+
+    Values live in METRICS_STRIPES pre-allocated (lock, dict) stripes and
+    every thread sticks to one stripe, so concurrent increments rarely
+    contend on a lock. Stripes are only summed when /metrics is scraped.
     """
-    if plc_id not in PLC_CONFIG:
-        return None
-    
-    config = PLC_CONFIG[plc_id]
-    try:
-        client = ModbusTcpClient(config["ip"], port=config["port"])
-        if client.connect():
-            result = client.read_holding_registers(8959, count=1, device_id=config["slave_unit"])
-            client.close()
-            if not result.isError():
-                temperature = result.registers[0]
-                timestamp = datetime.now().isoformat()
-                data = {
-                    "temperature": temperature,
-                    "plc": plc_id,
-                    "register": 8959,
-                    "timestamp": timestamp
-                }
-                # Update plc_data
-                plc_data[plc_id] = data
-                logger.info(f"Read temperature from {plc_id}: {temperature}°C")
-                return data
-            else:
-                logger.error(f"Modbus error reading from {plc_id}")
-                return None
-        else:
-            logger.error(f"Failed to connect to {plc_id}")
-            return None
-    except Exception as e:
-        logger.error(f"Error reading from {plc_id}: {str(e)}")
-        return None
 
-@app.route('/', methods=['GET'])
-def root():
-    logger.info("Root endpoint accessed")
-    return jsonify({"message": "Temperature Server", "endpoints": ["/temperature", "/threshold"]})
+    kind = "counter"
 
-@app.route('/temperature', methods=['GET'])
-def get_temperature():
-    # Return temperature data including which PLC it came from
-    if lastesttempeturedata:
-        temp_value = lastesttempeturedata.get('temperature')
-        plc_source = lastesttempeturedata.get('plc', 'Unknown')
-        timestamp = lastesttempeturedata.get('timestamp', 'N/A')
-        register = lastesttempeturedata.get('register', 'N/A')
-        
-        logger.debug(f"GET /temperature - Returning current temperature: {temp_value}°C from {plc_source}")
-        return jsonify({
-            "temperature": temp_value,
-            "plc": plc_source,
-            "register": register,
-            "timestamp": timestamp
-        })
-    logger.warning("GET /temperature - No temperature data available yet")
-    return jsonify({
-        "temperature": "Not Available",
-        "plc": "Unknown",
-        "error": "No data received from any PLC yet"
-    })
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = labelnames
+        self._stripes = [(threading.Lock(), {}) for _ in range(METRICS_STRIPES)]
+        _metrics.append(self)
 
-@app.route('/plc-data', methods=['GET'])
-def get_plc_data():
+    def inc(self, *labels, amount=1):
+        lock, values = self._stripes[_stripe_index()]
+        with lock:
+            values[labels] = values.get(labels, 0) + amount
+
+    def collect(self):
+        totals = {}
+        for lock, values in self._stripes:
+            with lock:
+                for labels, value in values.items():
+                    totals[labels] = totals.get(labels, 0) + value
+        return [(self.name, labels, value) for labels, value in totals.items()]
+
+
+class Histogram(Counter):
     """
-    Get current data for both PLCs including temperatures, setpoints and thresholds
+    Bucketed distribution with labels, striped like Counter.
+
+    Each label set keeps one list of per-bucket counts plus the sum; an
+    observation is a bisect and two additions. Counts are made cumulative
+    (Prometheus "le" buckets) at scrape time.
     """
-    plc1_data = plc_data.get("PLC1")
-    plc2_data = plc_data.get("PLC2")
-    
-    # Use manual temperature if available, otherwise use PLC data
-    plc1_temp = manual_temperatures.get("PLC1") or (plc1_data.get('temperature') if plc1_data else "Not Available")
-    plc2_temp = manual_temperatures.get("PLC2") or (plc2_data.get('temperature') if plc2_data else "Not Available")
-    
-    response = {
-        "PLC1": {
-            "temperature": plc1_temp,
-            "setpoint": threshold_config.get('plc1_setpoint', 30.0),
-            "threshold": threshold_config.get('plc1_threshold', 30.0),
-            "timestamp": plc1_data.get('timestamp') if plc1_data else "N/A",
-            "register": plc1_data.get('register') if plc1_data else "N/A"
-        },
-        "PLC2": {
-            "temperature": plc2_temp,
-            "setpoint": threshold_config.get('plc2_setpoint', 32.0),
-            "threshold": threshold_config.get('plc2_threshold', 32.0),
-            "timestamp": plc2_data.get('timestamp') if plc2_data else "N/A",
-            "register": plc2_data.get('register') if plc2_data else "N/A"
-        }
-    }
-    
-    logger.info("GET /plc-data - Returning data for both PLCs")
-    return jsonify(response), 200
-        
-    
-@app.route('/read-plc/<plc_id>', methods=['GET'])
-def read_plc(plc_id):
+
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        lock, series = self._stripes[_stripe_index()]
+        with lock:
+            counts = series.get(labels)
+            if counts is None:
+                counts = series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[index] += 1
+            counts[-1] += value
+
+    def collect(self):
+        merged = {}
+        for lock, series in self._stripes:
+            with lock:
+                for labels, counts in series.items():
+                    total = merged.get(labels)
+                    merged[labels] = list(counts) if total is None else [a + b for a, b in zip(total, counts)]
+
+        samples = []
+        bounds = [repr(bound) for bound in self.buckets] + ["+Inf"]
+        for labels, counts in merged.items():
+            cumulative = 0
+            for bound, count in zip(bounds, counts):
+                cumulative += count
+                samples.append((f"{self.name}_bucket", labels + (("le", bound),), cumulative))
+            samples.append((f"{self.name}_sum", labels, counts[-1]))
+            samples.append((f"{self.name}_count", labels, cumulative))
+        return samples
+
+
+class Gauge(Counter):
+    """Last value per label set (a plain dict assignment, no lock needed)."""
+
+    kind = "gauge"
+
+    def __init__(self, name, help_text, labelnames=(), func=None):
+        super().__init__(name, help_text, labelnames)
+        self.func = func  # computes {labels: value} at scrape time instead of set()
+        self._values = {}
+
+    def set(self, value, *labels):
+        self._values[labels] = value
+
+    def items(self):
+        return list(self._values.items())
+
+    def collect(self):
+        values = self.func() if self.func is not None else dict(self.items())
+        return [(self.name, labels, value) for labels, value in values.items()]
+
+
+def _format_labels(labelnames, labels):
+    pairs = []
+    for name, value in zip(labelnames, labels):
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{name}="{value}"')
+    for name, value in labels[len(labelnames):]:  # ("le", bound) appended by Histogram
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def render_metrics():
+    """All metrics in the Prometheus text exposition format (version 0.0.4)."""
+    lines = []
+    for metric in _metrics:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for name, labels, value in metric.collect():
+            lines.append(f"{name}{_format_labels(metric.labelnames, labels)} {value!r}")
+    return "\n".join(lines) + "\n"
+
+
+HTTP_REQUEST_SECONDS = Histogram('http_request_duration_seconds', 'Flask request latency by route',
+                                 ('route', 'method', 'status'))
+MODBUS_READ_SECONDS = Histogram('modbus_read_duration_seconds', 'Modbus register read latency per PLC',
+                                ('plc', 'source'))
+MODBUS_READ_ERRORS = Counter('modbus_read_errors_total', 'Failed Modbus reads per PLC by kind '
+                             '(connect, timeout, error, exception_response, circuit_open)', ('plc', 'source', 'kind'))
+INGEST_READINGS = Counter('ingest_readings_total', 'Gateway readings received by endpoint and result',
+                          ('endpoint', 'result'))
+PLC_LAST_READING = Gauge('plc_last_reading_timestamp_seconds', 'Unix time of the last reading per PLC', ('plc',))
+PLC_READING_AGE = Gauge('plc_reading_age_seconds', 'Seconds since the last reading per PLC', ('plc',),
+                        func=lambda: {labels: round(time.time() - value, 3) for labels, value in PLC_LAST_READING.items()
+                                      if labels[0] in plc_registry})
+ALERT_DECISIONS = Counter('alert_decisions_total', 'Alert engine decisions (notify = alert fired)', ('decision',))
+ALERT_DISPATCH_SECONDS = Histogram('alert_dispatch_duration_seconds', 'SendGrid send latency by email kind and outcome',
+                                   ('kind', 'outcome'))
+ALERT_DISPATCH_REJECTED = Counter('alert_dispatch_rejected_total', 'Emails rejected because the dispatch queue was full',
+                                  ('kind',))
+ALERT_QUEUE_DEPTH = Gauge('alert_dispatch_queue_depth', 'Emails waiting for a dispatcher worker',
+                          func=lambda: {(): alert_dispatcher.queue_depth()})
+ALERT_DIGEST_PENDING = Gauge('alert_digest_pending', 'Alarms waiting in the open alert digest',
+                             func=lambda: {(): alert_digest.pending()})
+POLLER_QUEUE_DEPTH = Gauge('poller_queue_depth', 'PLCs scheduled in the poller heap',
+                           func=lambda: {(): len(plc_poller._scheduled)})
+POLLER_IN_FLIGHT = Gauge('poller_in_flight', 'PLC polls in flight', func=lambda: {(): len(plc_poller._in_flight)})
+MODBUS_CIRCUIT_OPEN = Gauge('modbus_circuit_open', 'PLCs whose circuit breaker is not closed', ('plc',),
+                            func=lambda: {(plc_id,): 1 for plc_id in modbus_pool.breaker_states()})
+
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def observe_request(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, route, request.method, str(response.status_code))
+    return response
+
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
     """
-    Read current temperature from specified PLC
+    Prometheus scrape endpoint (metrics are per worker process)
     """
-    plc_id = plc_id.upper()
-    if plc_id not in ["PLC1", "PLC2"]:
-        return jsonify({"status": "error", "message": "Invalid PLC ID"}), 400
-    
-    data = read_plc_temperature(plc_id)
-    if data:
-        return jsonify({"status": "success", "data": data}), 200
-    else:
-        return jsonify({"status": "error", "message": f"Failed to read from {plc_id}"}), 500
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
 
-@app.route('/temperature', methods=['POST'])
-def receive_sensordata():
-    # Mocked temperature data
-    global lastesttempeturedata 
-    data = request.get_json()
-    lastesttempeturedata = data
-    
-    # Store data for specific PLC
-    plc = data.get('plc', 'Unknown')
-    if plc in plc_data:
-        plc_data[plc] = data
-    
-    logger.info("=" * 70)
-    logger.info("📊 RECEIVED TEMPERATURE DATA FROM LOCAL MODBUS")
-    logger.info("=" * 70)
-    logger.info(f"  PLC: {data.get('plc', 'Unknown')}")
-    logger.info(f"  Temperature Value: {data.get('temperature')}°C")
-    logger.info(f"  Register: {data.get('register', 'N/A')}")
-    logger.info(f"  Timestamp: {data.get('timestamp', 'N/A')}")
-    logger.info(f"  Raw Payload: {json.dumps(data, indent=2)}")
-    logger.info("=" * 70)
-    
-    return jsonify({"status": "success"}), 200 
 
-@app.route('/temperature/alert', methods=['POST'])
-def check_temperature_alert():
+# ============================================================================
+# REGISTER MAP - batched block reads
+# Adjacent fields are fetched with as few read_holding_registers calls as possible
+# ============================================================================
+
+MODBUS_MAX_READ_COUNT = 125  # Modbus limit for one holding-register read
+MODBUS_MAX_BLOCK_GAP = int(os.getenv('MODBUS_MAX_BLOCK_GAP', 8))
+
+# type -> (register count, struct format)
+REGISTER_TYPES = {
+    "int16": (1, ">h"),
+    "uint16": (1, ">H"),
+    "int32": (2, ">i"),
+    "uint32": (2, ">I"),
+    "float32": (2, ">f")
+}
+
+_register_plans = {}
+
+
+def plan_register_blocks(register_map, max_count=MODBUS_MAX_READ_COUNT, max_gap=MODBUS_MAX_BLOCK_GAP):
     """
-    Check if current temperature exceeds threshold and send email alert
-    Expects JSON: {"current_temperature": <value>, "threshold_temperature": <value>}
+    Group a register map into the fewest contiguous block reads.
+
+    Fields are sorted by address and merged into the current block while the
+    gap to it is at most max_gap registers (reading a few unused registers is
+    cheaper than another round trip) and the block stays within max_count.
+
+    Args:
+        register_map (dict): field name -> {"address", "type", optional "scale"}
+        max_count (int): Maximum registers per read
+        max_gap (int): Maximum unused registers to read across
+
+    Returns:
+        list: [{"address": int, "count": int, "fields": [(name, offset, spec), ...]}, ...]
     """
-    try:
-        data = request.get_json()
-        current_temp = data.get('current_temperature')
-        threshold_temp = data.get('threshold_temperature')
-        
-        logger.debug(f"Temperature Alert Check - Current: {current_temp}°C, Threshold: {threshold_temp}°C")
-        
-        if current_temp is None or threshold_temp is None:
-            logger.warning(f"Temperature Alert - Missing parameters. Current: {current_temp}, Threshold: {threshold_temp}")
-            return jsonify({"status": "error", "message": "Missing current_temperature or threshold_temperature"}), 400
-        
-        current_temp = float(current_temp)
-        threshold_temp = float(threshold_temp)
-        
-        # Check if current temperature exceeds threshold
-        if current_temp > threshold_temp:
-            logger.warning(f"🚨 TEMPERATURE ALERT TRIGGERED - {current_temp}°C > {threshold_temp}°C (Excess: {current_temp - threshold_temp}°C)")
-            # Send email alert
-            email_response = send_temperature_alert_email(current_temp, threshold_temp)
-            return jsonify({
-                "status": "alert_sent",
-                "message": f"Temperature {current_temp}°C exceeds threshold {threshold_temp}°C. Email alert sent!",
-                "current_temperature": current_temp,
-                "threshold_temperature": threshold_temp,
-                "email_response": email_response
-            }), 200
+    fields = []
+    for name, spec in register_map.items():
+        if spec.get("type", "uint16") not in REGISTER_TYPES:
+            raise ValueError(f"Unsupported register type for {name}: {spec.get('type')}")
+        width = REGISTER_TYPES[spec.get("type", "uint16")][0]
+        fields.append((int(spec["address"]), width, name, spec))
+    fields.sort(key=lambda field: field[0])
+
+    blocks = []
+    for address, width, name, spec in fields:
+        block = blocks[-1] if blocks else None
+        if block and address - (block["address"] + block["count"]) <= max_gap \
+                and address + width - block["address"] <= max_count:
+            block["count"] = max(block["count"], address + width - block["address"])
         else:
-            logger.info(f"✅ Temperature within threshold - {current_temp}°C <= {threshold_temp}°C")
-            return jsonify({
-                "status": "ok",
-                "message": f"Temperature {current_temp}°C is within threshold {threshold_temp}°C",
-                "current_temperature": current_temp,
-                "threshold_temperature": threshold_temp
-            }), 200
-            
-    except Exception as e:
-        logger.error(f"❌ Error in temperature alert check: {str(e)}", exc_info=True)
-        return jsonify({"status": "error", "message": str(e)}), 500
+            block = {"address": address, "count": width, "fields": []}
+            blocks.append(block)
+        block["fields"].append((name, address - block["address"], spec))
+    return blocks
 
-@app.route('/threshold', methods=['GET'])
-def get_threshold():
+
+def get_register_plan(plc_id):
     """
-    Get current threshold configuration for all PLCs
+    Get the (cached) block read plan for a PLC's register map
     """
-    logger.info("GET /threshold - Retrieving all thresholds")
-    logger.debug(f"Current threshold config: {json.dumps(threshold_config)}")
-    return jsonify(threshold_config), 200
+    register_map = plc_registry[plc_id].get("registers", DEFAULT_REGISTER_MAP)
+    cached = _register_plans.get(plc_id)
+    if cached is None or cached[0] is not register_map:
+        cached = (register_map, plan_register_blocks(register_map))
+        _register_plans[plc_id] = cached
+    return cached[1]
 
-@app.route('/threshold/<plc_id>', methods=['GET'])
-def get_plc_threshold(plc_id):
+
+def decode_register_blocks(plan, block_registers):
     """
-    Get threshold for a specific PLC
+    Decode the registers returned for each planned block into named values
+
     Args:
-        plc_id: 'plc1' or 'plc2'
+        plan (list): Output of plan_register_blocks
+        block_registers (list): One list of registers per block, in plan order
+
+    Returns:
+        dict: field name -> decoded value
     """
-    key = f"{plc_id}_threshold"
-    if key in threshold_config:
-        value = threshold_config[key]
-        logger.info(f"GET /threshold/{plc_id} - Retrieved threshold: {value}°C")
-        return jsonify({"plc": plc_id, "threshold": value}), 200
-    logger.warning(f"GET /threshold/{plc_id} - Invalid PLC ID: {plc_id}")
-    return jsonify({"error": f"Invalid PLC ID: {plc_id}"}), 404
+    values = {}
+    for block, registers in zip(plan, block_registers):
+        for name, offset, spec in block["fields"]:
+            width, fmt = REGISTER_TYPES[spec.get("type", "uint16")]
+            raw = struct.pack(f">{width}H", *registers[offset:offset + width])
+            value = struct.unpack(fmt, raw)[0]
+            if "scale" in spec:
+                value = round(value * spec["scale"], 6)
+            values[name] = value
+    return values
 
-@app.route('/threshold', methods=['POST'])
-def update_threshold():
+
+def encode_register_value(spec, value):
     """
-    Update threshold configuration
-    Expects JSON: {"plc1_threshold": <value>, "plc2_threshold": <value>}
+    Encode a value into registers for a register map field (inverse of decoding)
+
+    Returns:
+        list: Register values (one for 16-bit types, two for 32-bit types)
     """
-    try:
-        data = request.get_json()
-        
-        logger.info("=" * 70)
-        logger.info("🎯 RECEIVED NEW SETPOINT(S) FROM FRONTEND")
-        logger.info("=" * 70)
-        
-        updated_plcs = []
-        
-        if 'plc1_threshold' in data:
-            old_value = threshold_config.get('plc1_threshold', 'N/A')
-            new_value = float(data['plc1_threshold'])
-            threshold_config['plc1_threshold'] = new_value
-            logger.info(f"  PLC1 Threshold Updated: {old_value}°C → {new_value}°C")
-            updated_plcs.append(f"PLC1: {old_value}°C → {new_value}°C")
-            
-        if 'plc2_threshold' in data:
-            old_value = threshold_config.get('plc2_threshold', 'N/A')
-            new_value = float(data['plc2_threshold'])
-            threshold_config['plc2_threshold'] = new_value
-            logger.info(f"  PLC2 Threshold Updated: {old_value}°C → {new_value}°C")
-            updated_plcs.append(f"PLC2: {old_value}°C → {new_value}°C")
-        
-        logger.info(f"  Total Updates: {len(updated_plcs)}")
-        logger.info(f"  New Configuration: {json.dumps(threshold_config)}")
-        logger.info("  ✅ Will be sent to local modbus on next poll cycle")
-        logger.info("=" * 70)
-        
-        return jsonify({
-            "status": "success",
-            "message": "Threshold updated",
-            "config": threshold_config
-        }), 200
-    except Exception as e:
-        logger.error(f"❌ Error updating threshold: {str(e)}", exc_info=True)
-        return jsonify({"status": "error", "message": str(e)}), 400
+    register_type = spec.get("type", "uint16")
+    width, fmt = REGISTER_TYPES[register_type]
+    if "scale" in spec:
+        value = value / spec["scale"]
+    if register_type != "float32":
+        value = int(round(value))
+    return list(struct.unpack(f">{width}H", struct.pack(fmt, value)))
 
-@app.route('/threshold/<plc_id>', methods=['POST'])
-def update_plc_threshold(plc_id):
+
+
+# ============================================================================
+# CONFIG PERSISTENCE
+# Thresholds, setpoints and manual overrides survive restarts and deploys
+# ============================================================================
+
+CONFIG_DB = os.getenv('CONFIG_DB', 'config.db')  # empty string disables persistence
+PERSISTED_SECTIONS = ("threshold_config", "manual_temperatures", "plc_registry")
+
+
+class ConfigPersistence:
     """
-    Update threshold for a specific PLC
-    Args:
-        plc_id: 'plc1' or 'plc2'
-    Expects JSON: {"threshold": <value>}
+    Durable key/value store for threshold_config, manual_temperatures and
+    PLC registry edits.
+
+    Backed by SQLite in WAL mode with synchronous=NORMAL: a commit is an
+    append to the write-ahead log without an fsync, which keeps writes well
+    under a millisecond and survives process crashes and restarts. SQLite
+    checkpoints (compacts) the log into the database automatically, and the
+    whole table is loaded with a single query at startup.
     """
-    try:
-        data = request.get_json()
-        threshold = float(data.get('threshold'))
-        key = f"{plc_id}_threshold"
-        
-        if key not in threshold_config:
-            logger.warning(f"POST /threshold/{plc_id} - Invalid PLC ID: {plc_id}")
-            return jsonify({"error": f"Invalid PLC ID: {plc_id}"}), 404
-        
-        old_value = threshold_config[key]
-        threshold_config[key] = threshold
-        
-        logger.info("=" * 70)
-        logger.info(f"🎯 RECEIVED NEW SETPOINT FROM FRONTEND FOR {plc_id.upper()}")
-        logger.info("=" * 70)
-        logger.info(f"  Previous Threshold: {old_value}°C")
-        logger.info(f"  New Threshold: {threshold}°C")
-        logger.info(f"  Change: {threshold - old_value:+.1f}°C")
-        logger.info(f"  Timestamp: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-        logger.info("  ✅ Will be sent to local modbus on next poll cycle")
-        logger.info("=" * 70)
-        
-        return jsonify({
-            "status": "success",
-            "message": f"{plc_id} threshold updated",
-            "plc": plc_id,
-            "threshold": threshold,
-            "previous_threshold": old_value
-        }), 200
-    except Exception as e:
-        logger.error(f"❌ Error updating {plc_id} threshold: {str(e)}", exc_info=True)
-        return jsonify({"status": "error", "message": str(e)}), 400
-    
-    
-@app.route('/setpoint/<plc_id>', methods=['POST'])
-def update_plc_setpoint(plc_id):
+
+    def __init__(self, path):
+        self.path = path
+        self.enabled = bool(path)
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connection(self):
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS settings (
+                    section TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    updated_at REAL NOT NULL,
+                    PRIMARY KEY (section, key)
+                )
+            """)
+            self._conn = conn
+        return self._conn
+
+    def load(self):
+        """
+        Load every persisted setting
+
+        Returns:
+            dict: section -> {key: value}
+        """
+        loaded = {section: {} for section in PERSISTED_SECTIONS}
+        if not self.enabled:
+            return loaded
+        started = time.perf_counter()
+        with self._lock:
+            rows = self._connection().execute("SELECT section, key, value FROM settings").fetchall()
+        for section, key, value in rows:
+            if section in loaded:
+                loaded[section][key] = json.loads(value)
+        logger.info("config loaded settings=%d path=%s load_ms=%.1f", len(rows), self.path, (time.perf_counter() - started) * 1000)
+        return loaded
+
+    def get(self, section, keys):
+        """
+        Load selected persisted settings of one section
+
+        Returns:
+            dict: key -> value for the keys that are persisted
+        """
+        keys = list(keys)
+        if not self.enabled or not keys:
+            return {}
+        with self._lock:
+            rows = self._connection().execute(
+                f"SELECT key, value FROM settings WHERE section = ? AND key IN ({','.join('?' * len(keys))})",
+                (section, *keys)
+            ).fetchall()
+        return {key: json.loads(value) for key, value in rows}
+
+    def save(self, section, values):
+        """
+        Persist changed settings in one transaction
+
+        Args:
+            section (str): One of PERSISTED_SECTIONS
+            values (dict): key -> value
+        """
+        if not self.enabled or not values:
+            return
+        now = time.time()
+        rows = [(section, key, json.dumps(value), now) for key, value in values.items()]
+        with self._lock:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.executemany("INSERT OR REPLACE INTO settings (section, key, value, updated_at) VALUES (?, ?, ?, ?)", rows)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+
+config_persistence = ConfigPersistence(CONFIG_DB)
+
+
+# ============================================================================
+# PLC REGISTRY
+# Devices come from a config file and can be added, changed or removed at runtime
+# ============================================================================
+
+PLC_REGISTRY_FILE = os.getenv('PLC_REGISTRY_FILE', 'plcs.json')
+PLC_ID_PATTERN = re.compile(r'^[A-Z0-9][A-Z0-9_.-]{0,63}$')
+
+
+def normalize_plc_settings(plc_id, settings):
     """
-    Update setpoint for a specific PLC
+    Validate one PLC registry entry
+
     Args:
-        plc_id: 'plc1' or 'plc2'
-    Expects JSON: {"setpoint": <value>}
+        plc_id (str): PLC id (case-insensitive, stored upper case)
+        settings (dict): {"ip", optional "port", "slave_unit", "registers",
+                          "poll_interval", "index", "recipients", "setpoint", "threshold"}
+
+    Returns:
+        tuple: (plc_id, settings, initial setpoint/threshold values)
+
+    Raises:
+        ValueError: If the id or a setting is invalid
     """
+    plc_id = str(plc_id).strip().upper()
+    if not PLC_ID_PATTERN.match(plc_id):
+        raise ValueError(f"Invalid PLC ID: {plc_id}")
+    if not isinstance(settings, dict):
+        raise ValueError("PLC settings must be a JSON object")
+    ip = settings.get("ip")
+    if not ip or not isinstance(ip, str):
+        raise ValueError("PLC settings require an 'ip'")
+
     try:
-        data = request.get_json()
-        setpoint = float(data.get('setpoint'))
-        key = f"{plc_id}_setpoint"
-        
-        if key not in threshold_config:
-            logger.warning(f"POST /setpoint/{plc_id} - Invalid PLC ID: {plc_id}")
-            return jsonify({"error": f"Invalid PLC ID: {plc_id}"}), 404
-        
-        old_value = threshold_config[key]
-        threshold_config[key] = setpoint
-        
-        logger.info("=" * 70)
-        logger.info(f"🎯 RECEIVED NEW SETPOINT FROM FRONTEND FOR {plc_id.upper()}")
-        logger.info("=" * 70)
-        logger.info(f"  Previous Setpoint: {old_value}°C")
-        logger.info(f"  New Setpoint: {setpoint}°C")
-        logger.info(f"  Change: {setpoint - old_value:+.1f}°C")
-        logger.info(f"  Timestamp: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-        logger.info("  ✅ Setpoint updated")
-        logger.info("=" * 70)
-        
-        return jsonify({
-            "status": "success",
-            "message": f"{plc_id} setpoint updated",
-            "plc": plc_id,
-            "setpoint": setpoint,
-            "previous_setpoint": old_value
-        }), 200
-    except Exception as e:
-        logger.error(f"❌ Error updating {plc_id} setpoint: {str(e)}", exc_info=True)
-        return jsonify({"status": "error", "message": str(e)}), 400
+        port = int(settings.get("port", 502))
+        slave_unit = int(settings.get("slave_unit", 1))
+        poll_interval = settings.get("poll_interval")
+        poll_interval = float(poll_interval) if poll_interval is not None else None
+        index = int(settings["index"]) if settings.get("index") is not None else None
+        initial = {kind: float(settings[kind]) for kind in ("setpoint", "threshold") if settings.get(kind) is not None}
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"Invalid PLC setting: {e}") from e
+    if not 0 < port < 65536 or not 0 <= slave_unit < 256:
+        raise ValueError("PLC port must be 1-65535 and slave_unit 0-255")
+    if poll_interval is not None and poll_interval <= 0:
+        raise ValueError("PLC poll_interval must be positive")
+    if index is not None and not 0 <= index < 65536:
+        raise ValueError("PLC index must be 0-65535")
+    recipients = settings.get("recipients")
+    if recipients is not None and (not isinstance(recipients, list) or
+                                   not all(isinstance(email, str) and '@' in email for email in recipients)):
+        raise ValueError("PLC recipients must be a list of email addresses")
 
+    registers = settings.get("registers", DEFAULT_REGISTER_MAP)
+    if not isinstance(registers, dict) or not all(isinstance(spec, dict) for spec in registers.values()):
+        raise ValueError("PLC registers must map field names to register specs")
+    try:
+        plan_register_blocks(registers)
+    except (KeyError, TypeError, ValueError) as e:
+        raise ValueError(f"Invalid register map: {e}") from e
 
-@app.route('/temperature/manual/<plc_id>', methods=['POST'])
-def set_manual_temperature(plc_id):
-    """
-    Set manual temperature for a specific PLC
-    Args:
-        plc_id: 'PLC1' or 'PLC2'
-    Expects JSON: {"temperature": <value>}
+    return plc_id, {
+        "ip": ip,
+        "port": port,
+        "slave_unit": slave_unit,
+        "registers": registers,
+        "poll_interval": poll_interval,
+        "index": index,
+        "recipients": recipients or None
+    }, initial
+
+
+def _free_device_index(devices):
+    used = {settings.get("index") for settings in devices.values()}
+    return next(index for index in range(len(used) + 1) if index not in used)
+
+
+def load_plc_devices(path, persisted):
+    """
+    Load the registry from a JSON file ({"<plc id>": settings, ...}, falling
+    back to DEFAULT_PLCS) and apply the edits persisted in CONFIG_DB
+
+    Returns:
+        tuple: (plc id -> settings, threshold_config defaults)
+    """
+    source = DEFAULT_PLCS
+    if path and os.path.exists(path):
+        with open(path) as f:
+            source = json.load(f)
+        logger.info("plc registry file loaded plcs=%d path=%s", len(source), path)
+
+    devices = {}
+    thresholds = {}
+    for plc_id, settings in source.items():
+        plc_id, settings, initial = normalize_plc_settings(plc_id, settings)
+        devices[plc_id] = settings
+        thresholds[f"{plc_id.lower()}_setpoint"] = initial.get("setpoint", DEFAULT_SETPOINT)
+        thresholds[f"{plc_id.lower()}_threshold"] = initial.get("threshold", DEFAULT_THRESHOLD)
+    for plc_id, settings in persisted.items():
+        if settings is None:
+            devices.pop(plc_id, None)
+            continue
+        devices[plc_id] = settings
+        thresholds.setdefault(f"{plc_id.lower()}_setpoint", DEFAULT_SETPOINT)
+        thresholds.setdefault(f"{plc_id.lower()}_threshold", DEFAULT_THRESHOLD)
+
+    # Devices without an explicit index get the lowest free one, in file order
+    explicit = [settings["index"] for settings in devices.values() if settings.get("index") is not None]
+    if len(explicit) != len(set(explicit)):
+        raise ValueError("Duplicate PLC index in the PLC registry")
+    for plc_id, settings in devices.items():
+        if settings.get("index") is None:
+            devices[plc_id] = {**settings, "index": _free_device_index(devices)}
+    return devices, thresholds
+
+
+class PlcRegistry(Mapping):
+    """
+    Registered PLCs: id -> {"ip", "port", "slave_unit", "registers", "poll_interval", "index"}.
+
+    A read-only mapping over an immutable dict: lookups are plain dict
+    lookups without a lock, and response caches can key on `devices`
+    identity. Edits build a new dict under a lock, set up the device's
+    state (reading slot, manual override, flat "<id>_setpoint" and
+    "<id>_threshold" keys), persist the entry in CONFIG_DB and mirror it to
+    other workers. Settings dicts are replaced, never modified, so
+    connections notice a changed device by identity.
+
+    Every device also has a unique numeric "index" (kept across edits),
+    which compact ingest formats use instead of the id string.
+    """
+
+    def __init__(self, devices):
+        self._devices = dict(devices)
+        self._by_index = {settings["index"]: plc_id for plc_id, settings in self._devices.items()}
+        self._lock = threading.Lock()
+
+    def __getitem__(self, plc_id):
+        return self._devices[plc_id]
+
+    def __iter__(self):
+        return iter(self._devices)
+
+    def __len__(self):
+        return len(self._devices)
+
+    def __contains__(self, plc_id):
+        return plc_id in self._devices
+
+    @property
+    def devices(self):
+        return self._devices
+
+    @property
+    def by_index(self):
+        """Device index -> PLC id."""
+        return self._by_index
+
+    def put(self, plc_id, settings, share=True):
+        """
+        Register a PLC or replace its settings
+
+        Args:
+            plc_id (str): PLC id
+            settings (dict): See normalize_plc_settings; "setpoint"/"threshold"
+                             are applied to threshold_config
+            share (bool): Persist and mirror to other workers (False when applying another worker's edit)
+
+        Returns:
+            tuple: (created, normalized settings)
+
+        Raises:
+            ValueError: If the id or settings are invalid
+        """
+        plc_id, settings, initial = normalize_plc_settings(plc_id, settings)
+        with self._lock:
+            existing = self._devices.get(plc_id)
+            created = existing is None
+            if settings["index"] is None:
+                settings["index"] = existing["index"] if existing else _free_device_index(self._devices)
+            owner = self._by_index.get(settings["index"])
+            if owner is not None and owner != plc_id:
+                raise ValueError(f"PLC index {settings['index']} is already used by {owner}")
+            self._devices = {**self._devices, plc_id: settings}
+            self._by_index = {**{index: key for index, key in self._by_index.items() if key != plc_id},
+                              settings["index"]: plc_id}
+            if share:
+                config_persistence.save("plc_registry", {plc_id: settings})
+                shared_state.put("plc_registry", plc_id, settings)
+        if not created:
+            modbus_pool.discard(plc_id)  # new settings: fresh connection and circuit breaker
+
+        snapshot = state.snapshot
+        thresholds = {}
+        defaults = {f"{plc_id.lower()}_setpoint": DEFAULT_SETPOINT, f"{plc_id.lower()}_threshold": DEFAULT_THRESHOLD}
+        missing = [key for key in defaults if key not in snapshot.threshold_config]
+        # A re-added PLC gets back the values persisted before it was removed
+        persisted = config_persistence.get("threshold_config", missing)
+        for key, default in defaults.items():
+            kind = key.rsplit('_', 1)[1]
+            if kind in initial:
+                thresholds[key] = initial[kind]
+            elif key in missing:
+                thresholds[key] = persisted.get(key, default)
+        state.update(
+            plc_data={plc_id: None} if plc_id not in snapshot.plc_data else None,
+            manual_temperatures={plc_id: None} if plc_id not in snapshot.manual_temperatures else None,
+            threshold_config=thresholds,
+            share=share
+        )
+        return created, settings
+
+    def remove(self, plc_id, share=True):
+        """
+        Unregister a PLC and drop its state (persisted thresholds are kept for a re-add)
+
+        Returns:
+            bool: False if the PLC was not registered
+        """
+        with self._lock:
+            if plc_id not in self._devices:
+                return False
+            self._devices = {key: value for key, value in self._devices.items() if key != plc_id}
+            self._by_index = {index: key for index, key in self._by_index.items() if key != plc_id}
+            if share:
+                config_persistence.save("plc_registry", {plc_id: None})
+                shared_state.put("plc_registry", plc_id, None)
+        state.remove_plc(plc_id)
+        rolling_stats.pop(plc_id, None)
+        modbus_pool.discard(plc_id)
+        return True
+
+    def apply(self, plc_id, settings):
+        """Apply a registry edit made by another worker."""
+        if settings is None:
+            self.remove(plc_id, share=False)
+        else:
+            self.put(plc_id, settings, share=False)
+
+
+_persisted_config = config_persistence.load()
+_plc_devices, _plc_thresholds = load_plc_devices(PLC_REGISTRY_FILE, _persisted_config["plc_registry"])
+plc_registry = PlcRegistry(_plc_devices)
+
+
+# ============================================================================
+# APPLICATION STATE
+# Immutable versioned snapshots: writers publish, readers never lock
+# ============================================================================
+
+_UNSET = object()
+
+
+@dataclass(frozen=True, slots=True)
+class StateSnapshot:
+    """
+    One consistent, versioned view of the server state.
+
+    The dicts of a published snapshot are never modified (writers copy the
+    sections they change), so a handler that takes state.snapshot once can
+    read readings, thresholds and manual overrides that belong together.
+    """
+    version: int
+    plc_data: dict = field(default_factory=dict)
+    threshold_config: dict = field(default_factory=dict)
+    manual_temperatures: dict = field(default_factory=dict)
+    latest_reading: dict = None  # last reading received from any PLC (GET /temperature)
+
+
+class StateStore:
+    """
+    Holds the current StateSnapshot.
+
+    Readers take `state.snapshot`, a single attribute read with no lock, so
+    read throughput scales with threads. Writers serialize on a lock, build
+    the next snapshot copy-on-write with version + 1, persist changed
+    settings, mirror the changed keys to the shared state store and wake
+    SSE subscribers.
+    """
+
+    __slots__ = ("_snapshot", "_lock")
+
+    def __init__(self, plc_data, threshold_config, manual_temperatures):
+        self._snapshot = StateSnapshot(
+            version=0,
+            plc_data=dict(plc_data),
+            threshold_config=dict(threshold_config),
+            manual_temperatures=dict(manual_temperatures)
+        )
+        self._lock = threading.Lock()
+
+    @property
+    def snapshot(self):
+        return self._snapshot
+
+    def update(self, plc_data=None, threshold_config=None, manual_temperatures=None,
+               latest_reading=_UNSET, share=True):
+        """
+        Publish a new snapshot with the given keys changed
+
+        Args:
+            plc_data (dict): PLC id -> reading
+            threshold_config (dict): threshold/setpoint key -> value
+            manual_temperatures (dict): PLC id -> manual temperature
+            latest_reading (dict): New value for GET /temperature
+            share (bool): Mirror the changes to other workers and persist thresholds and
+                          manual temperatures (False when applying another worker's changes)
+
+        Returns:
+            tuple: (previous snapshot, new snapshot)
+        """
+        with self._lock:
+            previous = self._snapshot
+            snapshot = StateSnapshot(
+                version=previous.version + 1,
+                plc_data={**previous.plc_data, **plc_data} if plc_data else previous.plc_data,
+                threshold_config={**previous.threshold_config, **threshold_config} if threshold_config else previous.threshold_config,
+                manual_temperatures={**previous.manual_temperatures, **manual_temperatures} if manual_temperatures else previous.manual_temperatures,
+                latest_reading=previous.latest_reading if latest_reading is _UNSET else latest_reading
+            )
+            self._snapshot = snapshot
+            if share:
+                config_persistence.save("threshold_config", threshold_config)
+                config_persistence.save("manual_temperatures", manual_temperatures)
+            if share and shared_state.enabled:
+                items = [("plc_data", key, value) for key, value in (plc_data or {}).items()]
+                items += [("threshold_config", key, value) for key, value in (threshold_config or {}).items()]
+                items += [("manual_temperatures", key, value) for key, value in (manual_temperatures or {}).items()]
+                if latest_reading is not _UNSET:
+                    items.append(("latest", "reading", latest_reading))
+                shared_state.put_many(items)
+        state_broadcaster.notify(snapshot.version)
+        return previous, snapshot
+
+    def remove_plc(self, plc_id):
+        """
+        Publish a snapshot without a PLC's reading, manual temperature,
+        setpoint and threshold (not shared: registry edits carry removals)
+        """
+        keys = (f"{plc_id.lower()}_setpoint", f"{plc_id.lower()}_threshold")
+        with self._lock:
+            previous = self._snapshot
+            snapshot = StateSnapshot(
+                version=previous.version + 1,
+                plc_data={key: value for key, value in previous.plc_data.items() if key != plc_id},
+                threshold_config={key: value for key, value in previous.threshold_config.items() if key not in keys},
+                manual_temperatures={key: value for key, value in previous.manual_temperatures.items() if key != plc_id},
+                latest_reading=previous.latest_reading
+            )
+            self._snapshot = snapshot
+        state_broadcaster.notify(snapshot.version)
+        return previous, snapshot
+
+
+state = StateStore(
+    {plc_id: None for plc_id in plc_registry},
+    {**_plc_thresholds, **{key: value for key, value in _persisted_config["threshold_config"].items() if key in _plc_thresholds}},
+    {plc_id: _persisted_config["manual_temperatures"].get(plc_id) for plc_id in plc_registry}
+)
+
+
+# ============================================================================
+# SHARED STATE
+# SQLite store so every server worker process sees the same readings and thresholds
+# ============================================================================
+
+SHARED_STATE = os.getenv('SHARED_STATE', 'false').lower() in ('1', 'true', 'yes')
+_default_state_dir = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+STATE_DB = os.getenv('STATE_DB', os.path.join(_default_state_dir, 'temperature-server-state.db'))
+SHARED_STATE_SYNC_INTERVAL = float(os.getenv('SHARED_STATE_SYNC_INTERVAL', 0.5))  # seconds between background syncs
+# Readings stay in the shared journal this long; every worker applies them within a sync interval
+READING_JOURNAL_RETENTION = float(os.getenv('READING_JOURNAL_RETENTION', 60))
+
+
+class SharedStateStore:
+    """
+    Write-through mirror of the application state (plc_data,
+    threshold_config, manual_temperatures, the latest reading and PLC
+    registry edits) in a SQLite database shared by all workers.
+
+    Each process keeps serving from its in-memory snapshot. Writers also upsert
+    the changed keys with an increasing sequence number; sync() (run before
+    every request and every SHARED_STATE_SYNC_INTERVAL in the background)
+    asks SQLite for its data_version, which only changes when another
+    connection committed, and then pulls just the rows newer than the last
+    sequence it applied. An unchanged store costs one PRAGMA.
+
+    Ingested readings go through a journal table instead of being applied
+    where they arrive: every worker applies all of them, in journal order,
+    to its history buffers and rolling statistics (see apply_readings), so
+    all workers serve the same history and stats. sync_readings() runs in
+    the background and before the requests that read history or stats,
+    so ingest requests only pay for the insert. The leader also writes
+    them to the history segment files and records the last journal seq it
+    flushed there; a starting worker loads the segments and tails the
+    journal from that seq. The leader prunes rows older than
+    READING_JOURNAL_RETENTION.
+
+    Alarm state, the open alert digest and alert statuses are records
+    that any worker may change: update_records() is a read-modify-write
+    under the database write lock, so workers never overwrite each
+    other's changes.
+    """
+
+    def __init__(self, path, enabled=True):
+        self.path = path
+        self.enabled = enabled
+        self._conn = None
+        self._lock = threading.Lock()
+        self._apply_lock = threading.Lock()  # applies changes in commit order
+        self._data_version = None
+        self._last_seq = 0
+        self._last_reading_seq = 0
+        self._prune_marks = deque()  # (monotonic time, journal seq) for pruning
+
+    def _connection(self):
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=OFF")  # runtime state only; durability is not needed
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS state (
+                    namespace TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    seq INTEGER NOT NULL,
+                    PRIMARY KEY (namespace, key)
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS state_seq ON state (seq)")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS readings (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    plc_id TEXT NOT NULL,
+                    timestamp REAL NOT NULL,
+                    value REAL NOT NULL
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS records (
+                    namespace TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    PRIMARY KEY (namespace, key)
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS history_flushed (
+                    id INTEGER PRIMARY KEY CHECK (id = 0),
+                    seq INTEGER NOT NULL
+                )
+            """)
+            self._conn = conn
+            self._last_reading_seq = self._flushed_seq()
+        return self._conn
+
+    def _flushed_seq(self):
+        row = self._conn.execute("SELECT seq FROM history_flushed WHERE id = 0").fetchone()
+        return row[0] if row else 0
+
+    def put_many(self, items):
+        """
+        Publish changed keys to the other workers
+
+        Args:
+            items (list): [(namespace, key, value), ...]
+        """
+        if not self.enabled or not items:
+            return
+        rows = [(namespace, key, json.dumps(value)) for namespace, key, value in items]
+        with self._lock:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                for row in rows:
+                    conn.execute(
+                        "INSERT OR REPLACE INTO state (namespace, key, value, seq) "
+                        "VALUES (?, ?, ?, (SELECT COALESCE(MAX(seq), 0) + 1 FROM state))", row
+                    )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+    def put(self, namespace, key, value):
+        self.put_many([(namespace, key, value)])
+
+    def append_readings(self, readings):
+        """
+        Journal readings for every worker (this one included) to apply
+
+        Args:
+            readings (list): [(plc_id, timestamp, value), ...]
+        """
+        if not readings:
+            return
+        with self._lock:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.executemany("INSERT INTO readings (plc_id, timestamp, value) VALUES (?, ?, ?)", readings)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+    def prune_readings(self):
+        """Drop journal rows older than READING_JOURNAL_RETENTION (run by the leader)."""
+        now = time.monotonic()
+        with self._lock:
+            conn = self._connection()
+            marks = self._prune_marks
+            if not marks or now - marks[-1][0] >= SHARED_STATE_SYNC_INTERVAL * 10:
+                marks.append((now, self._last_reading_seq))
+            cutoff = None
+            while marks and now - marks[0][0] >= READING_JOURNAL_RETENTION:
+                cutoff = marks.popleft()[1]
+            if cutoff:
+                conn.execute("DELETE FROM readings WHERE seq <= ?", (cutoff,))
+
+    def _select_records(self, conn, namespace, keys):
+        if keys is None:
+            return conn.execute("SELECT key, value FROM records WHERE namespace = ?", (namespace,)).fetchall()
+        keys = list(keys)
+        placeholders = ','.join('?' * len(keys))
+        return conn.execute(f"SELECT key, value FROM records WHERE namespace = ? AND key IN ({placeholders})",
+                            (namespace, *keys)).fetchall()
+
+    def get_records(self, namespace, keys=None):
+        """
+        Read shared records
+
+        Args:
+            namespace (str): Record namespace
+            keys (iterable): Keys to read, or None for the whole namespace
+
+        Returns:
+            dict: key -> value of the records that exist
+        """
+        with self._lock:
+            rows = self._select_records(self._connection(), namespace, keys)
+        return {key: json.loads(value) for key, value in rows}
+
+    def update_records(self, namespace, keys, update):
+        """
+        Read-modify-write shared records in one transaction
+
+        Args:
+            namespace (str): Record namespace
+            keys (iterable): Keys to load, or None for the whole namespace
+            update (callable): Called with {key: value} of the loaded records;
+                               entries it changes, adds or removes are written back
+
+        Returns:
+            The return value of update
+        """
+        with self._lock:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                stored = dict(self._select_records(conn, namespace, keys))
+                records = {key: json.loads(value) for key, value in stored.items()}
+                result = update(records)
+                changed = []
+                for key, value in records.items():
+                    encoded = json.dumps(value)
+                    if stored.get(key) != encoded:
+                        changed.append((namespace, key, encoded))
+                conn.executemany("INSERT OR REPLACE INTO records (namespace, key, value) VALUES (?, ?, ?)", changed)
+                conn.executemany("DELETE FROM records WHERE namespace = ? AND key = ?",
+                                 [(namespace, key) for key in stored if key not in records])
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        return result
+
+    def prune_records(self, namespace, keep):
+        """Keep only the `keep` most recently written records of a namespace."""
+        with self._lock:
+            self._connection().execute(
+                "DELETE FROM records WHERE namespace = ? AND rowid NOT IN "
+                "(SELECT rowid FROM records WHERE namespace = ? ORDER BY rowid DESC LIMIT ?)",
+                (namespace, namespace, keep)
+            )
+
+    def sync(self):
+        """
+        Apply changes committed by other workers to this process's state
+
+        Returns:
+            int: Number of keys applied
+        """
+        if not self.enabled:
+            return 0
+        with self._lock:
+            conn = self._connection()
+            data_version = conn.execute("PRAGMA data_version").fetchone()[0]
+            if data_version == self._data_version:
+                return 0
+            self._data_version = data_version
+            rows = conn.execute(
+                "SELECT namespace, key, value, seq FROM state WHERE seq > ? ORDER BY seq", (self._last_seq,)
+            ).fetchall()
+            if rows:
+                self._last_seq = rows[-1][3]
+
+        if not rows:
+            return 0
+        self._apply_state(rows)
+        return len(rows)
+
+    def sync_readings(self):
+        """
+        Apply the journal readings this process has not applied yet, in
+        journal order (see apply_readings)
+
+        Returns:
+            int: Number of readings applied
+        """
+        if not self.enabled:
+            return 0
+        with self._apply_lock:
+            with self._lock:
+                conn = self._connection()
+                readings = conn.execute(
+                    "SELECT plc_id, timestamp, value, seq FROM readings WHERE seq > ? ORDER BY seq",
+                    (self._last_reading_seq,)
+                ).fetchall()
+                if not readings:
+                    return 0
+                self._last_reading_seq = readings[-1][3]
+
+            apply_readings([reading[:3] for reading in readings])
+            if is_leader():
+                with self._lock:
+                    conn.execute("INSERT OR REPLACE INTO history_flushed (id, seq) VALUES (0, ?)",
+                                 (self._last_reading_seq,))
+            return len(readings)
+
+    def _apply_state(self, rows):
+        changes = {"plc_data": {}, "threshold_config": {}, "manual_temperatures": {}}
+        registry_changes = {}
+        latest_reading = _UNSET
+        for namespace, key, value, _ in rows:
+            if namespace == "latest":
+                latest_reading = json.loads(value)
+            elif namespace == "plc_registry":
+                registry_changes[key] = json.loads(value)
+            elif namespace in changes:
+                changes[namespace][key] = json.loads(value)
+        state.update(latest_reading=latest_reading, share=False, **changes)
+        # After the state: added PLCs keep the values above, removed PLCs drop them
+        for plc_id, settings in registry_changes.items():
+            plc_registry.apply(plc_id, settings)
+
+    def start(self):
+        """
+        Load the history segment files, tail the reading journal from the
+        last reading the leader flushed to them, and keep syncing in the
+        background so idle workers keep up with the journal
+        """
+        if not self.enabled:
+            load_history()
+            return
+        with self._apply_lock:
+            with self._lock:
+                self._connection()
+                self._last_reading_seq = self._flushed_seq()
+            load_history()
+        threading.Thread(target=self._run, name="shared-state-sync", daemon=True).start()
+
+    def _run(self):
+        while True:
+            time.sleep(SHARED_STATE_SYNC_INTERVAL)
+            try:
+                self.sync()
+                self.sync_readings()
+                if is_leader():
+                    self.prune_readings()
+                    self.prune_records("alert_status", ALERT_STATUS_HISTORY)
+                    alert_digest.flush_due()
+            except Exception:
+                logger.exception("shared state sync failed")
+
+
+shared_state = SharedStateStore(STATE_DB, enabled=SHARED_STATE)
+
+
+def acquire_process_lock(path):
+    """
+    Take an exclusive, non-blocking flock on path, held until the process exits
+
+    Returns:
+        file: The open lock file (keep a reference to it), or None if another process holds the lock
+    """
+    lock_file = open(path, 'w')
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return None
+    return lock_file
+
+
+_leader_lock_file = None
+
+
+def elect_leader():
+    """
+    Become the leader process if no other worker is: the first to flock
+    <STATE_DB>.leader.lock. The leader runs the PLC poller, writes the
+    history segment files and evaluates alerts on ingested readings.
+
+    Returns:
+        bool: Whether this process is the leader
+    """
+    global _leader_lock_file
+    if _leader_lock_file is None:
+        _leader_lock_file = acquire_process_lock(f"{STATE_DB}.leader.lock")
+    return _leader_lock_file is not None
+
+
+def is_leader():
+    """Whether this process is the leader (a process without shared state is its own)."""
+    return _leader_lock_file is not None or not shared_state.enabled
+
+
+# Endpoints that read history or rolling stats apply pending journal readings first
+READING_ENDPOINTS = {'get_history', 'get_rolling_stats_all', 'get_plc_rolling_stats', 'get_plc_data'}
+
+
+@app.before_request
+def sync_shared_state():
+    shared_state.sync()
+    if request.endpoint in READING_ENDPOINTS:
+        shared_state.sync_readings()
+
+
+# ============================================================================
+# MODBUS CONNECTION POOL
+# One persistent TCP connection per PLC instead of connect/read/close per call
+# ============================================================================
+
+MODBUS_TIMEOUT = float(os.getenv('MODBUS_TIMEOUT', 3))
+MODBUS_IDLE_TIMEOUT = float(os.getenv('MODBUS_IDLE_TIMEOUT', 60))
+MODBUS_RECONNECT_DELAY = float(os.getenv('MODBUS_RECONNECT_DELAY', 0.5))  # first circuit breaker cooldown
+MODBUS_RECONNECT_DELAY_MAX = float(os.getenv('MODBUS_RECONNECT_DELAY_MAX', 30))
+MODBUS_BREAKER_THRESHOLD = int(os.getenv('MODBUS_BREAKER_THRESHOLD', 3))  # read errors before opening
+
+
+class CircuitOpenError(ConnectionError):
+    """Raised instead of contacting a PLC whose circuit breaker is open."""
+
+
+class _ConnectFailed(ConnectionError):
+    """A connect attempt failed (opens the circuit breaker at once)."""
+
+
+def modbus_error_kind(error):
+    """Classify a failed Modbus read for modbus_read_errors_total."""
+    if isinstance(error, CircuitOpenError):
+        return "circuit_open"
+    if isinstance(error, _ConnectFailed):
+        return "connect"
+    if isinstance(error.__cause__ or error, (TimeoutError, ModbusIOException)):
+        return "timeout"
+    return "error"
+
+
+class CircuitBreaker:
+    """
+    Per-PLC circuit breaker with closed, open and half_open states.
+
+    closed: calls go through. A failed connect opens the breaker at once,
+        as do `threshold` consecutive failed reads on an open connection.
+    open: calls fail immediately with CircuitOpenError until the cooldown
+        ends. The cooldown doubles with every consecutive trip, up to
+        cooldown_max.
+    half_open: the first caller after the cooldown becomes the single probe;
+        every other caller keeps failing fast until the probe closes the
+        breaker (success) or opens it again (failure).
+    """
+
+    def __init__(self, plc_id, threshold=MODBUS_BREAKER_THRESHOLD, cooldown=MODBUS_RECONNECT_DELAY,
+                 cooldown_max=MODBUS_RECONNECT_DELAY_MAX):
+        self.plc_id = plc_id
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.cooldown_max = cooldown_max
+        self.state = "closed"
+        self.failures = 0
+        self.trips = 0
+        self.open_until = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def _reject(self, now):
+        if self.state == "open":
+            raise CircuitOpenError(f"{self.plc_id} is unreachable (circuit open, retry in {self.open_until - now:.1f}s)")
+        raise CircuitOpenError(f"{self.plc_id} is unreachable (circuit half-open, probe in progress)")
+
+    def acquire(self):
+        """
+        Let a call through or reject it
+
+        Raises:
+            CircuitOpenError: While open, or half-open with a probe already in flight
+        """
+        with self._lock:
+            if self.state == "closed":
+                return
+            now = time.monotonic()
+            if self.state == "open" and now >= self.open_until:
+                self.state = "half_open"
+            if self.state == "half_open" and not self._probing:
+                self._probing = True
+                return
+            self._reject(now)
+
+    def check(self):
+        """Fail fast if a call that was queued behind another one should no longer go through."""
+        if self.state == "open":
+            with self._lock:
+                if self.state == "open":
+                    self._reject(time.monotonic())
+
+    def record_success(self):
+        with self._lock:
+            if self.state != "closed":
+                logger.info("circuit closed plc=%s trips=%d", self.plc_id, self.trips)
+            self.state = "closed"
+            self.failures = 0
+            self.trips = 0
+            self._probing = False
+
+    def record_failure(self, connect_failed=False):
+        with self._lock:
+            self._probing = False
+            self.failures += 1
+            if self.state == "closed" and not connect_failed and self.failures < self.threshold:
+                return
+            self.trips += 1
+            cooldown = min(self.cooldown * (2 ** (self.trips - 1)), self.cooldown_max)
+            self.open_until = time.monotonic() + cooldown
+            if self.state != "open":
+                logger.warning("circuit opened plc=%s failures=%d cooldown=%.1fs", self.plc_id, self.failures, cooldown)
+            self.state = "open"
+
+    def snapshot(self):
+        return {
+            "state": self.state,
+            "failures": self.failures,
+            "trips": self.trips,
+            "retry_in": round(max(0.0, self.open_until - time.monotonic()), 1) if self.state == "open" else None
+        }
+
+
+class ModbusConnectionPool:
+    """
+    Keeps one Modbus TCP connection alive per registered PLC.
+
+    Each PLC gets its own lock so reads to different PLCs never wait on each
+    other, while reads to the same PLC share (and serialize on) one socket.
+    Connections idle for longer than idle_timeout, whose socket has been
+    closed by the PLC, or whose registry settings changed are treated as
+    stale and reopened before use. Every PLC has a CircuitBreaker: once a
+    PLC is unreachable, callers fail fast instead of each waiting out the
+    connect timeout behind the same dead host, and only one probe at a
+    time tries it again.
+    """
+
+    def __init__(self, plc_config, timeout=MODBUS_TIMEOUT, idle_timeout=MODBUS_IDLE_TIMEOUT):
+        self.plc_config = plc_config
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self._connections = {}
+        self._lock = threading.Lock()
+
+    def _entry(self, plc_id):
+        entry = self._connections.get(plc_id)
+        if entry is None:
+            with self._lock:
+                entry = self._connections.setdefault(plc_id, {
+                    "client": None,
+                    "config": None,
+                    "lock": threading.Lock(),
+                    "last_used": 0.0,
+                    "breaker": CircuitBreaker(plc_id)
+                })
+        return entry
+
+    def breaker(self, plc_id):
+        """Get a PLC's CircuitBreaker (also fed by the background poller)."""
+        return self._entry(plc_id)["breaker"]
+
+    def breaker_states(self):
+        """Breaker snapshots of every PLC that is not closed."""
+        with self._lock:
+            entries = list(self._connections.items())
+        return {plc_id: entry["breaker"].snapshot() for plc_id, entry in entries if entry["breaker"].state != "closed"}
+
+    def _drop(self, entry):
+        if entry["client"] is not None:
+            try:
+                entry["client"].close()
+            except Exception:
+                pass
+        entry["client"] = None
+
+    def _is_stale(self, entry, now):
+        client = entry["client"]
+        if client is None:
+            return True
+        if now - entry["last_used"] > self.idle_timeout:
+            return True
+        return not client.is_socket_open()
+
+    def _connect(self, plc_id, entry, now):
+        config = self.plc_config[plc_id]
+        client = ModbusTcpClient(config["ip"], port=config["port"], timeout=self.timeout)
+        if not client.connect():
+            client.close()
+            raise _ConnectFailed(f"Failed to connect to {plc_id}")
+
+        entry["client"] = client
+        entry["config"] = config
+        entry["last_used"] = now
+        return client
+
+    def read_holding_registers(self, plc_id, address, count=1):
+        """
+        Read holding registers from a PLC over its pooled connection.
+
+        Args:
+            plc_id (str): Registered PLC id
+            address (int): First register address
+            count (int): Number of registers to read
+
+        Returns:
+            The pymodbus response (check isError() for Modbus exceptions)
+
+        Raises:
+            CircuitOpenError: If the PLC's circuit breaker is open (no I/O is attempted)
+            ConnectionError: If the PLC cannot be reached
+        """
+        entry = self._entry(plc_id)
+        breaker = entry["breaker"]
+        started = time.perf_counter()
+        try:
+            breaker.acquire()
+            result = self._read(plc_id, entry, address, count)
+        except Exception as e:
+            MODBUS_READ_ERRORS.inc(plc_id, "request", modbus_error_kind(e))
+            if not isinstance(e, CircuitOpenError):
+                breaker.record_failure(connect_failed=isinstance(e, _ConnectFailed))
+            raise
+        breaker.record_success()
+        MODBUS_READ_SECONDS.observe(time.perf_counter() - started, plc_id, "request")
+        return result
+
+    def _read(self, plc_id, entry, address, count):
+        config = self.plc_config[plc_id]
+        with entry["lock"]:
+            entry["breaker"].check()  # a caller ahead of us may have found the PLC dead
+            now = time.monotonic()
+            reused = entry["config"] is config and not self._is_stale(entry, now)
+            if not reused:
+                self._drop(entry)
+                self._connect(plc_id, entry, now)
+            try:
+                result = entry["client"].read_holding_registers(address, count=count, device_id=config["slave_unit"])
+            except (ModbusException, OSError) as e:
+                self._drop(entry)
+                if not reused:
+                    raise ConnectionError(f"Error reading from {plc_id}: {e}") from e
+                # The PLC may have silently closed an idle socket; retry once on a fresh one
+                logger.debug("modbus stale connection plc=%s error=%s, reconnecting", plc_id, e)
+                self._connect(plc_id, entry, time.monotonic())
+                try:
+                    result = entry["client"].read_holding_registers(address, count=count, device_id=config["slave_unit"])
+                except (ModbusException, OSError) as e2:
+                    self._drop(entry)
+                    raise ConnectionError(f"Error reading from {plc_id}: {e2}") from e2
+            entry["last_used"] = time.monotonic()
+            return result
+
+    def discard(self, plc_id):
+        """Close and forget a PLC's connection."""
+        with self._lock:
+            entry = self._connections.pop(plc_id, None)
+        if entry is not None:
+            with entry["lock"]:
+                self._drop(entry)
+
+    def close_all(self):
+        """Close every pooled connection."""
+        with self._lock:
+            entries = list(self._connections.values())
+        for entry in entries:
+            with entry["lock"]:
+                self._drop(entry)
+
+
+modbus_pool = ModbusConnectionPool(plc_registry)
+atexit.register(modbus_pool.close_all)
+
+
+@app.route('/breakers', methods=['GET'])
+def get_breakers():
+    """
+    Get the circuit breakers of PLCs that are currently unreachable (open or half-open)
+    """
+    return jsonify(modbus_pool.breaker_states()), 200
+
+
+READ_FRESHNESS = float(os.getenv('READ_FRESHNESS', 0.25))  # seconds a register read is reused by /read-plc
+
+_plc_read_times = {}  # plc_id -> time.monotonic() of the last register read
+
+
+class SingleFlight:
+    """
+    Collapses concurrent calls with the same key into one execution.
+
+    The first caller runs the function; callers that arrive while it is in
+    flight wait for it and get the same result (or exception) instead of
+    starting their own.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.stats = {"calls": 0, "shared": 0}
+
+    def do(self, key, func, *args):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = {"done": threading.Event(), "result": None, "error": None}
+                self.stats["calls"] += 1
+            else:
+                self.stats["shared"] += 1
+
+        if not leader:
+            call["done"].wait()
+            if call["error"] is not None:
+                raise call["error"]
+            return call["result"]
+
+        try:
+            call["result"] = func(*args)
+            return call["result"]
+        except BaseException as e:
+            call["error"] = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call["done"].set()
+
+
+plc_reads = SingleFlight()
+
+
+def store_plc_reading(plc_id, values):
+    """
+    Build a reading from decoded register values and publish it to the state
+
+    Args:
+        plc_id (str): Registered PLC id
+        values (dict): Decoded register map values (see decode_register_blocks)
+
+    Returns:
+        dict: The stored reading
+    """
+    register_map = plc_registry.get(plc_id, {}).get("registers", DEFAULT_REGISTER_MAP)
+    data = {
+        "temperature": values.get("temperature"),
+        "plc": plc_id,
+        "register": register_map.get("temperature", {}).get("address", "N/A"),
+        "values": values,
+        "timestamp": datetime.now().isoformat()
+    }
+    state.update(plc_data={plc_id: data}, latest_reading=data)
+    _plc_read_times[plc_id] = time.monotonic()
+    PLC_LAST_READING.set(time.time(), plc_id)
+    record_reading(plc_id, data["temperature"])
+    return data
+
+
+def read_plc_temperature(plc_id):
+    """
+    Read current temperature (and the rest of the PLC's register map) from PLC
+    over its pooled Modbus connection, one block read per contiguous range
+
+    A reading taken (by any caller or the poller) within the last
+    READ_FRESHNESS seconds is returned from plc_data without I/O, and
+    concurrent calls for the same PLC share one in-flight read.
+    """
+    if plc_id not in plc_registry:
+        return None
+
+    read_at = _plc_read_times.get(plc_id)
+    if read_at is not None and time.monotonic() - read_at < READ_FRESHNESS:
+        data = state.snapshot.plc_data.get(plc_id)
+        if data is not None:
+            return data
+    return plc_reads.do(plc_id, _read_plc_registers, plc_id)
+
+
+def _read_plc_registers(plc_id):
+    try:
+        plan = get_register_plan(plc_id)
+        block_registers = []
+        for block in plan:
+            result = modbus_pool.read_holding_registers(plc_id, block["address"], count=block["count"])
+            if result.isError():
+                MODBUS_READ_ERRORS.inc(plc_id, "request", "exception_response")
+                logger.error("modbus read error plc=%s registers=%d-%d", plc_id,
+                             block["address"], block["address"] + block["count"] - 1)
+                return None
+            block_registers.append(result.registers)
+        data = store_plc_reading(plc_id, decode_register_blocks(plan, block_registers))
+        logger.info("plc read plc=%s temperature=%s", plc_id, data["temperature"])
+        return data
+    except CircuitOpenError as e:
+        logger.debug("plc read skipped plc=%s reason=%s", plc_id, e)
+        return None
+    except Exception as e:
+        logger.error("plc read failed plc=%s error=%s", plc_id, e)
+        return None
+
+# ============================================================================
+# BACKGROUND PLC POLLER
+# Reads every PLC concurrently on an asyncio loop so GET handlers never do I/O
+# ============================================================================
+
+POLLER_ENABLED = os.getenv('POLLER_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+POLL_INTERVAL = float(os.getenv('POLL_INTERVAL', 5))
+POLL_TIMEOUT = float(os.getenv('POLL_TIMEOUT', 2))
+POLL_CONCURRENCY = int(os.getenv('POLL_CONCURRENCY', 100))
+POLL_GATEWAY_CONCURRENCY = int(os.getenv('POLL_GATEWAY_CONCURRENCY', 4))  # in-flight reads per ip:port
+POLL_FAST_INTERVAL = float(os.getenv('POLL_FAST_INTERVAL', 1))  # for PLCs near or above threshold
+POLL_NEAR_THRESHOLD = float(os.getenv('POLL_NEAR_THRESHOLD', 2))  # °C below threshold that counts as near
+POLL_BACKOFF_MAX = float(os.getenv('POLL_BACKOFF_MAX', 300))  # longest interval for unreachable PLCs
+POLL_LAG_SAMPLES = 1000
+
+
+class PlcPoller:
+    """
+    Polls all registered PLCs on a background thread running an asyncio loop.
+
+    A heap keyed by next-due time schedules each PLC on its own interval:
+    its poll_interval (default POLL_INTERVAL), shortened to
+    POLL_FAST_INTERVAL while the last reading is within POLL_NEAR_THRESHOLD
+    of its threshold or above it, and doubled per consecutive failure (up
+    to POLL_BACKOFF_MAX) while it is unreachable. Due PLCs are read
+    concurrently over their own persistent AsyncModbusTcpClient, bounded by
+    POLL_CONCURRENCY in-flight reads overall and POLL_GATEWAY_CONCURRENCY
+    per gateway (ip:port), each with a per-device timeout. PLCs added to
+    or removed from the registry are picked up on the next wake-up.
+
+    Scheduler lag (how late a PLC was started after it became due) and the
+    queue depth are reported in stats for GET /poller.
+    """
+
+    def __init__(self, plc_config, interval=POLL_INTERVAL, timeout=POLL_TIMEOUT, concurrency=POLL_CONCURRENCY,
+                 gateway_concurrency=POLL_GATEWAY_CONCURRENCY):
+        self.plc_config = plc_config
+        self.interval = interval
+        self.timeout = timeout
+        self.concurrency = concurrency
+        self.gateway_concurrency = gateway_concurrency
+        self._clients = {}
+        self._client_configs = {}
+        self._heap = []  # (due, plc_id); entries not matching _scheduled are stale
+        self._scheduled = {}  # plc_id -> due
+        self._intervals = {}  # plc_id -> (interval, reason)
+        self._failures = {}
+        self._in_flight = set()
+        self._tasks = set()
+        self._gateways = {}
+        self._lags = deque(maxlen=POLL_LAG_SAMPLES)
+        self._devices = None
+        self._thread = None
+        self._loop = None
+        self._wakeup = None
+        self._stopping = False
+        self.stats = {
+            "running": False,
+            "polls": 0,
+            "last_errors": {}
+        }
+
+    def start(self):
+        """Start the polling thread (no-op if already running)."""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stopping = False
+        self._thread = threading.Thread(target=self._thread_main, name="plc-poller", daemon=True)
+        self._thread.start()
+        logger.info("poller started plcs=%d interval=%ss timeout=%ss", len(self.plc_config), self.interval, self.timeout)
+
+    def stop(self):
+        """Ask the polling loop to exit and wait for it."""
+        self._stopping = True
+        if self._loop and self._wakeup:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+        if self._thread:
+            self._thread.join(timeout=self.timeout + 1)
+
+    def _thread_main(self):
+        asyncio.run(self._run())
+
+    async def _run(self):
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        semaphore = asyncio.Semaphore(self.concurrency)
+        self.stats["running"] = True
+        try:
+            while not self._stopping:
+                shared_state.sync()  # pick up thresholds and registry edits from other workers
+                self._sync_devices()
+                now = time.monotonic()
+                while self._heap and self._heap[0][0] <= now:
+                    due, plc_id = heapq.heappop(self._heap)
+                    if self._scheduled.get(plc_id) != due:
+                        continue
+                    del self._scheduled[plc_id]
+                    self._lags.append(now - due)
+                    self._in_flight.add(plc_id)
+                    task = asyncio.create_task(self._poll_and_reschedule(plc_id, semaphore))
+                    self._tasks.add(task)
+                    task.add_done_callback(self._tasks.discard)
+
+                self._wakeup.clear()
+                timeout = self._heap[0][0] - now if self._heap else self.interval
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=max(0.0, timeout))
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            for task in list(self._tasks):
+                task.cancel()
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+            for client in self._clients.values():
+                client.close()
+            self._clients.clear()
+            self._heap.clear()
+            self._scheduled.clear()
+            self._in_flight.clear()
+            self._devices = None
+            self.stats["running"] = False
+
+    def _schedule(self, plc_id, due):
+        self._scheduled[plc_id] = due
+        heapq.heappush(self._heap, (due, plc_id))
+        if self._wakeup is not None and self._heap[0] == (due, plc_id):
+            self._wakeup.set()  # due before whatever the loop is sleeping towards
+
+    def _sync_devices(self):
+        """Schedule newly registered PLCs and forget removed ones (only when the registry changed)."""
+        devices = getattr(self.plc_config, "devices", self.plc_config)
+        if devices is self._devices:
+            return
+        self._devices = devices
+        now = time.monotonic()
+        for plc_id in devices:
+            if plc_id not in self._scheduled and plc_id not in self._in_flight:
+                self._schedule(plc_id, now)
+        for plc_id in [plc_id for plc_id in self._scheduled if plc_id not in devices]:
+            del self._scheduled[plc_id]  # heap entry goes stale
+            self._forget(plc_id)
+
+    def _forget(self, plc_id):
+        self._intervals.pop(plc_id, None)
+        self._failures.pop(plc_id, None)
+        self._client_configs.pop(plc_id, None)
+        self.stats["last_errors"].pop(plc_id, None)
+        write_back.forget(plc_id)
+        client = self._clients.pop(plc_id, None)
+        if client is not None:
+            client.close()
+
+    def _gateway_semaphore(self, config):
+        key = (config["ip"], config["port"])
+        gateway = self._gateways.get(key)
+        if gateway is None:
+            gateway = self._gateways[key] = asyncio.Semaphore(self.gateway_concurrency)
+        return gateway
+
+    def next_interval(self, plc_id, config, data):
+        """
+        Seconds until a PLC's next poll, from its last poll result
+
+        Returns:
+            tuple: (interval, reason) with reason 'backoff', 'alarm', 'near' or 'normal'
+        """
+        interval = config.get("poll_interval") or self.interval
+        if data is None:
+            failures = self._failures[plc_id] = self._failures.get(plc_id, 0) + 1
+            return min(max(interval, interval * 2 ** (failures - 1)), POLL_BACKOFF_MAX), "backoff"
+        self._failures.pop(plc_id, None)
+
+        temperature = data.get("temperature")
+        threshold = state.snapshot.threshold_config.get(f"{plc_id.lower()}_threshold")
+        if isinstance(temperature, (int, float)) and threshold is not None:
+            if temperature > threshold:
+                return min(interval, POLL_FAST_INTERVAL), "alarm"
+            if temperature >= threshold - POLL_NEAR_THRESHOLD:
+                return min(interval, POLL_FAST_INTERVAL), "near"
+        return interval, "normal"
+
+    async def _poll_and_reschedule(self, plc_id, semaphore):
+        data = None
+        try:
+            config = self.plc_config.get(plc_id)
+            if config is None:
+                return
+            async with self._gateway_semaphore(config):
+                data = await self._poll_plc(plc_id, semaphore)
+            self.stats["polls"] += 1
+        except Exception as e:
+            logger.error("poll task failed plc=%s error=%s", plc_id, e, exc_info=True)
+        finally:
+            self._in_flight.discard(plc_id)
+            config = self.plc_config.get(plc_id)
+            if config is None:
+                self._forget(plc_id)  # removed from the registry while this poll was in flight
+            elif not self._stopping:
+                interval, reason = self.next_interval(plc_id, config, data)
+                self._intervals[plc_id] = (interval, reason)
+                self._schedule(plc_id, time.monotonic() + interval)
+
+    def scheduler_stats(self):
+        """Queue depth, in-flight reads, lag and interval reasons of the scheduler."""
+        now = time.monotonic()
+        lags = sorted(self._lags)
+        reasons = {}
+        for _, reason in list(self._intervals.values()):
+            reasons[reason] = reasons.get(reason, 0) + 1
+        return {
+            "queue_depth": len(self._scheduled),
+            "due": sum(1 for due in list(self._scheduled.values()) if due <= now),
+            "in_flight": len(self._in_flight),
+            "lag_ms": {
+                "avg": round(sum(lags) / len(lags) * 1000, 1) if lags else None,
+                "p99": round(lags[int(len(lags) * 0.99)] * 1000, 1) if lags else None,
+                "max": round(lags[-1] * 1000, 1) if lags else None
+            },
+            "intervals": reasons
+        }
+
+    async def _client(self, plc_id, config):
+        client = self._clients.get(plc_id)
+        if client is not None and client.connected and self._client_configs.get(plc_id) is config:
+            return client
+        if client is not None:
+            client.close()
+        # Reconnects are driven by the poll cycle itself, not pymodbus
+        client = AsyncModbusTcpClient(config["ip"], port=config["port"], timeout=self.timeout,
+                                      retries=0, reconnect_delay=0)
+        self._clients[plc_id] = client
+        self._client_configs[plc_id] = config
+        if not await client.connect():
+            raise _ConnectFailed(f"Failed to connect to {plc_id}")
+        return client
+
+    async def _poll_plc(self, plc_id, semaphore):
+        config = self.plc_config.get(plc_id)
+        if config is None:
+            return None
+        async with semaphore:
+            error_kind = None
+            try:
+                client = await asyncio.wait_for(self._client(plc_id, config), timeout=self.timeout)
+                plan = get_register_plan(plc_id)
+                started = time.perf_counter()
+                block_registers = []
+                for block in plan:
+                    result = await asyncio.wait_for(
+                        client.read_holding_registers(block["address"], count=block["count"],
+                                                      device_id=config["slave_unit"]),
+                        timeout=self.timeout
+                    )
+                    if result.isError():
+                        error_kind = "exception_response"
+                        raise ModbusException(f"Modbus error reading from {plc_id}")
+                    block_registers.append(result.registers)
+                MODBUS_READ_SECONDS.observe(time.perf_counter() - started, plc_id, "poller")
+            except Exception as e:
+                client = self._clients.pop(plc_id, None)
+                if client is not None:
+                    client.close()
+                MODBUS_READ_ERRORS.inc(plc_id, "poller", error_kind or modbus_error_kind(e))
+                # Let /read-plc fail fast on PLCs the poller already found dead
+                modbus_pool.breaker(plc_id).record_failure(connect_failed=isinstance(e, _ConnectFailed))
+                error = str(e) or type(e).__name__
+                if self.stats["last_errors"].get(plc_id) != error:
+                    logger.error("poll failed plc=%s error=%s", plc_id, error)
+                self.stats["last_errors"][plc_id] = error
+                return None
+
+            if self.stats["last_errors"].pop(plc_id, None) is not None:
+                logger.info("poll recovered plc=%s", plc_id)
+            modbus_pool.breaker(plc_id).record_success()
+            values = decode_register_blocks(plan, block_registers)
+            data = store_plc_reading(plc_id, values)
+            logger.debug("poll read plc=%s temperature=%s", plc_id, data["temperature"])
+
+            # Push changed setpoints/thresholds over the same connection
+            try:
+                await write_back.flush(plc_id, client, config["slave_unit"], values, self.timeout)
+            except Exception as e:
+                logger.error("write-back failed plc=%s error=%s", plc_id, str(e) or type(e).__name__)
+                self._clients.pop(plc_id, None)
+                client.close()
+            return data
+
+
+plc_poller = PlcPoller(plc_registry)
+
+
+@app.route('/poller', methods=['GET'])
+def get_poller_status():
+    """
+    Get background poller status and scheduler queue depth and lag
+    """
+    return jsonify({
+        "enabled": POLLER_ENABLED,
+        "interval": plc_poller.interval,
+        "timeout": plc_poller.timeout,
+        **plc_poller.stats,
+        "scheduler": plc_poller.scheduler_stats()
+    }), 200
+
+
+# ============================================================================
+# SETPOINT / THRESHOLD WRITE-BACK
+# Server-side values are written to the PLCs once per poll cycle
+# ============================================================================
+
+# register map field -> threshold_config key template
+WRITEBACK_FIELDS = {
+    "setpoint": "{plc}_setpoint",
+    "threshold": "{plc}_threshold"
+}
+
+
+class WriteBackEngine:
+    """
+    Writes threshold_config setpoints/thresholds to PLCs with writable
+    register map fields.
+
+    The engine remembers the register values last confirmed on each PLC.
+    After every poll of a PLC it compares them with the encoding of the
+    current threshold_config values; whatever differs is dirty. Dirty fields
+    in adjacent registers go out in one write_registers call on the poller's
+    connection, followed by a read-back. The registers only count as
+    confirmed when the read-back matches, otherwise they stay dirty and are
+    retried after the next poll. Any number of updates between two polls
+    results in a single write of the latest value.
+
+    Confirmed values are seeded from the first poll of each PLC, so fields
+    that already hold the server's value are not rewritten after a restart.
+    """
+
+    def __init__(self):
+        self._confirmed = {}
+        self.stats = {}
+
+    def forget(self, plc_id):
+        """Drop a removed PLC's confirmed registers and stats."""
+        self._confirmed.pop(plc_id, None)
+        self.stats.pop(plc_id, None)
+
+    def _plc_stats(self, plc_id):
+        return self.stats.setdefault(plc_id, {
+            "writes": 0,
+            "confirmed": 0,
+            "mismatches": 0,
+            "last_write_at": None,
+            "last_error": None,
+            "pending": {}
+        })
+
+    def dirty_fields(self, plc_id, polled_values):
+        """
+        Fields whose desired registers differ from the confirmed ones
+
+        Returns:
+            list: [(field, spec, value, registers), ...] sorted by address
+        """
+        register_map = plc_registry.get(plc_id, {}).get("registers", DEFAULT_REGISTER_MAP)
+        threshold_config = state.snapshot.threshold_config
+        confirmed = self._confirmed.setdefault(plc_id, {})
+        dirty = []
+        for field_name, key_template in WRITEBACK_FIELDS.items():
+            spec = register_map.get(field_name)
+            if not spec or not spec.get("writable"):
+                continue
+            desired = threshold_config.get(key_template.format(plc=plc_id.lower()))
+            if desired is None:
+                continue
+            if field_name not in confirmed and polled_values.get(field_name) is not None:
+                confirmed[field_name] = encode_register_value(spec, polled_values[field_name])
+            registers = encode_register_value(spec, desired)
+            if confirmed.get(field_name) != registers:
+                dirty.append((field_name, spec, desired, registers))
+        dirty.sort(key=lambda item: int(item[1]["address"]))
+        return dirty
+
+    async def flush(self, plc_id, client, device_id, polled_values, timeout):
+        """
+        Write and confirm a PLC's dirty fields over an open async client
+        """
+        dirty = self.dirty_fields(plc_id, polled_values)
+        stats = self._plc_stats(plc_id)
+        stats["pending"] = {field_name: value for field_name, _, value, _ in dirty}
+        if not dirty:
+            return
+
+        # Merge fields with adjacent registers into runs, one write_registers call each
+        runs = []
+        for field_name, spec, value, registers in dirty:
+            address = int(spec["address"])
+            if runs and runs[-1]["address"] + len(runs[-1]["registers"]) == address:
+                runs[-1]["registers"].extend(registers)
+                runs[-1]["fields"].append((field_name, value, registers))
+            else:
+                runs.append({"address": address, "registers": list(registers), "fields": [(field_name, value, registers)]})
+
+        confirmed = self._confirmed.setdefault(plc_id, {})
+        for run in runs:
+            result = await asyncio.wait_for(
+                client.write_registers(run["address"], run["registers"], device_id=device_id), timeout=timeout
+            )
+            stats["writes"] += 1
+            stats["last_write_at"] = datetime.now().isoformat()
+            if result.isError():
+                stats["last_error"] = f"Modbus error writing registers {run['address']}"
+                raise ModbusException(stats["last_error"])
+
+            readback = await asyncio.wait_for(
+                client.read_holding_registers(run["address"], count=len(run["registers"]), device_id=device_id),
+                timeout=timeout
+            )
+            if readback.isError() or list(readback.registers) != run["registers"]:
+                stats["mismatches"] += 1
+                stats["last_error"] = f"Read-back mismatch at register {run['address']}"
+                logger.warning("write-back unconfirmed plc=%s address=%d", plc_id, run["address"])
+                continue
+
+            for field_name, value, registers in run["fields"]:
+                confirmed[field_name] = registers
+                stats["pending"].pop(field_name, None)
+                stats["confirmed"] += 1
+                logger.info("write-back confirmed plc=%s field=%s value=%s", plc_id, field_name, value)
+            stats["last_error"] = None
+
+
+write_back = WriteBackEngine()
+
+
+@app.route('/writeback', methods=['GET'])
+def get_writeback_status():
+    """
+    Get setpoint/threshold write-back status per PLC (pending values, writes, confirmations)
+    """
+    return jsonify({
+        "enabled": POLLER_ENABLED,
+        "plcs": write_back.stats
+    }), 200
+
+
+# ============================================================================
+# READING HISTORY
+# Per-PLC ring buffers of (timestamp, temperature) with optional on-disk segments
+# ============================================================================
+
+# Readings kept in memory per PLC: 16 bytes each, so the default (24 h at the 5 s
+# poll interval) is ~276 KB per PLC once full, ~83 MB for 300 PLCs per process.
+# Older readings stay available from the segment files when HISTORY_DIR is set.
+HISTORY_CAPACITY = int(os.getenv('HISTORY_CAPACITY', 17280))
+HISTORY_DIR = os.getenv('HISTORY_DIR')  # enables on-disk segment files when set
+HISTORY_SEGMENT_MAX_BYTES = int(os.getenv('HISTORY_SEGMENT_MAX_BYTES', 64 * 1024 * 1024))
+HISTORY_DEFAULT_STEP = float(os.getenv('HISTORY_DEFAULT_STEP', 60))
+HISTORY_MAX_BUCKETS = int(os.getenv('HISTORY_MAX_BUCKETS', 10000))
+HISTORY_EXPORT_CHUNK = int(os.getenv('HISTORY_EXPORT_CHUNK', 8192))  # readings per streamed chunk
+
+HISTORY_RECORD = struct.Struct('<dd')  # epoch seconds, temperature
+
+
+class _RingView:
+    """Read-only sequence over a ring buffer array in oldest-first order (for bisect)."""
+
+    __slots__ = ("data", "first", "size", "capacity")
+
+    def __init__(self, data, first, size, capacity):
+        self.data = data
+        self.first = first
+        self.size = size
+        self.capacity = capacity
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, index):
+        return self.data[(self.first + index) % self.capacity]
+
+
+class HistoryBuffer:
+    """
+    Fixed-capacity history of one PLC's readings.
+
+    Timestamps and values live in two array('d') ring buffers (16 bytes per
+    reading) that grow on demand up to capacity, so idle or new PLCs cost
+    next to nothing. With segment_path set the buffer is loaded from the
+    segment files (when load is true) and exports read them. The writer,
+    the leader process (see elect_leader), also appends every reading to
+    the segment, rotating it to <segment_path>.1 once it exceeds
+    HISTORY_SEGMENT_MAX_BYTES; the shared reading journal gives it the
+    readings ingested by every worker.
+    """
+
+    def __init__(self, capacity=HISTORY_CAPACITY, segment_path=None, writer=True, load=True):
+        self.capacity = capacity
+        self.timestamps = array('d')
+        self.values = array('d')
+        self.head = 0  # next write position (== size until the ring is full)
+        self.size = 0
+        self.total = 0  # readings ever appended; logical index of the next one
+        self.segment_path = segment_path
+        self._segment = None
+        self._lock = threading.Lock()
+        if segment_path:
+            if load:
+                self._load_segment()
+            if writer:
+                self._segment = open(segment_path, 'ab')
+
+    def _load_segment(self):
+        if not os.path.exists(self.segment_path):
+            return
+        record_size = HISTORY_RECORD.size
+        with open(self.segment_path, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            length = f.tell() - f.tell() % record_size  # ignore a torn trailing record
+            start = max(0, length - self.capacity * record_size)
+            f.seek(start)
+            raw = f.read(length - start)
+        for timestamp, value in HISTORY_RECORD.iter_unpack(raw):
+            self._append(timestamp, value)
+        logger.info("history loaded records=%d path=%s", self.size, self.segment_path)
+
+    def _append(self, timestamp, value):
+        if self.size and timestamp < self.timestamps[self.head - 1]:
+            timestamp = self.timestamps[self.head - 1]  # keep the buffer sorted for bisect
+        if self.size < self.capacity:
+            self.timestamps.append(timestamp)
+            self.values.append(value)
+        else:
+            self.timestamps[self.head] = timestamp
+            self.values[self.head] = value
+        self.head = (self.head + 1) % self.capacity
+        if self.size < self.capacity:
+            self.size += 1
+        self.total += 1
+        return timestamp
+
+    def append(self, timestamp, value):
+        """Record one reading (epoch seconds, temperature)."""
+        with self._lock:
+            timestamp = self._append(timestamp, value)
+            if self._segment is not None:
+                self._segment.write(HISTORY_RECORD.pack(timestamp, value))
+                if self._segment.tell() >= HISTORY_SEGMENT_MAX_BYTES:
+                    self._rotate_segment()
+
+    def _rotate_segment(self):
+        self._segment.close()
+        os.replace(self.segment_path, self.segment_path + '.1')
+        self._segment = open(self.segment_path, 'ab')
+
+    def flush(self):
+        with self._lock:
+            if self._segment is not None:
+                self._segment.flush()
+
+    def _slice(self, array_, start, stop):
+        """Copy logical positions [start, stop) out of a ring array."""
+        first = (self.head - self.size) % self.capacity
+        lo = (first + start) % self.capacity
+        count = stop - start
+        if lo + count <= self.capacity:
+            return array_[lo:lo + count]
+        return array_[lo:] + array_[:count - (self.capacity - lo)]
+
+    def query(self, start, end, step):
+        """
+        Aggregate readings in [start, end) into buckets of step seconds.
+
+        Bucket boundaries are located with bisect and each bucket is reduced
+        with the C-level min/max/sum over an array slice, so the cost is one
+        pass over the matching readings rather than per-reading Python work.
+
+        Returns:
+            list: [{"start", "min", "max", "avg", "count"}, ...] (empty buckets omitted)
+        """
+        with self._lock:
+            first = (self.head - self.size) % self.capacity
+            view = _RingView(self.timestamps, first, self.size, self.capacity)
+            lo = bisect.bisect_left(view, start)
+            hi = bisect.bisect_left(view, end)
+            timestamps = self._slice(self.timestamps, lo, hi)
+            values = self._slice(self.values, lo, hi)
+
+        buckets = []
+        index = 0
+        while index < len(timestamps):
+            bucket_start = start + ((timestamps[index] - start) // step) * step
+            stop = bisect.bisect_left(timestamps, bucket_start + step, index)
+            chunk = values[index:stop]
+            buckets.append({
+                "start": bucket_start,
+                "min": min(chunk),
+                "max": max(chunk),
+                "avg": round(sum(chunk) / len(chunk), 3),
+                "count": len(chunk)
+            })
+            index = stop
+        return buckets
+
+    def recent(self, seconds):
+        """(timestamps, values) arrays of the readings within `seconds` of the newest one."""
+        with self._lock:
+            if not self.size:
+                return array('d'), array('d')
+            first = (self.head - self.size) % self.capacity
+            view = _RingView(self.timestamps, first, self.size, self.capacity)
+            lo = bisect.bisect_left(view, view[self.size - 1] - seconds)
+            return self._slice(self.timestamps, lo, self.size), self._slice(self.values, lo, self.size)
+
+    def iter_range(self, start, end, chunk_size=HISTORY_EXPORT_CHUNK):
+        """
+        Yield (timestamps, values) arrays of the readings in [start, end),
+        oldest first, at most chunk_size readings at a time.
+
+        With segment files the export reads them (they reach further back than
+        the ring buffer); otherwise it walks the ring buffer, skipping readings
+        that are overwritten while the export is in progress.
+        """
+        if self.segment_path:
+            yield from self._iter_segments(start, end, chunk_size)
+        else:
+            yield from self._iter_ring(start, end, chunk_size)
+
+    def _iter_ring(self, start, end, chunk_size):
+        with self._lock:
+            first = (self.head - self.size) % self.capacity
+            view = _RingView(self.timestamps, first, self.size, self.capacity)
+            oldest = self.total - self.size
+            position = oldest + bisect.bisect_left(view, start)
+            stop = oldest + bisect.bisect_left(view, end)
+        while position < stop:
+            with self._lock:
+                oldest = self.total - self.size
+                position = max(position, oldest)
+                count = min(chunk_size, stop - position)
+                if count <= 0:
+                    return
+                offset = position - oldest
+                timestamps = self._slice(self.timestamps, offset, offset + count)
+                values = self._slice(self.values, offset, offset + count)
+            position += count
+            yield timestamps, values
+
+    def _iter_segments(self, start, end, chunk_size):
+        record_size = HISTORY_RECORD.size
+        with self._lock:
+            # Open both files under the lock so a rotation cannot slip in between;
+            # sizes are captured now so the export stops at the current end
+            if self._segment is not None:
+                self._segment.flush()
+            segments = []
+            for path in (self.segment_path + '.1', self.segment_path):
+                try:
+                    f = open(path, 'rb')
+                except FileNotFoundError:
+                    continue
+                segments.append((f, os.fstat(f.fileno()).st_size // record_size))
+
+        try:
+            for f, count in segments:
+                position = self._bisect_segment(f, count, start)
+                f.seek(position * record_size)
+                while position < count:
+                    n = min(chunk_size, count - position)
+                    timestamps = array('d')
+                    values = array('d')
+                    for timestamp, value in HISTORY_RECORD.iter_unpack(f.read(n * record_size)):
+                        if timestamp >= end:
+                            break
+                        timestamps.append(timestamp)
+                        values.append(value)
+                    if timestamps:
+                        yield timestamps, values
+                    if len(timestamps) < n:
+                        return
+                    position += n
+        finally:
+            for f, _ in segments:
+                f.close()
+
+    @staticmethod
+    def _bisect_segment(f, count, target):
+        """Index of the first record in a segment file with timestamp >= target."""
+        lo, hi = 0, count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            f.seek(mid * HISTORY_RECORD.size)
+            if HISTORY_RECORD.unpack(f.read(HISTORY_RECORD.size))[0] < target:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+
+history_store = {}
+_history_lock = threading.Lock()
+
+
+def get_history_buffer(plc_id, load=None):
+    """
+    Get (creating on first use) the history buffer for a PLC
+
+    Args:
+        load (bool): Whether a new buffer loads the PLC's segment files; by
+                     default only without shared state. With shared state
+                     load_history loads them at startup, and a buffer created
+                     later gets its readings from the journal instead.
+    """
+    buffer = history_store.get(plc_id)
+    if buffer is None:
+        with _history_lock:
+            buffer = history_store.get(plc_id)
+            if buffer is None:
+                segment_path = None
+                if HISTORY_DIR:
+                    os.makedirs(HISTORY_DIR, exist_ok=True)
+                    segment_path = os.path.join(HISTORY_DIR, f"{plc_id}.seg")
+                if load is None:
+                    load = not shared_state.enabled
+                buffer = HistoryBuffer(segment_path=segment_path, writer=is_leader(), load=load)
+                history_store[plc_id] = buffer
+    return buffer
+
+
+def load_history():
+    """
+    Load the history of every PLC with segment files in HISTORY_DIR and
+    seed its rolling statistics from the readings still inside their
+    windows (at startup, before this process applies journal readings)
+    """
+    global rolling_stats_version
+    if not HISTORY_DIR or not os.path.isdir(HISTORY_DIR):
+        return
+    horizon = max(*ROLLING_WINDOWS, ROLLING_SLOPE_WINDOW, ALERT_SUSTAIN_WINDOW)
+    for name in sorted(os.listdir(HISTORY_DIR)):
+        if name.endswith('.seg'):
+            plc_id = name[:-len('.seg')]
+            timestamps, values = get_history_buffer(plc_id, load=True).recent(horizon)
+            stats = get_rolling_stats(plc_id)
+            for timestamp, value in zip(timestamps, values):
+                stats.update(timestamp, value)
+    rolling_stats_version = object()
+
+
+def reading_timestamp(timestamp, now):
+    """
+    When a reading was taken, in epoch seconds
+
+    Args:
+        timestamp: Epoch seconds or ISO-8601 as sent by the device; missing,
+                   invalid, non-positive, future or out-of-range values mean now
+        now: Current time in epoch seconds
+    """
+    try:
+        timestamp = parse_time_param(timestamp, now)
+    except (TypeError, ValueError, OverflowError):
+        return now
+    if not 0 < timestamp <= now:
+        return now
+    return timestamp
+
+
+def record_readings(readings):
+    """
+    Record ingested readings in history and rolling statistics and check
+    them against the PLC thresholds (non-numeric temperatures are skipped).
+    With shared state they go through the reading journal, which applies
+    them in every worker.
+
+    Args:
+        readings (list): [(plc_id, temperature, timestamp), ...] where timestamp
+                         is when the reading was taken (see reading_timestamp)
+    """
+    now = time.time()
+    rows = []
+    for plc_id, temperature, timestamp in readings:
+        try:
+            value = float(temperature)
+        except (TypeError, ValueError):
+            continue
+        rows.append((plc_id, reading_timestamp(timestamp, now), value))
+    if shared_state.enabled:
+        shared_state.append_readings(rows)
+    else:
+        apply_readings(rows)
+
+
+def record_reading(plc_id, temperature, timestamp=None):
+    """Record one ingested reading (see record_readings)."""
+    record_readings([(plc_id, temperature, timestamp)])
+
+
+def apply_readings(readings):
+    """
+    Append readings [(plc_id, timestamp, value), ...] to history and rolling
+    statistics. The leader also writes them to the segment files and
+    evaluates ingest alerts, so each reading is stored and alerted on once.
+    """
+    global rolling_stats_version
+    leader = is_leader()
+    touched = {}
+    checks = []
+    for plc_id, timestamp, value in readings:
+        buffer = touched.get(plc_id)
+        if buffer is None:
+            buffer = touched[plc_id] = get_history_buffer(plc_id)
+        buffer.append(timestamp, value)
+        get_rolling_stats(plc_id).update(timestamp, value)
+        if leader:
+            check = ingest_alert_check(plc_id, value)
+            if check is not None:
+                checks.append(check)
+    rolling_stats_version = object()
+    if leader and shared_state.enabled:
+        for buffer in touched.values():
+            buffer.flush()  # exports in the other workers read the segment files
+    if checks:
+        evaluate_ingest_alerts(checks)
+
+
+def _flush_history():
+    for buffer in list(history_store.values()):
+        buffer.flush()
+
+
+atexit.register(_flush_history)
+
+
+def parse_time_param(value, default):
+    """
+    Parse a query-string time as epoch seconds or ISO-8601
+    """
+    if value is None or value == '':
+        return default
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+
+@app.route('/history/<plc_id>', methods=['GET'])
+def get_history(plc_id):
+    """
+    Get downsampled temperature history for a PLC
+    Query params:
+        from: range start, epoch seconds or ISO-8601 (default: one hour before 'to')
+        to: range end, epoch seconds or ISO-8601 (default: now)
+        step: bucket width in seconds (default: HISTORY_DEFAULT_STEP)
+    """
+    plc_id = plc_id.upper()
+    if plc_id not in plc_registry:
+        return jsonify({"status": "error", "message": "Invalid PLC ID"}), 404
+    try:
+        end = parse_time_param(request.args.get('to'), time.time())
+        start = parse_time_param(request.args.get('from'), end - 3600)
+        step = float(request.args.get('step', HISTORY_DEFAULT_STEP))
+    except ValueError as e:
+        return jsonify({"status": "error", "message": f"Invalid query parameter: {e}"}), 400
+
+    if step <= 0 or end <= start:
+        return jsonify({"status": "error", "message": "Require step > 0 and from < to"}), 400
+    if (end - start) / step > HISTORY_MAX_BUCKETS:
+        return jsonify({"status": "error", "message": f"Range/step exceeds {HISTORY_MAX_BUCKETS} buckets"}), 400
+
+    buckets = get_history_buffer(plc_id).query(start, end, step)
+    return jsonify({
+        "plc": plc_id,
+        "from": start,
+        "to": end,
+        "step": step,
+        "buckets": buckets
+    }), 200
+
+
+EXPORT_FORMATS = {
+    "csv": ("text/csv", "csv"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+
+
+def _export_csv(plc_ids, start, end):
+    """Yield CSV text, one chunk per history chunk"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    writer.writerow(("plc", "timestamp", "temperature"))
+    yield buffer.getvalue()
+    for plc_id in plc_ids:
+        for timestamps, values in get_history_buffer(plc_id).iter_range(start, end):
+            buffer.seek(0)
+            buffer.truncate()
+            writer.writerows(
+                (plc_id, datetime.fromtimestamp(timestamp).isoformat(), value)
+                for timestamp, value in zip(timestamps, values)
+            )
+            yield buffer.getvalue()
+
+
+class _ChunkSink:
+    """Write-only file object that collects what ParquetWriter writes until drained."""
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+def _export_parquet(plc_ids, start, end):
+    """Yield a Parquet file, one row group per history chunk"""
+    schema = pyarrow.schema([
+        ("plc", pyarrow.string()),
+        ("timestamp", pyarrow.timestamp('us')),
+        ("temperature", pyarrow.float64()),
+    ])
+    sink = _ChunkSink()
+    writer = pyarrow.parquet.ParquetWriter(sink, schema)
+    try:
+        for plc_id in plc_ids:
+            for timestamps, values in get_history_buffer(plc_id).iter_range(start, end):
+                writer.write_table(pyarrow.table({
+                    "plc": pyarrow.array([plc_id] * len(timestamps), pyarrow.string()),
+                    "timestamp": pyarrow.array([int(t * 1_000_000) for t in timestamps], pyarrow.timestamp('us')),
+                    "temperature": pyarrow.array(values, pyarrow.float64()),
+                }, schema=schema))
+                yield sink.drain()
+    finally:
+        writer.close()
+    yield sink.drain()  # footer
+
+
+@app.route('/history/export', methods=['GET'])
+def export_history():
+    """
+    Stream raw readings as CSV or Parquet (chunked; memory use does not grow with the range)
+    Query params:
+        plc: comma-separated PLC IDs (default: all registered PLCs)
+        from: range start, epoch seconds or ISO-8601 (default: one hour before 'to')
+        to: range end, epoch seconds or ISO-8601 (default: now)
+        format: csv (default) or parquet (requires pyarrow)
+    """
+    export_format = request.args.get('format', 'csv').lower()
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({"status": "error", "message": f"Unsupported format, use one of: {', '.join(EXPORT_FORMATS)}"}), 400
+    if export_format == "parquet" and pyarrow is None:
+        return jsonify({"status": "error", "message": "Parquet export requires pyarrow to be installed"}), 501
+
+    requested = request.args.get('plc')
+    if requested:
+        plc_ids = [plc_id.strip().upper() for plc_id in requested.split(',') if plc_id.strip()]
+        unknown = [plc_id for plc_id in plc_ids if plc_id not in plc_registry]
+        if unknown:
+            return jsonify({"status": "error", "message": f"Invalid PLC ID: {', '.join(unknown)}"}), 404
+    else:
+        plc_ids = list(plc_registry)
+    try:
+        end = parse_time_param(request.args.get('to'), time.time())
+        start = parse_time_param(request.args.get('from'), end - 3600)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": f"Invalid query parameter: {e}"}), 400
+    if end <= start:
+        return jsonify({"status": "error", "message": "Require from < to"}), 400
+
+    mimetype, extension = EXPORT_FORMATS[export_format]
+    generate = _export_parquet if export_format == "parquet" else _export_csv
+    logger.info("history export format=%s plcs=%d from=%s to=%s", export_format, len(plc_ids), start, end)
+    return Response(generate(plc_ids, start, end), mimetype=mimetype, headers={
+        "Content-Disposition": f'attachment; filename="history-{int(start)}-{int(end)}.{extension}"',
+        "Cache-Control": "no-cache",
+    })
+
+
+# ============================================================================
+# ROLLING STATISTICS
+# EWMA, windowed min/max/mean and slope per PLC, updated in O(1) per reading
+# ============================================================================
+
+ROLLING_WINDOWS = tuple(sorted({float(w) for w in os.getenv('ROLLING_WINDOWS', '60,300,900').split(',') if w.strip()}))
+ROLLING_EWMA_TAU = float(os.getenv('ROLLING_EWMA_TAU', 60))  # seconds; a reading's weight decays by 1/e over tau
+ROLLING_SLOPE_WINDOW = float(os.getenv('ROLLING_SLOPE_WINDOW', 300))  # window behind the top-level slope_per_min
+# A window reports no slope until its readings span this fraction of its duration
+ROLLING_SLOPE_MIN_SPAN = float(os.getenv('ROLLING_SLOPE_MIN_SPAN', 0.25))
+
+
+class RollingWindow:
+    """
+    Min/max/mean and least-squares slope of the readings in the last
+    `duration` seconds (the window ends at the latest reading).
+
+    Each reading enters and leaves the window once; min and max come from
+    monotonic deques and mean/slope from running sums, so an update is
+    amortized O(1). The sums are recomputed from the samples after every
+    len(samples) evictions, against a fresh time origin, which keeps
+    floating-point drift bounded at no extra amortized cost.
+    """
+
+    __slots__ = ("duration", "samples", "minima", "maxima", "origin",
+                 "sum_t", "sum_v", "sum_tt", "sum_tv", "evicted")
+
+    def __init__(self, duration):
+        self.duration = duration
+        self.samples = deque()  # (timestamp, value)
+        self.minima = deque()  # increasing values: the front is the window minimum
+        self.maxima = deque()  # decreasing values: the front is the window maximum
+        self.origin = None
+        self.sum_t = self.sum_v = self.sum_tt = self.sum_tv = 0.0
+        self.evicted = 0
+
+    def add(self, timestamp, value):
+        if self.origin is None:
+            self.origin = timestamp
+        self.samples.append((timestamp, value))
+        t = timestamp - self.origin
+        self.sum_t += t
+        self.sum_v += value
+        self.sum_tt += t * t
+        self.sum_tv += t * value
+        while self.minima and self.minima[-1][1] >= value:
+            self.minima.pop()
+        self.minima.append((timestamp, value))
+        while self.maxima and self.maxima[-1][1] <= value:
+            self.maxima.pop()
+        self.maxima.append((timestamp, value))
+        self._expire(timestamp - self.duration)
+
+    def _expire(self, cutoff):
+        samples = self.samples
+        while samples[0][0] <= cutoff:
+            timestamp, value = samples.popleft()
+            t = timestamp - self.origin
+            self.sum_t -= t
+            self.sum_v -= value
+            self.sum_tt -= t * t
+            self.sum_tv -= t * value
+            self.evicted += 1
+        while self.minima[0][0] <= cutoff:
+            self.minima.popleft()
+        while self.maxima[0][0] <= cutoff:
+            self.maxima.popleft()
+        if self.evicted >= len(samples):
+            self._resum()
+
+    def _resum(self):
+        self.origin = self.samples[0][0]
+        self.sum_t = self.sum_v = self.sum_tt = self.sum_tv = 0.0
+        for timestamp, value in self.samples:
+            t = timestamp - self.origin
+            self.sum_t += t
+            self.sum_v += value
+            self.sum_tt += t * t
+            self.sum_tv += t * value
+        self.evicted = 0
+
+    @property
+    def minimum(self):
+        return self.minima[0][1] if self.minima else None
+
+    @property
+    def span(self):
+        """Seconds between the oldest and the latest reading in the window."""
+        return self.samples[-1][0] - self.samples[0][0] if self.samples else 0.0
+
+    @property
+    def maximum(self):
+        return self.maxima[0][1] if self.maxima else None
+
+    @property
+    def mean(self):
+        return self.sum_v / len(self.samples) if self.samples else None
+
+    @property
+    def slope(self):
+        """
+        Least-squares slope in °C per minute, or None until the readings span
+        ROLLING_SLOPE_MIN_SPAN of the window (two readings a few ms apart
+        would otherwise give an arbitrarily steep slope)
+        """
+        n = len(self.samples)
+        if n < 2 or self.span < self.duration * ROLLING_SLOPE_MIN_SPAN:
+            return None
+        denominator = n * self.sum_tt - self.sum_t * self.sum_t
+        if denominator <= 1e-9:
+            return None
+        return (n * self.sum_tv - self.sum_t * self.sum_v) / denominator * 60
+
+    def summary(self):
+        return {
+            "min": self.minimum,
+            "max": self.maximum,
+            "mean": _round_stat(self.mean),
+            "slope_per_min": _round_stat(self.slope),
+            "count": len(self.samples)
+        }
+
+
+def _round_stat(value):
+    return None if value is None else round(value, 3)
+
+
+class RollingStats:
+    """
+    Rolling statistics of one PLC's readings: a time-aware EWMA (weight
+    1 - exp(-dt/tau), so irregular reading intervals are handled) plus one
+    RollingWindow per configured duration.
+    """
+
+    def __init__(self, windows, slope_window, tau=ROLLING_EWMA_TAU):
+        self.tau = tau
+        self.windows = {duration: RollingWindow(duration) for duration in sorted(windows)}
+        self.slope_window = self.windows[slope_window]
+        self.ewma = None
+        self.last_timestamp = None
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def update(self, timestamp, value):
+        """Add one reading (epoch seconds, temperature); late readings count as the latest time."""
+        with self._lock:
+            if self.last_timestamp is not None and timestamp < self.last_timestamp:
+                timestamp = self.last_timestamp  # windows need non-decreasing timestamps
+            if self.ewma is None:
+                self.ewma = value
+            else:
+                dt = max(0.0, timestamp - self.last_timestamp)
+                self.ewma += (1 - math.exp(-dt / self.tau)) * (value - self.ewma)
+            self.last_timestamp = timestamp
+            self.count += 1
+            for window in self.windows.values():
+                window.add(timestamp, value)
+
+    def minimum(self, duration, min_span=0.0):
+        """
+        Lowest reading in the window of the given duration (must be a tracked
+        window), or None until its readings span min_span of the window
+        """
+        with self._lock:
+            window = self.windows[duration]
+            if window.span < window.duration * min_span:
+                return None
+            return window.minimum
+
+    def slope(self):
+        """°C per minute over ROLLING_SLOPE_WINDOW."""
+        with self._lock:
+            return self.slope_window.slope
+
+    def summary(self):
+        with self._lock:
+            return {
+                "ewma": _round_stat(self.ewma),
+                "slope_per_min": _round_stat(self.slope_window.slope),
+                "updated_at": datetime.fromtimestamp(self.last_timestamp).isoformat() if self.count else None,
+                "windows": {f"{duration:g}s": window.summary() for duration, window in self.windows.items()}
+            }
+
+
+rolling_stats = {}
+_rolling_stats_lock = threading.Lock()
+# Replaced after every batch of readings is applied, so the /plc-data cache
+# can tell by identity whether its statistics are still current
+rolling_stats_version = object()
+
+
+def get_rolling_stats(plc_id):
+    """
+    Get (creating on first use) the rolling statistics of a PLC
+    """
+    stats = rolling_stats.get(plc_id)
+    if stats is None:
+        with _rolling_stats_lock:
+            stats = rolling_stats.get(plc_id)
+            if stats is None:
+                windows = {*ROLLING_WINDOWS, ROLLING_SLOPE_WINDOW}
+                if ALERT_SUSTAIN_WINDOW:
+                    windows.add(ALERT_SUSTAIN_WINDOW)
+                stats = rolling_stats[plc_id] = RollingStats(windows, ROLLING_SLOPE_WINDOW)
+    return stats
+
+
+@app.route('/stats', methods=['GET'])
+def get_rolling_stats_all():
+    """
+    Get rolling statistics (EWMA, windowed min/max/mean, slope) of every registered PLC
+    (the same summaries /plc-data carries, without the rest of the payload)
+    """
+    summaries = {}
+    for plc_id in plc_registry.devices:
+        stats = rolling_stats.get(plc_id)
+        summaries[plc_id] = stats.summary() if stats else None
+    response = jsonify({"plcs": summaries})
+    response.headers['Cache-Control'] = 'no-cache'
+    return response, 200
+
+
+@app.route('/stats/<plc_id>', methods=['GET'])
+def get_plc_rolling_stats(plc_id):
+    """
+    Get rolling statistics of one PLC (null until its first reading)
+    """
+    plc_id = plc_id.upper()
+    if plc_id not in plc_registry:
+        return jsonify({"status": "error", "message": "Invalid PLC ID"}), 404
+    stats = rolling_stats.get(plc_id)
+    return jsonify({"plc": plc_id, "stats": stats.summary() if stats else None}), 200
+
+
+# ============================================================================
+# LIVE PUSH STREAM (Server-Sent Events)
+# Dashboards subscribe once instead of polling /plc-data
+# ============================================================================
+
+STREAM_TICK = float(os.getenv('STREAM_TICK', 1.0))
+STREAM_HEARTBEAT = float(os.getenv('STREAM_HEARTBEAT', 15))
+# Each subscriber holds a server thread; gunicorn.conf.py sizes threads as this plus headroom
+STREAM_MAX_CLIENTS = int(os.getenv('STREAM_MAX_CLIENTS', 200))
+
+
+class StateBroadcaster:
+    """
+    Condition variable announcing new state versions (plc_data,
+    manual_temperatures and threshold_config changes).
+
+    Subscribers never get a per-client queue: they wake up, render the
+    latest state and go back to waiting, sending at most one message per
+    STREAM_TICK. Any number of changes within a tick collapse into one
+    message and a slow client simply skips intermediate versions. The
+    serialized message is cached per state version and registry (device
+    set) so it is built once no matter how many dashboards are connected.
+    """
+
+    def __init__(self, max_clients=STREAM_MAX_CLIENTS):
+        self.version = 0
+        self.max_clients = max_clients
+        self.clients = 0
+        self._condition = threading.Condition()
+        self._cached = (None, None, None)
+
+    def subscribe(self):
+        """Take a subscriber slot; False when max_clients streams are already open."""
+        with self._condition:
+            if self.clients >= self.max_clients:
+                return False
+            self.clients += 1
+            return True
+
+    def unsubscribe(self):
+        with self._condition:
+            self.clients -= 1
+
+    def notify(self, version):
+        """Announce that the state moved to a new version."""
+        with self._condition:
+            if version > self.version:
+                self.version = version
+                self._condition.notify_all()
+
+    def wait(self, last_version, timeout):
+        """Block until the version differs from last_version or timeout expires."""
+        with self._condition:
+            self._condition.wait_for(lambda: self.version != last_version, timeout=timeout)
+            return self.version
+
+    def message(self):
+        """
+        SSE message for the current snapshot, serialized once per version and
+        shared by all subscribers
+
+        Returns:
+            tuple: (version, message)
+        """
+        snapshot = state.snapshot
+        devices = plc_registry.devices
+        cached_version, cached_devices, cached_message = self._cached
+        if cached_version == snapshot.version and cached_devices is devices:
+            return cached_version, cached_message
+        payload = {
+            "version": snapshot.version,
+            "plcs": build_plc_data_response(snapshot, devices),
+            "thresholds": snapshot.threshold_config,
+            "manual_temperatures": snapshot.manual_temperatures
+        }
+        message = f"id: {snapshot.version}\nevent: state\ndata: {json.dumps(payload)}\n\n"
+        self._cached = (snapshot.version, devices, message)
+        return snapshot.version, message
+
+
+state_broadcaster = StateBroadcaster()
+
+
+@app.route('/stream', methods=['GET'])
+def stream_state():
+    """
+    Server-Sent Events stream of PLC data, thresholds and manual temperatures.
+    Sends the full state on connect and again whenever it changes (coalesced
+    to one message per STREAM_TICK), with keepalive comments in between.
+    At most STREAM_MAX_CLIENTS streams per process; beyond that 503.
+    """
+    if not state_broadcaster.subscribe():
+        logger.warning("stream rejected client=%s reason=max_clients limit=%d", request.remote_addr, STREAM_MAX_CLIENTS)
+        response = jsonify({"status": "error", "message": "Too many open streams, poll /plc-data instead"})
+        response.headers['Retry-After'] = str(int(STREAM_HEARTBEAT))
+        return response, 503
+
+    def generate():
+        last_version = None
+        last_sent = time.monotonic()
+        # With shared state, wake every tick to pull changes made by other workers
+        wait_timeout = STREAM_TICK if shared_state.enabled else STREAM_HEARTBEAT
+        while True:
+            shared_state.sync()
+            version = state_broadcaster.wait(last_version, wait_timeout)
+            if version == last_version:
+                if time.monotonic() - last_sent >= STREAM_HEARTBEAT:
+                    last_sent = time.monotonic()
+                    yield ": keepalive\n\n"
+                continue
+            last_version, message = state_broadcaster.message()
+            last_sent = time.monotonic()
+            yield message
+            time.sleep(STREAM_TICK)
+
+    logger.info("stream subscribed client=%s clients=%d", request.remote_addr, state_broadcaster.clients)
+    response = Response(generate(), mimetype='text/event-stream', headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no"
+    })
+    response.call_on_close(state_broadcaster.unsubscribe)  # runs on disconnect, even before the first message
+    return response
+
+
+# ============================================================================
+# RESPONSE CACHE
+# Pre-serialized JSON + ETag for the polled read endpoints
+# ============================================================================
+
+class ResponseCache:
+    """
+    Serialized JSON bodies of read endpoints, rebuilt only when their state changes.
+
+    Each entry remembers the snapshot sections it was built from. State
+    updates are copy-on-write, so an unchanged section is the very same
+    object in the next snapshot: an identity check tells whether the cached
+    bytes are still current, and readings arriving from the poller do not
+    invalidate /threshold. The ETag is a hash of the body, so it stays valid
+    across worker processes, and If-None-Match gets a bodyless 304.
+    """
+
+    def __init__(self):
+        self._entries = {}
+
+    def respond(self, name, sources, build):
+        """
+        Return the cached response for an endpoint, rebuilding it if its sources changed
+
+        Args:
+            name (str): Cache key (one per endpoint)
+            sources (tuple): State objects the payload is derived from
+            build (callable): Returns the payload when the cache is stale
+        """
+        entry = self._entries.get(name)
+        if entry is None or len(entry[0]) != len(sources) or any(a is not b for a, b in zip(entry[0], sources)):
+            body = app.json.dumps(build()).encode()
+            entry = (sources, body, hashlib.blake2b(body, digest_size=8).hexdigest())
+            self._entries[name] = entry
+        _, body, etag = entry
+
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+        else:
+            response = Response(body, mimetype='application/json')
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+
+
+response_cache = ResponseCache()
+
+
+@app.route('/', methods=['GET'])
+def root():
+    logger.debug("GET / - Root endpoint accessed")
+    return jsonify({"message": "Temperature Server", "endpoints": ["/temperature", "/threshold"]})
+
+@app.route('/temperature', methods=['GET'])
+def get_temperature():
+    # Return temperature data including which PLC it came from
+    latest_reading = state.snapshot.latest_reading
+    logger.debug("GET /temperature - Returning latest reading")
+    return response_cache.respond('temperature', (latest_reading,), lambda: build_temperature_response(latest_reading))
+
+
+def build_temperature_response(latest_reading):
+    """
+    Build the GET /temperature payload from the latest reading
+    """
+    if latest_reading:
+        return {
+            "temperature": latest_reading.get('temperature'),
+            "plc": latest_reading.get('plc', 'Unknown'),
+            "register": latest_reading.get('register', 'N/A'),
+            "timestamp": latest_reading.get('timestamp', 'N/A')
+        }
+    return {
+        "temperature": "Not Available",
+        "plc": "Unknown",
+        "error": "No data received from any PLC yet"
+    }
+
+@app.route('/plc-data', methods=['GET'])
+def get_plc_data():
+    """
+    Get current data for all registered PLCs including temperatures, setpoints,
+    thresholds and rolling statistics
+    """
+    snapshot = state.snapshot
+    devices = plc_registry.devices
+    stats_version = rolling_stats_version
+    logger.debug("GET /plc-data - Returning data for %d PLCs", len(devices))
+    return response_cache.respond(
+        'plc-data',
+        (devices, snapshot.plc_data, snapshot.manual_temperatures, snapshot.threshold_config, stats_version),
+        lambda: build_plc_data_response(snapshot, devices)
+    )
+
+
+def build_plc_data_response(snapshot, devices):
+    """
+    Build the /plc-data payload from one state snapshot's plc_data,
+    manual_temperatures and threshold_config for the registered PLCs, plus
+    each PLC's rolling statistics. Every worker applies the same journalled
+    readings, so the body (and its ETag) matches across workers once they
+    have synced.
+    """
+    plc_data = snapshot.plc_data
+    manual_temperatures = snapshot.manual_temperatures
+    threshold_config = snapshot.threshold_config
+    
+    response = {}
+    for plc_id in devices:
+        data = plc_data.get(plc_id)
+        stats = rolling_stats.get(plc_id)
+        key = plc_id.lower()
+        response[plc_id] = {
+            # Use manual temperature if available, otherwise use PLC data
+            "temperature": manual_temperatures.get(plc_id) or (data.get('temperature') if data else "Not Available"),
+            "setpoint": threshold_config.get(f'{key}_setpoint', DEFAULT_SETPOINT),
+            "threshold": threshold_config.get(f'{key}_threshold', DEFAULT_THRESHOLD),
+            "timestamp": data.get('timestamp') if data else "N/A",
+            "register": data.get('register') if data else "N/A",
+            "stats": stats.summary() if stats else None
+        }
+    return response
+        
+    
+@app.route('/read-plc/<plc_id>', methods=['GET'])
+def read_plc(plc_id):
+    """
+    Read current temperature from specified PLC
+    While the PLC's circuit breaker is open the last known reading is
+    returned with "status": "stale" (503 if there is none) without
+    contacting the PLC.
+    """
+    plc_id = plc_id.upper()
+    if plc_id not in plc_registry:
+        return jsonify({"status": "error", "message": "Invalid PLC ID"}), 400
+    
+    data = read_plc_temperature(plc_id)
+    if data:
+        return jsonify({"status": "success", "data": data}), 200
+
+    breaker = modbus_pool.breaker(plc_id).snapshot()
+    if breaker["state"] == "closed":
+        return jsonify({"status": "error", "message": f"Failed to read from {plc_id}"}), 500
+    last_reading = state.snapshot.plc_data.get(plc_id)
+    if last_reading is not None:
+        return jsonify({
+            "status": "stale",
+            "message": f"{plc_id} is unreachable, returning last known reading",
+            "data": {**last_reading, "stale": True},
+            "breaker": breaker
+        }), 200
+    response = jsonify({"status": "error", "message": f"{plc_id} is unreachable", "breaker": breaker})
+    if breaker["retry_in"] is not None:
+        response.headers['Retry-After'] = str(int(breaker["retry_in"]) + 1)
+    return response, 503
+
+@app.route('/temperature', methods=['POST'])
+def receive_sensordata():
+    # Mocked temperature data
+    data = request.get_json()
+    
+    # Store data for specific PLC
+    plc = str(data.get('plc', 'Unknown')).strip().upper()
+    if plc in plc_registry:
+        data = {**data, 'plc': plc}
+        INGEST_READINGS.inc("single", "accepted")
+        PLC_LAST_READING.set(time.time(), plc)
+        state.update(plc_data={plc: data}, latest_reading=data)
+        record_reading(plc, data.get('temperature'), data.get('timestamp'))
+    else:
+        INGEST_READINGS.inc("single", "unregistered")
+        state.update(latest_reading=data)
+    
+    logger.info("reading received plc=%s temperature=%s register=%s timestamp=%s",
+                plc, data.get('temperature'), data.get('register', 'N/A'), data.get('timestamp', 'N/A'))
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("reading payload=%s", json.dumps(data))
+    
+    return jsonify({"status": "success"}), 200 
+
+
+BATCH_MAX_ERRORS = 100  # cap on per-reading errors echoed back to the gateway
+NDJSON_CONTENT_TYPES = ('application/x-ndjson', 'application/jsonl', 'application/json-lines')
+
+
+def _iter_batch_readings():
+    """
+    Yield readings from the request body: a JSON array, or newline-delimited
+    JSON consumed line by line from the request stream without buffering it
+    """
+    if request.mimetype in NDJSON_CONTENT_TYPES:
+        for line in request.stream:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError as e:
+                yield ValueError(f"Invalid JSON line: {e}")
+        return
+
+    data = request.get_json(silent=True)
+    if not isinstance(data, list):
+        raise ValueError("Expected a JSON array of readings or application/x-ndjson body")
+    yield from data
+
+
+def validate_sensor_reading(reading, known_plcs):
+    """
+    Validate one gateway reading
+
+    Args:
+        reading: Decoded JSON reading
+        known_plcs: Container of valid (upper-case) PLC ids; the reading's
+                    id is matched case-insensitively like the registry's
+
+    Returns:
+        str: Error message, or None if the reading is valid
+    """
+    if not isinstance(reading, dict):
+        return "Reading must be a JSON object"
+    if reading.get('plc') is None or str(reading['plc']).strip().upper() not in known_plcs:
+        return f"Unknown PLC: {reading.get('plc')}"
+    try:
+        float(reading.get('temperature'))
+    except (TypeError, ValueError):
+        return f"Invalid temperature: {reading.get('temperature')}"
+    return None
+
+
+@app.route('/temperature/batch', methods=['POST'])
+def receive_sensordata_batch():
+    """
+    Receive many readings in one request
+    Accepts a JSON array of readings, or newline-delimited JSON
+    (Content-Type: application/x-ndjson) with one reading per line.
+    Each reading has the same shape as POST /temperature. The batch is
+    published as a single state update.
+    """
+    accepted = 0
+    errors = []
+    rejected = 0
+    last_reading = None
+    latest_by_plc = {}
+    recorded = []  # (plc_id, temperature, timestamp) for history, stats and alerts
+    known_plcs = plc_registry
+
+    try:
+        for index, reading in enumerate(_iter_batch_readings()):
+            error = str(reading) if isinstance(reading, ValueError) else validate_sensor_reading(reading, known_plcs)
+            if error:
+                rejected += 1
+                if len(errors) < BATCH_MAX_ERRORS:
+                    errors.append({"index": index, "error": error})
+                continue
+            plc = str(reading['plc']).strip().upper()
+            reading['plc'] = plc
+            latest_by_plc[plc] = reading
+            recorded.append((plc, reading['temperature'], reading.get('timestamp')))
+            last_reading = reading
+            accepted += 1
+    except ValueError as e:
+        logger.warning("batch rejected error=%s", e)
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+    if last_reading is not None:
+        # One snapshot and one journal write for the whole batch
+        state.update(plc_data=latest_by_plc, latest_reading=last_reading)
+        record_readings(recorded)
+        now = time.time()
+        for plc in latest_by_plc:
+            PLC_LAST_READING.set(now, plc)
+    INGEST_READINGS.inc("batch", "accepted", amount=accepted)
+    INGEST_READINGS.inc("batch", "rejected", amount=rejected)
+
+    logger.info("batch received accepted=%d rejected=%d plcs=%s", accepted, rejected, ','.join(sorted(latest_by_plc)) or 'none')
+    return jsonify({
+        "status": "success" if not rejected else "partial",
+        "accepted": accepted,
+        "rejected": rejected,
+        "errors": errors
+    }), 200
+
+
+# Binary ingest record, little-endian: device index (the PLC's registry "index"),
+# register, temperature in tenths of °C, timestamp in epoch milliseconds (0 = time received)
+BINARY_RECORD = struct.Struct('<HHhq')
+BINARY_VALUE_DIVISOR = 10
+BINARY_READ_RECORDS = 4096  # records decoded per read from the request stream
+
+
+def _iter_binary_records():
+    """
+    Yield (device index, register, value, timestamp ms) tuples from the
+    request stream, decoded in bulk with struct.iter_unpack
+    """
+    size = BINARY_RECORD.size
+    pending = b''
+    while True:
+        chunk = request.stream.read(size * BINARY_READ_RECORDS)
+        if not chunk:
+            break
+        data = pending + chunk if pending else chunk
+        usable = len(data) - len(data) % size
+        pending = data[usable:]
+        yield from BINARY_RECORD.iter_unpack(memoryview(data)[:usable])
+    if pending:
+        raise ValueError(f"Body is not a whole number of {size}-byte records")
+
+
+@app.route('/temperature/binary', methods=['POST'])
+def receive_sensordata_binary():
+    """
+    Receive readings in the compact binary format
+    Body: concatenated 14-byte records (BINARY_RECORD, struct '<HHhq'):
+        device index (uint16, "index" in GET /plcs), register (uint16),
+        temperature in tenths of °C (int16), timestamp in epoch ms (int64; 0,
+        negative, future or out-of-range values mean now)
+    Records are decoded in bulk without a dict per reading; only the latest
+    reading of each PLC becomes a plc_data entry, published as a single
+    state update like POST /temperature/batch.
+    """
+    if request.content_length is not None and request.content_length % BINARY_RECORD.size:
+        return jsonify({"status": "error", "message": f"Body is not a whole number of {BINARY_RECORD.size}-byte records"}), 400
+
+    by_index = plc_registry.by_index
+    accepted = 0
+    rejected = 0
+    errors = []
+    latest_by_plc = {}  # plc_id -> (register, temperature, timestamp)
+    recorded = []
+    last_plc = None
+    now = time.time()
+
+    try:
+        for position, (device, register, value, timestamp_ms) in enumerate(_iter_binary_records()):
+            plc = by_index.get(device)
+            if plc is None:
+                rejected += 1
+                if len(errors) < BATCH_MAX_ERRORS:
+                    errors.append({"index": position, "error": f"Unknown device index: {device}"})
+                continue
+            temperature = value / BINARY_VALUE_DIVISOR
+            timestamp = reading_timestamp(timestamp_ms / 1000, now)
+            latest_by_plc[plc] = (register, temperature, timestamp)
+            recorded.append((plc, temperature, timestamp))
+            last_plc = plc
+            accepted += 1
+    except ValueError as e:
+        logger.warning("binary batch rejected error=%s", e)
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+    if last_plc is not None:
+        readings = {
+            plc: {
+                "plc": plc,
+                "temperature": temperature,
+                "register": register,
+                "timestamp": datetime.fromtimestamp(timestamp).isoformat()
+            }
+            for plc, (register, temperature, timestamp) in latest_by_plc.items()
+        }
+        state.update(plc_data=readings, latest_reading=readings[last_plc])
+        record_readings(recorded)
+        for plc in readings:
+            PLC_LAST_READING.set(now, plc)
+    INGEST_READINGS.inc("binary", "accepted", amount=accepted)
+    INGEST_READINGS.inc("binary", "rejected", amount=rejected)
+
+    logger.info("binary batch received accepted=%d rejected=%d plcs=%d", accepted, rejected, len(latest_by_plc))
+    return jsonify({
+        "status": "success" if not rejected else "partial",
+        "accepted": accepted,
+        "rejected": rejected,
+        "errors": errors
+    }), 200
+
+
+@app.route('/temperature/alert', methods=['POST'])
+def check_temperature_alert():
+    """
+    Check if current temperature exceeds threshold and send email alert
+    Expects JSON: {"current_temperature": <value>, "threshold_temperature": <value>, "plc": <optional registered id>}
+    Only alarm state transitions (and re-notifications after ALERT_RENOTIFY_INTERVAL)
+    send an email; other over-threshold checks are counted as suppressed.
+    For a registered 'plc' the rolling-statistics rules apply as well
+    (ALERT_SUSTAIN_WINDOW, ALERT_RATE_LIMIT); without one the sustain rule
+    has no readings to look at and only the checked temperature counts.
+    """
+    try:
+        data = request.get_json()
+        current_temp = data.get('current_temperature')
+        threshold_temp = data.get('threshold_temperature')
+        plc = str(data.get('plc') or ALERT_DEFAULT_KEY).upper()
+        
+        logger.debug("alert check plc=%s current=%s threshold=%s", plc, current_temp, threshold_temp)
+        
+        if current_temp is None or threshold_temp is None:
+            logger.warning("alert check missing parameters current=%s threshold=%s", current_temp, threshold_temp)
+            return jsonify({"status": "error", "message": "Missing current_temperature or threshold_temperature"}), 400
+        if plc != ALERT_DEFAULT_KEY and plc not in plc_registry:
+            logger.warning("alert check rejected plc=%s reason=unregistered", plc)
+            return jsonify({"status": "error", "message": "Invalid PLC ID"}), 404
+        
+        current_temp = float(current_temp)
+        threshold_temp = float(threshold_temp)
+        
+        if plc == ALERT_DEFAULT_KEY:
+            sustained, slope = current_temp, None  # no reading history: the check itself is all there is
+        else:
+            sustained, slope = rolling_alert_inputs(plc)
+        decision, alarm = alert_engine.evaluate(plc, current_temp, threshold_temp, sustained, slope)
+        response = {
+            "plc": plc,
+            "current_temperature": current_temp,
+            "threshold_temperature": threshold_temp,
+            "alarm_state": alarm["state"],
+            "alarm_reason": alarm["reason"],
+            "slope_per_min": _round_stat(slope)
+        }
+        
+        if decision == "notify":
+            logger.warning("alert triggered plc=%s current=%s threshold=%s excess=%.1f reason=%s",
+                           plc, current_temp, threshold_temp, current_temp - threshold_temp, alarm["reason"])
+            # Queue email alert; a dispatcher worker sends it
+            try:
+                alert_id = queue_alarm_notification(plc, current_temp, threshold_temp, alarm, slope)
+            except queue.Full:
+                alert_engine.notification_failed(plc)
+                logger.error("alert rejected plc=%s reason=queue_full", plc)
+                return jsonify({
+                    **response,
+                    "status": "alert_rejected",
+                    "message": "Alert queue is full, try again later"
+                }), 503
+            return jsonify({
+                **response,
+                "status": "alert_queued",
+                "message": (f"Temperature {current_temp}°C exceeds threshold {threshold_temp}°C. Email alert queued!"
+                            if alarm["reason"] != "rate" else
+                            f"Temperature {current_temp}°C is rising {slope:.2f}°C/min. Email alert queued!"),
+                "alert_id": alert_id,
+                "status_url": f"/alerts/{alert_id}"
+            }), 202
+        elif decision == "suppressed":
+            logger.debug("alert suppressed plc=%s suppressed=%d", plc, alarm["suppressed"])
+            return jsonify({
+                **response,
+                "status": "alert_suppressed",
+                "message": f"{plc} is already alarming; next notification after {alarm['renotify_in']}s",
+                "suppressed": alarm["suppressed"]
+            }), 200
+        else:
+            logger.debug("alert check ok plc=%s current=%s threshold=%s state=%s",
+                         plc, current_temp, threshold_temp, alarm["state"])
+            return jsonify({
+                **response,
+                "status": "ok",
+                "message": f"Temperature {current_temp}°C is within threshold {threshold_temp}°C"
+            }), 200
+            
+    except Exception as e:
+        logger.error("alert check failed error=%s", e, exc_info=True)
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+@app.route('/threshold', methods=['GET'])
+def get_threshold():
+    """
+    Get current threshold configuration for all PLCs
+    """
+    threshold_config = state.snapshot.threshold_config
+    logger.debug("GET /threshold - Retrieving all thresholds")
+    return response_cache.respond('threshold', (threshold_config,), lambda: threshold_config)
+
+@app.route('/threshold/<plc_id>', methods=['GET'])
+def get_plc_threshold(plc_id):
+    """
+    Get threshold for a specific PLC
+    Args:
+        plc_id: Registered PLC id, e.g. 'plc1'
+    """
+    key = f"{plc_id.lower()}_threshold"
+    threshold_config = state.snapshot.threshold_config
+    if plc_id.upper() in plc_registry and key in threshold_config:
+        value = threshold_config[key]
+        logger.debug("GET /threshold/%s - Retrieved threshold: %s°C", plc_id, value)
+        return jsonify({"plc": plc_id, "threshold": value}), 200
+    logger.warning("GET /threshold/%s - Invalid PLC ID", plc_id)
+    return jsonify({"error": f"Invalid PLC ID: {plc_id}"}), 404
+
+@app.route('/threshold', methods=['POST'])
+def update_threshold():
+    """
+    Update threshold configuration
+    Expects JSON: {"<plc id>_threshold": <value>, ...}, e.g. {"plc1_threshold": <value>, "plc2_threshold": <value>}
+    Keys of unregistered PLCs are ignored.
+    """
+    try:
+        data = request.get_json()
+        
+        changes = {}
+        for key, value in data.items():
+            if key.endswith('_threshold') and key[:-len('_threshold')].upper() in plc_registry:
+                changes[key.lower()] = float(value)
+        
+        previous, snapshot = state.update(threshold_config=changes) if changes else (state.snapshot, state.snapshot)
+        updated_plcs = [
+            f"{key[:-len('_threshold')].upper()}: {previous.threshold_config.get(key, 'N/A')}°C → {value}°C"
+            for key, value in changes.items()
+        ]
+        
+        logger.info("thresholds updated changes=%s", '; '.join(updated_plcs) or 'none')
+        
+        return jsonify({
+            "status": "success",
+            "message": "Threshold updated",
+            "config": snapshot.threshold_config
+        }), 200
+    except Exception as e:
+        logger.error("threshold update failed error=%s", e, exc_info=True)
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+@app.route('/threshold/<plc_id>', methods=['POST'])
+def update_plc_threshold(plc_id):
+    """
+    Update threshold for a specific PLC
+    Args:
+        plc_id: Registered PLC id, e.g. 'plc1'
+    Expects JSON: {"threshold": <value>}
+    """
+    try:
+        data = request.get_json()
+        threshold = float(data.get('threshold'))
+        key = f"{plc_id.lower()}_threshold"
+        
+        if plc_id.upper() not in plc_registry or key not in state.snapshot.threshold_config:
+            logger.warning("POST /threshold/%s - Invalid PLC ID", plc_id)
+            return jsonify({"error": f"Invalid PLC ID: {plc_id}"}), 404
+        
+        previous, _ = state.update(threshold_config={key: threshold})
+        old_value = previous.threshold_config[key]
+        
+        logger.info("threshold updated plc=%s old=%s new=%s change=%+.1f", plc_id.upper(), old_value, threshold, threshold - old_value)
+        
+        return jsonify({
+            "status": "success",
+            "message": f"{plc_id} threshold updated",
+            "plc": plc_id,
+            "threshold": threshold,
+            "previous_threshold": old_value
+        }), 200
+    except Exception as e:
+        logger.error("threshold update failed plc=%s error=%s", plc_id, e, exc_info=True)
+        return jsonify({"status": "error", "message": str(e)}), 400
+    
+    
+@app.route('/setpoint/<plc_id>', methods=['POST'])
+def update_plc_setpoint(plc_id):
+    """
+    Update setpoint for a specific PLC
+    Args:
+        plc_id: Registered PLC id, e.g. 'plc1'
+    Expects JSON: {"setpoint": <value>}
+    """
+    try:
+        data = request.get_json()
+        setpoint = float(data.get('setpoint'))
+        key = f"{plc_id.lower()}_setpoint"
+        
+        if plc_id.upper() not in plc_registry or key not in state.snapshot.threshold_config:
+            logger.warning("POST /setpoint/%s - Invalid PLC ID", plc_id)
+            return jsonify({"error": f"Invalid PLC ID: {plc_id}"}), 404
+        
+        previous, _ = state.update(threshold_config={key: setpoint})
+        old_value = previous.threshold_config[key]
+        
+        logger.info("setpoint updated plc=%s old=%s new=%s change=%+.1f", plc_id.upper(), old_value, setpoint, setpoint - old_value)
+        
+        return jsonify({
+            "status": "success",
+            "message": f"{plc_id} setpoint updated",
+            "plc": plc_id,
+            "setpoint": setpoint,
+            "previous_setpoint": old_value
+        }), 200
+    except Exception as e:
+        logger.error("setpoint update failed plc=%s error=%s", plc_id, e, exc_info=True)
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+
+@app.route('/temperature/manual/<plc_id>', methods=['POST'])
+def set_manual_temperature(plc_id):
+    """
+    Set manual temperature for a specific PLC
+    Args:
+        plc_id: Registered PLC id, e.g. 'PLC1'
+    Expects JSON: {"temperature": <value>}
     """
     try:
         data = request.get_json()
         temperature = float(data.get('temperature'))
         plc_key = plc_id.upper()
         
-        if plc_key not in manual_temperatures:
-            logger.warning(f"POST /temperature/manual/{plc_id} - Invalid PLC ID: {plc_id}")
+        if plc_key not in plc_registry or plc_key not in state.snapshot.manual_temperatures:
+            logger.warning("POST /temperature/manual/%s - Invalid PLC ID", plc_id)
             return jsonify({"error": f"Invalid PLC ID: {plc_id}"}), 404
         
-        old_value = manual_temperatures[plc_key]
-        manual_temperatures[plc_key] = temperature
+        previous, _ = state.update(manual_temperatures={plc_key: temperature})
+        old_value = previous.manual_temperatures[plc_key]
         
-        logger.info("=" * 70)
-        logger.info(f"🎯 RECEIVED MANUAL TEMPERATURE FOR {plc_key}")
-        logger.info("=" * 70)
-        logger.info(f"  Previous Temperature: {old_value}°C")
-        logger.info(f"  New Manual Temperature: {temperature}°C")
-        logger.info(f"  Timestamp: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-        logger.info("  ✅ Manual temperature set")
-        logger.info("=" * 70)
+        logger.info("manual temperature set plc=%s old=%s new=%s", plc_key, old_value, temperature)
         
         return jsonify({
             "status": "success",
@@ -426,267 +3606,1041 @@ def set_manual_temperature(plc_id):
             "previous_temperature": old_value
         }), 200
     except Exception as e:
-        logger.error(f"❌ Error setting manual temperature for {plc_id}: {str(e)}", exc_info=True)
+        logger.error("manual temperature failed plc=%s error=%s", plc_id, e, exc_info=True)
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+
+@app.route('/plcs', methods=['GET'])
+def list_plcs():
+    """
+    Get all registered PLCs and their connection settings
+    """
+    devices = plc_registry.devices
+    return response_cache.respond('plcs', (devices,), lambda: {"count": len(devices), "plcs": devices})
+
+
+@app.route('/plcs/<plc_id>', methods=['GET'])
+def get_plc(plc_id):
+    """
+    Get one registered PLC's settings
+    """
+    plc_key = plc_id.upper()
+    settings = plc_registry.get(plc_key)
+    if settings is None:
+        return jsonify({"error": f"Invalid PLC ID: {plc_id}"}), 404
+    return jsonify({"plc": plc_key, **settings}), 200
+
+
+@app.route('/plcs/<plc_id>', methods=['PUT'])
+def put_plc(plc_id):
+    """
+    Register a PLC or replace its settings
+    Expects JSON: {"ip": <address>, "port": 502, "slave_unit": 1, "registers": {...},
+                   "poll_interval": <seconds>, "setpoint": <value>, "threshold": <value>}
+    Only "ip" is required; setpoint/threshold default to DEFAULT_SETPOINT/DEFAULT_THRESHOLD
+    for new PLCs and are left unchanged for existing ones.
+    """
+    try:
+        created, settings = plc_registry.put(plc_id, request.get_json(silent=True))
+    except ValueError as e:
+        logger.warning("PUT /plcs/%s rejected error=%s", plc_id, e)
         return jsonify({"status": "error", "message": str(e)}), 400
 
+    plc_key = plc_id.upper()
+    logger.info("plc %s plc=%s ip=%s port=%s", "registered" if created else "updated", plc_key, settings["ip"], settings["port"])
+    return jsonify({"status": "success", "plc": plc_key, **settings}), 201 if created else 200
+
+
+@app.route('/plcs/<plc_id>', methods=['DELETE'])
+def delete_plc(plc_id):
+    """
+    Unregister a PLC
+    """
+    plc_key = plc_id.upper()
+    if not plc_registry.remove(plc_key):
+        return jsonify({"error": f"Invalid PLC ID: {plc_id}"}), 404
+    logger.info("plc removed plc=%s", plc_key)
+    return jsonify({"status": "success", "plc": plc_key}), 200
+
 
 # ============================================================================
 # EMAIL NOTIFICATION SYSTEM - SendGrid Integration
 # Self-contained for Render deployment
 # ============================================================================
 
-def send_temperature_alert_email(current_temperature, threshold_temperature):
+class EmailTemplate:
     """
-    Send email alert when temperature exceeds threshold using SendGrid API.
-    
-    Args:
-        current_temperature (float): Current temperature in Celsius
-        threshold_temperature (float): Temperature threshold in Celsius
-        
-    Returns:
-        dict: Status and response information
+    A str.format-style template parsed once at import: render() only joins
+    the literal parts with the formatted fields. With escape=True string
+    values are HTML-escaped (PLC ids in /temperature/alert come from clients).
     """
-    logger.info("=" * 80)
-    logger.info("📧 SENDGRID EMAIL ALERT - STARTING")
-    logger.info("=" * 80)
-    
-    logger.debug(f"  SENDGRID_API_KEY exists: {bool(SENDGRID_API_KEY)}")
-    logger.debug(f"  SENDGRID_API_KEY length: {len(SENDGRID_API_KEY) if SENDGRID_API_KEY else 0}")
-    logger.debug(f"  Alert Email: {ALERT_EMAIL}")
-    logger.debug(f"  Current Temperature: {current_temperature}°C")
-    logger.debug(f"  Threshold Temperature: {threshold_temperature}°C")
-    
-    if not SENDGRID_API_KEY:
-        logger.error("❌ SENDGRID_API_KEY is NOT configured!")
-        return {
-            "status": "failed", 
-            "error": "SENDGRID_API_KEY environment variable not configured"
-        }
-    
-    logger.info("✅ SENDGRID_API_KEY is configured")
-    
-    subject = f"🚨 Temperature Alert: {current_temperature}°C exceeds {threshold_temperature}°C"
-    logger.debug(f"  Email Subject: {subject}")
-    
-    text_content = f"""
+
+    def __init__(self, source, escape=False):
+        self.escape = escape
+        self._parts = [(literal, field, spec or '') for literal, field, spec, _ in string.Formatter().parse(source)]
+
+    def render(self, values):
+        out = []
+        for literal, field, spec in self._parts:
+            out.append(literal)
+            if field is not None:
+                value = values[field]
+                if self.escape and isinstance(value, str):
+                    value = html.escape(value)
+                out.append(format(value, spec))
+        return ''.join(out)
+
+
+ALERT_SUBJECT = EmailTemplate("🚨 Temperature Alert: {plc} at {temperature}°C exceeds {threshold}°C")
+ALERT_TEXT = EmailTemplate("""
 TEMPERATURE ALERT!
 
-Current Temperature: {current_temperature}°C
-Temperature Threshold: {threshold_temperature}°C
-Alert Timestamp: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
+PLC: {plc}
+Current Temperature: {temperature}°C
+Temperature Threshold: {threshold}°C
+Alert Timestamp: {time}
 
 The room temperature has exceeded the set threshold. Please take action.
 
 This is an automated alert from your Temperature Monitoring System.
-"""
-    
-    html_content = f"""
+""")
+ALERT_HTML = EmailTemplate("""
     <html>
         <body style="font-family: Arial, sans-serif; line-height: 1.6; color: #333;">
             <div style="border-left: 4px solid #ff6b6b; padding: 20px; background-color: #ffe0e0;">
                 <h2 style="color: #ff6b6b; margin: 0 0 10px 0;">🚨 TEMPERATURE ALERT</h2>
-                <p><strong>Current Temperature:</strong> {current_temperature}°C</p>
-                <p><strong>Threshold:</strong> {threshold_temperature}°C</p>
-                <p><strong>Excess:</strong> {current_temperature - threshold_temperature}°C above threshold</p>
-                <p><strong>Time:</strong> {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}</p>
+                <p><strong>PLC:</strong> {plc}</p>
+                <p><strong>Current Temperature:</strong> {temperature}°C</p>
+                <p><strong>Threshold:</strong> {threshold}°C</p>
+                <p><strong>Excess:</strong> {excess:.1f}°C above threshold</p>
+                <p><strong>Time:</strong> {time}</p>
+                <hr style="border: none; border-top: 1px solid #ddd; margin: 20px 0;">
+                <p style="color: #666; font-size: 12px;">This is an automated alert from your Temperature Monitoring System.</p>
+            </div>
+        </body>
+    </html>
+    """, escape=True)
+
+# Digest bodies are rendered once per digest; each personalization fills the
+# -alert_count-/-alert_rows-/-alert_rows_html- tags with its own PLCs' rows
+DIGEST_SUBJECT = EmailTemplate("🚨 Temperature Alert Digest: {count} alarm(s)")
+DIGEST_TEXT = EmailTemplate("""
+TEMPERATURE ALERT DIGEST
+
+-alert_count- alarm(s) between {opened} and {closed}:
+
+-alert_rows-
+Please take action.
+
+This is an automated alert from your Temperature Monitoring System.
+""")
+DIGEST_HTML = EmailTemplate("""
+    <html>
+        <body style="font-family: Arial, sans-serif; line-height: 1.6; color: #333;">
+            <div style="border-left: 4px solid #ff6b6b; padding: 20px; background-color: #ffe0e0;">
+                <h2 style="color: #ff6b6b; margin: 0 0 10px 0;">🚨 TEMPERATURE ALERT DIGEST</h2>
+                <p>-alert_count- alarm(s) between {opened} and {closed}</p>
+                <table cellpadding="4" style="border-collapse: collapse;">
+                    <tr><th align="left">PLC</th><th align="left">Temperature</th><th align="left">Threshold</th><th align="left">Alarm</th><th align="left">Time</th></tr>
+                    -alert_rows_html-
+                </table>
                 <hr style="border: none; border-top: 1px solid #ddd; margin: 20px 0;">
                 <p style="color: #666; font-size: 12px;">This is an automated alert from your Temperature Monitoring System.</p>
             </div>
         </body>
     </html>
+    """)
+DIGEST_ROW_TEXT = EmailTemplate("{plc}: {temperature}°C (threshold {threshold}°C, {detail}) at {time}\n")
+DIGEST_ROW_HTML = EmailTemplate(
+    "<tr><td>{plc}</td><td>{temperature}°C</td><td>{threshold}°C</td><td>{detail}</td><td>{time}</td></tr>",
+    escape=True
+)
+ALERT_DIGEST_MAX_ROWS = int(os.getenv('ALERT_DIGEST_MAX_ROWS', 25))  # rows per personalization (SendGrid caps substitutions at 10 KB)
+
+
+def alert_recipients(plc_id):
     """
-    
-    logger.debug(f"  Email text preview: {text_content[:100]}...")
-    logger.debug(f"  Email HTML preview: {html_content[:100]}...")
-    
+    Recipients for a PLC's alerts: its registry "recipients", else ALERT_RECIPIENTS
+    """
+    return (plc_registry.get(plc_id) or {}).get("recipients") or ALERT_RECIPIENTS
+
+
+def post_sendgrid(payload, label):
+    """
+    POST a mail/send payload to SendGrid
+
+    Args:
+        payload (dict): SendGrid v3 mail/send body
+        label (str): Email kind for the log lines ("alert", "digest", ...)
+
+    Returns:
+        dict: Status and response information
+    """
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("sendgrid %s payload=%s", label, json.dumps({k: v if k != 'content' else '...' for k, v in payload.items()}))
+
+    headers = {
+        "Authorization": f"Bearer {SENDGRID_API_KEY}",
+        "Content-Type": "application/json"
+    }
+
     try:
-        logger.info("📤 Preparing SendGrid API request...")
-        
-        payload = {
-            "personalizations": [
-                {
-                    "to": [
-                        {
-                            "email": ALERT_EMAIL,
-                            "name": "Temperature Alert System"
-                        }
-                    ],
-                    "subject": subject
-                }
-            ],
-            "from": {
-                "email": ALERT_EMAIL,
-                "name": "Temperature Monitoring System"
-            },
-            "content": [
-                {
-                    "type": "text/plain",
-                    "value": text_content
-                },
-                {
-                    "type": "text/html",
-                    "value": html_content
-                }
-            ],
-            "reply_to": {
-                "email": ALERT_EMAIL
-            }
-        }
-        
-        logger.debug(f"  Payload structure: {json.dumps({k: v if k != 'content' else '...' for k, v in payload.items()}, indent=2)}")
-        
-        headers = {
-            "Authorization": f"Bearer {SENDGRID_API_KEY}",
-            "Content-Type": "application/json"
-        }
-        
-        logger.debug(f"  Headers: Authorization: Bearer [***hidden***], Content-Type: application/json")
-        logger.info("🔗 Sending request to SendGrid API (https://api.sendgrid.com/v3/mail/send)...")
-        
-        response = requests.post(
-            "https://api.sendgrid.com/v3/mail/send",
+        started = time.monotonic()
+        response = sendgrid_session.post(
+            SENDGRID_API_URL,
             headers=headers,
-            json=payload
+            json=payload,
+            timeout=SENDGRID_TIMEOUT
         )
-        
-        logger.info(f"📥 Received response from SendGrid:")
-        logger.info(f"  Status Code: {response.status_code}")
-        logger.info(f"  Response Headers: {dict(response.headers)}")
-        logger.debug(f"  Response Body: {response.text}")
-        
+        elapsed_ms = (time.monotonic() - started) * 1000
+
         if response.status_code == 202:
-            logger.info("✅ EMAIL SENT SUCCESSFULLY! (Status: 202 Accepted)")
-            logger.info("=" * 80)
+            logger.info("sendgrid %s sent status=%d latency_ms=%.0f", label, response.status_code, elapsed_ms)
             return {
                 "status": "sent",
                 "message": "Email sent successfully",
                 "response_code": response.status_code
             }
-        else:
-            logger.error(f"❌ SendGrid API returned unexpected status code: {response.status_code}")
-            logger.error(f"  Response text: {response.text}")
-            logger.info("=" * 80)
-            return {
-                "status": "failed",
-                "error": f"SendGrid API error: {response.status_code}",
-                "details": response.text
-            }
+        logger.error("sendgrid %s failed status=%d latency_ms=%.0f body=%s", label, response.status_code, elapsed_ms, response.text)
+        return {
+            "status": "failed",
+            "error": f"SendGrid API error: {response.status_code}",
+            "details": response.text
+        }
     except Exception as e:
-        logger.error(f"❌ EXCEPTION occurred while sending email: {type(e).__name__}")
-        logger.error(f"  Error message: {str(e)}")
-        logger.exception(f"  Full traceback:")
-        logger.info("=" * 80)
+        logger.exception("sendgrid %s failed error=%s: %s", label, type(e).__name__, e)
         return {
             "status": "failed",
             "error": str(e)
         }
 
 
-def send_custom_notification(subject, message, recipient_email=None):
+def _sendgrid_not_configured(label):
+    logger.error("sendgrid %s failed error=SENDGRID_API_KEY not configured", label)
+    return {
+        "status": "failed",
+        "error": "SENDGRID_API_KEY environment variable not configured"
+    }
+
+
+def send_temperature_alert_email(current_temperature, threshold_temperature, plc_id=None):
     """
-    Send a custom email notification via SendGrid.
+    Send email alert when temperature exceeds threshold using SendGrid API.
     
     Args:
-        subject (str): Email subject
-        message (str): Email message content
-        recipient_email (str): Recipient email address (defaults to ALERT_EMAIL)
+        current_temperature (float): Current temperature in Celsius
+        threshold_temperature (float): Temperature threshold in Celsius
+        plc_id (str): Alerting PLC; selects the recipients (see alert_recipients)
         
     Returns:
         dict: Status and response information
     """
-    logger.info("=" * 80)
-    logger.info("📧 SENDGRID CUSTOM NOTIFICATION - STARTING")
-    logger.info("=" * 80)
+    recipients = alert_recipients(plc_id)
+    logger.debug("sendgrid alert start plc=%s current=%s threshold=%s to=%s",
+                 plc_id, current_temperature, threshold_temperature, ','.join(recipients))
     
-    logger.debug(f"  SENDGRID_API_KEY exists: {bool(SENDGRID_API_KEY)}")
-    logger.debug(f"  SENDGRID_API_KEY length: {len(SENDGRID_API_KEY) if SENDGRID_API_KEY else 0}")
-    logger.debug(f"  Subject: {subject}")
-    logger.debug(f"  Custom recipient: {recipient_email}")
-    logger.debug(f"  Default alert email: {ALERT_EMAIL}")
+    if not SENDGRID_API_KEY:
+        return _sendgrid_not_configured("alert")
     
+    values = {
+        "plc": plc_id or "N/A",
+        "temperature": current_temperature,
+        "threshold": threshold_temperature,
+        "excess": current_temperature - threshold_temperature,
+        "time": datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    }
+    payload = {
+        "personalizations": [
+            {
+                "to": [{"email": email} for email in recipients],
+                "subject": ALERT_SUBJECT.render(values)
+            }
+        ],
+        "from": {
+            "email": ALERT_EMAIL,
+            "name": "Temperature Monitoring System"
+        },
+        "content": [
+            {
+                "type": "text/plain",
+                "value": ALERT_TEXT.render(values)
+            },
+            {
+                "type": "text/html",
+                "value": ALERT_HTML.render(values)
+            }
+        ],
+        "reply_to": {
+            "email": ALERT_EMAIL
+        }
+    }
+    return post_sendgrid(payload, "alert")
+
+
+def send_alert_digest(alerts, opened_at):
+    """
+    Send one digest email for a batch of alarms (see AlertDigest).
+
+    Every alarm row is rendered once; recipients are grouped by the set of
+    alarms routed to them and each group becomes one SendGrid
+    personalization whose substitutions carry its rows, so the whole digest
+    is a single API call however many PLCs alarmed.
+
+    Args:
+        alerts (list): Alarm dicts {"plc", "temperature", "threshold", "reason", "slope", "time"}
+        opened_at (str): When the digest window opened
+
+    Returns:
+        dict: Status and response information
+    """
     if not SENDGRID_API_KEY:
-        logger.error("❌ SENDGRID_API_KEY is NOT configured!")
-        return {
-            "status": "failed",
-            "error": "SENDGRID_API_KEY environment variable not configured"
+        return _sendgrid_not_configured("digest")
+
+    text_rows = []
+    html_rows = []
+    routed = {}  # recipient -> alert positions
+    for position, alert in enumerate(alerts):
+        if alert["reason"] == "rate":
+            detail = f"rising {alert['slope']:.2f}°C/min"
+        else:
+            detail = f"+{alert['temperature'] - alert['threshold']:.1f}°C"
+        values = {**alert, "detail": detail}
+        text_rows.append(DIGEST_ROW_TEXT.render(values))
+        html_rows.append(DIGEST_ROW_HTML.render(values))
+        for email in alert_recipients(alert["plc"]):
+            routed.setdefault(email, []).append(position)
+
+    groups = {}  # alert positions -> recipients
+    for email, positions in routed.items():
+        groups.setdefault(tuple(positions), []).append(email)
+
+    personalizations = []
+    for positions, recipients in groups.items():
+        shown = positions[:ALERT_DIGEST_MAX_ROWS]
+        more = len(positions) - len(shown)
+        rows_text = ''.join(text_rows[position] for position in shown)
+        rows_html = ''.join(html_rows[position] for position in shown)
+        if more:
+            rows_text += f"... and {more} more\n"
+            rows_html += f'<tr><td colspan="5">... and {more} more</td></tr>'
+        personalizations.append({
+            "to": [{"email": email} for email in recipients],
+            "subject": DIGEST_SUBJECT.render({"count": len(positions)}),
+            "substitutions": {
+                "-alert_count-": str(len(positions)),
+                "-alert_rows-": rows_text,
+                "-alert_rows_html-": rows_html
+            }
+        })
+
+    window = {"opened": opened_at, "closed": datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
+    payload = {
+        "personalizations": personalizations,
+        "from": {
+            "email": ALERT_EMAIL,
+            "name": "Temperature Monitoring System"
+        },
+        "content": [
+            {
+                "type": "text/plain",
+                "value": DIGEST_TEXT.render(window)
+            },
+            {
+                "type": "text/html",
+                "value": DIGEST_HTML.render(window)
+            }
+        ],
+        "reply_to": {
+            "email": ALERT_EMAIL
         }
+    }
+    logger.info("sendgrid digest start alerts=%d personalizations=%d recipients=%d",
+                len(alerts), len(personalizations), len(routed))
+    return post_sendgrid(payload, "digest")
+
+
+def send_custom_notification(subject, message, recipient_email=None):
+    """
+    Send a custom email notification via SendGrid.
     
-    logger.info("✅ SENDGRID_API_KEY is configured")
+    Args:
+        subject (str): Email subject
+        message (str): Email message content
+        recipient_email (str or list): Recipient email address(es) (defaults to ALERT_EMAIL)
+        
+    Returns:
+        dict: Status and response information
+    """
+    if not SENDGRID_API_KEY:
+        return _sendgrid_not_configured("notification")
     
-    recipient = recipient_email or ALERT_EMAIL
-    logger.info(f"📬 Using recipient email: {recipient}")
-    logger.debug(f"  Message preview: {message[:100]}..." if len(message) > 100 else f"  Message: {message}")
+    recipients = recipient_email if isinstance(recipient_email, list) else [recipient_email or ALERT_EMAIL]
+    logger.debug("sendgrid notification start subject=%s to=%s", subject, ','.join(recipients))
     
-    try:
-        logger.info("📤 Preparing SendGrid API request for custom notification...")
-        
-        payload = {
-            "personalizations": [
-                {
-                    "to": [{"email": recipient}],
-                    "subject": subject
-                }
-            ],
-            "from": {
-                "email": ALERT_EMAIL,
-                "name": "System Notification"
-            },
-            "content": [
-                {
-                    "type": "text/plain",
-                    "value": message
-                }
-            ]
+    payload = {
+        "personalizations": [
+            {
+                "to": [{"email": email} for email in recipients],
+                "subject": subject
+            }
+        ],
+        "from": {
+            "email": ALERT_EMAIL,
+            "name": "System Notification"
+        },
+        "content": [
+            {
+                "type": "text/plain",
+                "value": message
+            }
+        ]
+    }
+    return post_sendgrid(payload, "notification")
+
+
+# ============================================================================
+# ALERT DISPATCHER
+# Bounded queue drained by worker threads so request handlers never wait on SendGrid
+# ============================================================================
+
+ALERT_QUEUE_SIZE = int(os.getenv('ALERT_QUEUE_SIZE', 1000))
+ALERT_WORKERS = int(os.getenv('ALERT_WORKERS', 4))
+ALERT_STATUS_HISTORY = int(os.getenv('ALERT_STATUS_HISTORY', 1000))
+SENDGRID_TIMEOUT = (float(os.getenv('SENDGRID_CONNECT_TIMEOUT', 5)), float(os.getenv('SENDGRID_READ_TIMEOUT', 15)))
+
+# One pooled session shared by all dispatcher workers (keeps TLS connections to SendGrid alive)
+sendgrid_session = requests.Session()
+sendgrid_session.mount("https://", requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=ALERT_WORKERS))
+
+
+class AlertDispatcher:
+    """
+    Sends queued email jobs on a fixed pool of background worker threads.
+
+    submit() never blocks: it returns an alert ID immediately, or raises
+    queue.Full when ALERT_QUEUE_SIZE jobs are already waiting. The status of
+    the last ALERT_STATUS_HISTORY jobs is kept for GET /alerts/<alert_id>,
+    in the shared store when it is enabled so any worker can answer.
+    Workers are started on first use so they are created in the process
+    that actually serves requests.
+    """
+
+    def __init__(self, workers=ALERT_WORKERS, queue_size=ALERT_QUEUE_SIZE, history=ALERT_STATUS_HISTORY,
+                 store=None):
+        self.workers = workers
+        self.history = history
+        self.store = store
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._statuses = OrderedDict()
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def _ensure_workers(self):
+        if self._threads:
+            return
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._worker, name=f"alert-dispatcher-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _shared(self):
+        return self.store is not None and self.store.enabled
+
+    def _update_status(self, alert_id, update):
+        """Run update(statuses) on the status map holding alert_id."""
+        if self._shared():
+            self.store.update_records("alert_status", [alert_id], update)
+            return
+        with self._lock:
+            update(self._statuses)
+            while len(self._statuses) > self.history:
+                self._statuses.popitem(last=False)
+
+    def _set_status(self, alert_id, **fields):
+        self._update_status(alert_id, lambda statuses: statuses.setdefault(alert_id, {"alert_id": alert_id}).update(fields))
+
+    def reserve(self, kind, alert_id=None):
+        """
+        Allocate an alert ID for a job that is submitted later (an alert digest);
+        its status is "batching" until then
+
+        Args:
+            alert_id (str): ID to use instead of a new one (a status it already has is kept)
+
+        Returns:
+            str: Alert ID
+        """
+        alert_id = alert_id or uuid.uuid4().hex
+        batching = {"alert_id": alert_id, "type": kind, "status": "batching",
+                    "batching_since": datetime.now().isoformat()}
+        self._update_status(alert_id, lambda statuses: statuses.setdefault(alert_id, batching))
+        return alert_id
+
+    def submit(self, kind, send_func, *args, alert_id=None):
+        """
+        Queue an email job
+
+        Args:
+            kind (str): Job type, reported in the status
+            send_func (callable): send_temperature_alert_email, send_alert_digest or send_custom_notification
+            *args: Arguments for send_func
+            alert_id (str): ID from reserve(), if one was allocated in advance
+
+        Returns:
+            str: Alert ID
+
+        Raises:
+            queue.Full: If the dispatch queue is full
+        """
+        self._ensure_workers()
+        reserved = alert_id is not None
+        if not reserved:
+            alert_id = uuid.uuid4().hex
+        self._set_status(alert_id, type=kind, status="queued", queued_at=datetime.now().isoformat())
+        try:
+            self._queue.put_nowait((alert_id, kind, send_func, args))
+        except queue.Full:
+            if reserved:
+                self._set_status(alert_id, status="rejected", completed_at=datetime.now().isoformat())
+            else:
+                self._update_status(alert_id, lambda statuses: statuses.pop(alert_id, None))
+            ALERT_DISPATCH_REJECTED.inc(kind)
+            raise
+        return alert_id
+
+    def get_status(self, alert_id):
+        if self._shared():
+            return self.store.get_records("alert_status", [alert_id]).get(alert_id)
+        with self._lock:
+            status = self._statuses.get(alert_id)
+            return dict(status) if status else None
+
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def _worker(self):
+        while True:
+            alert_id, kind, send_func, args = self._queue.get()
+            self._set_status(alert_id, status="sending")
+            started = time.perf_counter()
+            try:
+                result = send_func(*args)
+            except Exception as e:
+                logger.exception("alert dispatch crashed alert_id=%s", alert_id)
+                result = {"status": "failed", "error": str(e)}
+            ALERT_DISPATCH_SECONDS.observe(time.perf_counter() - started, kind, result.get("status", "failed"))
+            self._set_status(alert_id, status=result.get("status", "failed"), result=result,
+                             completed_at=datetime.now().isoformat())
+            self._queue.task_done()
+
+
+alert_dispatcher = AlertDispatcher(store=shared_state)
+
+ALERT_DIGEST_WINDOW = float(os.getenv('ALERT_DIGEST_WINDOW', 0))  # seconds; 0 sends one email per alarm
+
+
+class AlertDigest:
+    """
+    Collects alarm notifications for `window` seconds and sends them as one
+    digest email (send_alert_digest): one SendGrid call per window no
+    matter how many PLCs alarm during a site-wide failure.
+
+    The first alarm of a window reserves the digest's alert ID, which every
+    alarm in the window is reported under, and starts the window timer. A
+    digest rejected by a full dispatch queue releases its alarms in the
+    alert engine so the next reading retries them.
+
+    With the shared store enabled the open digest is a shared record that
+    every worker adds to, and the leader sends it once the window has
+    passed (flush_due, run by its background sync), so a window still
+    sends one email.
+    """
+
+    def __init__(self, window=ALERT_DIGEST_WINDOW, store=None):
+        self.window = window
+        self.store = store
+        self._lock = threading.Lock()
+        self._alerts = []
+        self._alert_id = None
+        self._opened_at = None
+
+    def _shared(self):
+        return self.store is not None and self.store.enabled
+
+    def add(self, plc_id, temperature, threshold, reason, slope=None):
+        """
+        Add an alarm to the open digest (opening one if needed)
+
+        Returns:
+            str: The digest's alert ID
+        """
+        alert = {
+            "plc": plc_id,
+            "temperature": temperature,
+            "threshold": threshold,
+            "reason": reason,
+            "slope": slope,
+            "time": datetime.now().strftime('%H:%M:%S')
         }
-        
-        logger.debug(f"  Payload structure: {json.dumps({k: v if k != 'content' else '...' for k, v in payload.items()}, indent=2)}")
-        
-        headers = {
-            "Authorization": f"Bearer {SENDGRID_API_KEY}",
-            "Content-Type": "application/json"
+        if self._shared():
+            return self._add_shared(alert)
+        with self._lock:
+            if self._alert_id is None:
+                self._alert_id = alert_dispatcher.reserve("temperature_digest")
+                self._opened_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+                timer = threading.Timer(self.window, self.flush)
+                timer.daemon = True
+                timer.start()
+            self._alerts.append(alert)
+            return self._alert_id
+
+    def _add_shared(self, alert):
+        new_id = uuid.uuid4().hex
+
+        def add(records):
+            digest = records.get("open")
+            if digest is None:
+                digest = records["open"] = {
+                    "alert_id": new_id,
+                    "opened_at": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                    "opened": time.time(),
+                    "alerts": []
+                }
+            digest["alerts"].append(alert)
+            return digest["alert_id"]
+
+        alert_id = self.store.update_records("digest", ["open"], add)
+        if alert_id == new_id:
+            alert_dispatcher.reserve("temperature_digest", alert_id)
+        return alert_id
+
+    def flush_due(self):
+        """Send the shared digest once its window has passed (run by the leader)."""
+        if not self._shared() or not self.window:
+            return
+        digest = self.store.get_records("digest", ["open"]).get("open")
+        if digest is None or time.time() - digest["opened"] < self.window:
+            return
+        self.flush()
+
+    def flush(self):
+        """Queue the open digest for sending."""
+        if self._shared():
+            digest = self.store.update_records("digest", ["open"], lambda records: records.pop("open", None))
+            if digest is None:
+                return
+            alerts, alert_id, opened_at = digest["alerts"], digest["alert_id"], digest["opened_at"]
+        else:
+            with self._lock:
+                alerts, alert_id, opened_at = self._alerts, self._alert_id, self._opened_at
+                self._alerts, self._alert_id = [], None
+        if not alerts:
+            return
+        try:
+            alert_dispatcher.submit("temperature_digest", send_alert_digest, alerts, opened_at, alert_id=alert_id)
+        except queue.Full:
+            logger.error("alert digest rejected alert_id=%s alerts=%d reason=queue_full", alert_id, len(alerts))
+            for alert in alerts:
+                alert_engine.notification_failed(alert["plc"])
+            return
+        logger.info("alert digest queued alert_id=%s alerts=%d", alert_id, len(alerts))
+
+    def pending(self):
+        if self._shared():
+            digest = self.store.get_records("digest", ["open"]).get("open")
+            return len(digest["alerts"]) if digest else 0
+        with self._lock:
+            return len(self._alerts)
+
+
+alert_digest = AlertDigest(store=shared_state)
+
+
+def queue_custom_notification(subject, message, recipient_email=None, kind="custom_notification"):
+    """
+    Queue a custom email notification for background delivery.
+
+    Args:
+        subject (str): Email subject
+        message (str): Email message content
+        recipient_email (str or list): Recipient email address(es) (defaults to ALERT_EMAIL)
+        kind (str): Job type reported in the alert status and metrics
+
+    Returns:
+        str: Alert ID (see GET /alerts/<alert_id>)
+
+    Raises:
+        queue.Full: If the dispatch queue is full
+    """
+    return alert_dispatcher.submit(kind, send_custom_notification, subject, message, recipient_email)
+
+
+@app.route('/alerts/<alert_id>', methods=['GET'])
+def get_alert_status(alert_id):
+    """
+    Get dispatch status of a queued alert: queued, sending, sent or failed
+    """
+    status = alert_dispatcher.get_status(alert_id)
+    if status is None:
+        return jsonify({"status": "error", "message": f"Unknown alert ID: {alert_id}"}), 404
+    return jsonify(status), 200
+
+
+# ============================================================================
+# ALERT ENGINE
+# Per-PLC alarm state with hysteresis so only transitions send email
+# ============================================================================
+
+ALERT_HYSTERESIS = float(os.getenv('ALERT_HYSTERESIS', 0.5))
+ALERT_RENOTIFY_INTERVAL = float(os.getenv('ALERT_RENOTIFY_INTERVAL', 900))
+ALERT_MIN_NOTIFY_GAP = float(os.getenv('ALERT_MIN_NOTIFY_GAP', 300))  # per PLC, across alarm episodes
+ALERT_DEFAULT_KEY = "DEFAULT"  # alarm key for /temperature/alert calls without a 'plc'
+ALERT_TOTALS_KEY = "*"  # shared alarm record holding the totals (never a valid PLC id)
+# Rules on rolling statistics (both off by default):
+# raise only when every reading over the window is above threshold (filters single-sample spikes)
+ALERT_SUSTAIN_WINDOW = float(os.getenv('ALERT_SUSTAIN_WINDOW', 0))
+# ... once the readings span this fraction of it (before that the minimum may be the spike itself)
+ALERT_SUSTAIN_MIN_SPAN = float(os.getenv('ALERT_SUSTAIN_MIN_SPAN', 0.5))
+# raise when the temperature climbs faster than this many °C/minute, even below threshold
+ALERT_RATE_LIMIT = float(os.getenv('ALERT_RATE_LIMIT')) if os.getenv('ALERT_RATE_LIMIT') else None
+
+
+class AlertEngine:
+    """
+    Tracks alarm state per PLC: normal -> alarming -> cleared -> normal.
+
+    A PLC starts alarming when its temperature rises above the threshold and
+    only clears once it drops below threshold - hysteresis, so a sensor
+    hovering at the threshold does not flap. While alarming, repeat
+    notifications are sent at most every renotify_interval seconds; every
+    other over-threshold check is counted as suppressed. A new alarm episode
+    within min_notify_gap seconds of the PLC's last email is suppressed as
+    well, so a sensor swinging wider than the hysteresis band cannot send
+    an email per swing.
+
+    Two optional rules use the PLC's rolling statistics: with sustain_window
+    the alarm is raised only once the sustained minimum is also above
+    threshold (no minimum yet means not sustained), and with rate_limit a PLC heating faster than rate_limit
+    °C/minute alarms (reason "rate") while still below threshold. The slope
+    must stay above the limit for sustain_window seconds, since one spike
+    also steepens the slope; a rate alarm clears once the slope is under
+    half the limit.
+
+    With the shared store enabled the alarm states live there and every
+    evaluation is one transaction on them, so a PLC alarms once no matter
+    which worker checks it.
+    """
+
+    def __init__(self, hysteresis=ALERT_HYSTERESIS, renotify_interval=ALERT_RENOTIFY_INTERVAL,
+                 rate_limit=ALERT_RATE_LIMIT, sustain_window=ALERT_SUSTAIN_WINDOW,
+                 min_notify_gap=ALERT_MIN_NOTIFY_GAP, store=None):
+        self.hysteresis = hysteresis
+        self.renotify_interval = renotify_interval
+        self.min_notify_gap = min_notify_gap
+        self.rate_limit = rate_limit
+        self.sustain_window = sustain_window
+        self.store = store
+        self._states = {}
+        self._lock = threading.Lock()
+        self.totals = {"notified": 0, "suppressed": 0, "cleared": 0}
+
+    def _shared(self):
+        return self.store is not None and self.store.enabled
+
+    @staticmethod
+    def _new_state():
+        return {
+            "state": "normal",
+            "reason": None,
+            "since": datetime.now().isoformat(),
+            "last_notified": None,
+            "last_notified_at": None,
+            "rising_since": None,
+            "notifications": 0,
+            "suppressed": 0,
+            "last_temperature": None,
+            "threshold": None
         }
-        
-        logger.debug(f"  Headers: Authorization: Bearer [***hidden***], Content-Type: application/json")
-        logger.info("🔗 Sending request to SendGrid API (https://api.sendgrid.com/v3/mail/send)...")
-        
-        response = requests.post(
-            "https://api.sendgrid.com/v3/mail/send",
-            headers=headers,
-            json=payload
-        )
-        
-        logger.info(f"📥 Received response from SendGrid:")
-        logger.info(f"  Status Code: {response.status_code}")
-        logger.info(f"  Response Headers: {dict(response.headers)}")
-        logger.debug(f"  Response Body: {response.text}")
-        
-        if response.status_code == 202:
-            logger.info("✅ CUSTOM NOTIFICATION SENT SUCCESSFULLY! (Status: 202 Accepted)")
-            logger.info("=" * 80)
-            return {
-                "status": "sent",
-                "message": "Email sent successfully",
-                "response_code": response.status_code
-            }
+
+    def _update(self, plc_ids, update):
+        """
+        Run update(states, totals) on the alarm states of plc_ids (created on
+        first use) and the totals: in this process, or with the shared store
+        enabled as one transaction on the state every worker uses
+        """
+        with self._lock:
+            if not self._shared():
+                for plc_id in plc_ids:
+                    if plc_id not in self._states:
+                        self._states[plc_id] = self._new_state()
+                return update(self._states, self.totals)
+
+            def shared_update(records):
+                totals = records.setdefault(ALERT_TOTALS_KEY, {"notified": 0, "suppressed": 0, "cleared": 0})
+                for plc_id in plc_ids:
+                    if plc_id not in records:
+                        records[plc_id] = self._new_state()
+                return update(records, totals)
+
+            return self.store.update_records("alarm", [*plc_ids, ALERT_TOTALS_KEY], shared_update)
+
+    def _transition(self, state, new_state):
+        state["state"] = new_state
+        state["since"] = datetime.now().isoformat()
+
+    def evaluate(self, plc_id, temperature, threshold, sustained=None, slope=None):
+        """
+        Evaluate a reading against a threshold
+
+        Args:
+            sustained (float): Lowest reading over the sustain window, or None
+                               while it is not covered yet (ignored without sustain_window)
+            slope (float): Temperature slope in °C/minute, or None
+
+        Returns:
+            tuple: (decision, state) where decision is 'notify', 'suppressed',
+                   'cleared' or 'ok' and state is a copy of the PLC's alarm state
+        """
+        return self.evaluate_many([(plc_id, temperature, threshold, sustained, slope)])[0]
+
+    def evaluate_many(self, checks):
+        """
+        Evaluate several readings in order, in one update of the alarm state
+
+        Args:
+            checks (list): [(plc_id, temperature, threshold, sustained, slope), ...]
+
+        Returns:
+            list: (decision, state) per check, as returned by evaluate
+        """
+        now = time.time()  # wall clock: alarm state may be shared between processes
+
+        def update(states, totals):
+            return [self._evaluate(states[plc_id], totals, now, temperature, threshold, sustained, slope)
+                    for plc_id, temperature, threshold, sustained, slope in checks]
+
+        return self._update({check[0] for check in checks}, update)
+
+    def _evaluate(self, state, totals, now, temperature, threshold, sustained, slope):
+        state["last_temperature"] = temperature
+        state["threshold"] = threshold
+        if not self.sustain_window:
+            over = temperature > threshold
         else:
-            logger.error(f"❌ SendGrid API returned unexpected status code: {response.status_code}")
-            logger.error(f"  Response text: {response.text}")
-            logger.info("=" * 80)
-            return {
-                "status": "failed",
-                "error": f"SendGrid API error: {response.status_code}"
-            }
-    except Exception as e:
-        logger.error(f"❌ EXCEPTION occurred while sending custom notification: {type(e).__name__}")
-        logger.error(f"  Error message: {str(e)}")
-        logger.exception(f"  Full traceback:")
-        logger.info("=" * 80)
+            over = sustained is not None and min(temperature, sustained) > threshold
+        rising_fast = self.rate_limit is not None and slope is not None and slope > self.rate_limit
+        if not rising_fast:
+            state["rising_since"] = None
+        elif state["rising_since"] is None:
+            state["rising_since"] = now
+        rate_alarm = rising_fast and now - state["rising_since"] >= self.sustain_window
+
+        if state["state"] == "alarming":
+            if state["reason"] == "rate" and over:
+                state["reason"] = "threshold"
+            if state["reason"] == "rate":
+                cleared = temperature <= threshold and (slope is None or slope < self.rate_limit / 2)
+                active = rising_fast
+            else:
+                cleared = temperature < threshold - self.hysteresis
+                active = temperature > threshold
+            if cleared:
+                self._transition(state, "cleared")
+                state["reason"] = None
+                totals["cleared"] += 1
+                decision = "cleared"
+            elif not active:
+                decision = "ok"  # inside the hysteresis band: still alarming, nothing to send
+            elif state["last_notified"] is None or now - state["last_notified"] >= self.renotify_interval:
+                decision = "notify"
+            else:
+                decision = "suppressed"
+        elif over or rate_alarm:
+            self._transition(state, "alarming")
+            state["reason"] = "threshold" if over else "rate"
+            if state["last_notified"] is not None and now - state["last_notified"] < self.min_notify_gap:
+                decision = "suppressed"  # new episode too soon after the last email
+            else:
+                decision = "notify"
+        else:
+            if state["state"] == "cleared":
+                self._transition(state, "normal")
+            decision = "ok"
+
+        if decision == "suppressed":
+            state["suppressed"] += 1
+            totals["suppressed"] += 1
+
+        if decision == "notify":
+            state["last_notified"] = now
+            state["last_notified_at"] = datetime.now().isoformat()
+            state["notifications"] += 1
+            totals["notified"] += 1
+
+        ALERT_DECISIONS.inc(decision)
+        return decision, self._public(state, now)
+
+    def notification_failed(self, plc_id):
+        """Forget the last notification so the next over-threshold reading retries."""
+        def update(states, totals):
+            state = states[plc_id]
+            state["last_notified"] = None
+            state["notifications"] -= 1
+            totals["notified"] -= 1
+
+        self._update([plc_id], update)
+
+    def _public(self, state, now):
+        public = {k: v for k, v in state.items() if k not in ("last_notified", "rising_since")}
+        if state["last_notified"] is None:
+            public["renotify_in"] = 0
+        else:
+            public["renotify_in"] = round(max(0.0, self.renotify_interval - (now - state["last_notified"])), 1)
+        return public
+
+    def snapshot(self):
+        """All PLC alarm states plus totals."""
+        now = time.time()
+        if self._shared():
+            states = self.store.get_records("alarm")
+            totals = states.pop(ALERT_TOTALS_KEY, {"notified": 0, "suppressed": 0, "cleared": 0})
+        else:
+            with self._lock:
+                states = {plc_id: dict(state) for plc_id, state in self._states.items()}
+                totals = dict(self.totals)
         return {
-            "status": "failed",
-            "error": str(e)
+            "hysteresis": self.hysteresis,
+            "renotify_interval": self.renotify_interval,
+            "min_notify_gap": self.min_notify_gap,
+            "sustain_window": self.sustain_window or None,
+            "rate_limit": self.rate_limit,
+            "digest_window": ALERT_DIGEST_WINDOW or None,
+            "totals": totals,
+            "plcs": {plc_id: self._public(state, now) for plc_id, state in states.items()}
         }
 
 
+alert_engine = AlertEngine(store=shared_state)
+
+
+def rolling_alert_inputs(plc_id):
+    """
+    Rolling statistics for the alert rules, read in O(1) from the PLC's
+    RollingStats (no pass over history)
+
+    Returns:
+        tuple: (lowest reading over ALERT_SUSTAIN_WINDOW, slope in °C/minute);
+               each None when its rule is disabled or its window is not covered yet
+    """
+    stats = rolling_stats.get(plc_id)
+    if stats is None:
+        return None, None
+    sustained = stats.minimum(ALERT_SUSTAIN_WINDOW, ALERT_SUSTAIN_MIN_SPAN) if ALERT_SUSTAIN_WINDOW else None
+    slope = stats.slope() if ALERT_RATE_LIMIT is not None else None
+    return sustained, slope
+
+
+def queue_alarm_notification(plc_id, temperature, threshold, alarm, slope=None):
+    """
+    Queue the email for an alarm: the threshold alert, or for a rate alarm
+    a notification with the rate of rise (slope, °C/minute), to the PLC's
+    recipients. With ALERT_DIGEST_WINDOW set the alarm joins the open digest.
+
+    Returns:
+        str: Alert ID (the digest's, in digest mode)
+
+    Raises:
+        queue.Full: If the dispatch queue is full
+    """
+    if ALERT_DIGEST_WINDOW > 0:
+        return alert_digest.add(plc_id, temperature, threshold, alarm["reason"], slope)
+    if alarm["reason"] != "rate":
+        return alert_dispatcher.submit("temperature_alert", send_temperature_alert_email, temperature, threshold, plc_id)
+    return queue_custom_notification(
+        f"Temperature rising fast on {plc_id}",
+        f"{plc_id} is at {temperature}°C and rising {slope:.2f}°C/min "
+        f"(limit {alert_engine.rate_limit}°C/min, threshold {threshold}°C).",
+        alert_recipients(plc_id),
+        kind="rate_alert"
+    )
+
+ALERT_ON_INGEST = os.getenv('ALERT_ON_INGEST', 'true').lower() in ('1', 'true', 'yes')
+
+
+def ingest_alert_check(plc_id, temperature):
+    """
+    The alert check for a newly ingested reading against the PLC's configured
+    threshold (threshold_config['<plc>_threshold']), taken right after the
+    reading entered the rolling statistics
+
+    Returns:
+        tuple: (plc_id, temperature, threshold, sustained, slope) for
+               evaluate_ingest_alerts, or None if the reading is not evaluated
+    """
+    if not ALERT_ON_INGEST:
+        return None
+    threshold = state.snapshot.threshold_config.get(f"{plc_id.lower()}_threshold")
+    if threshold is None:
+        return None
+    sustained, slope = rolling_alert_inputs(plc_id)
+    return plc_id, temperature, threshold, sustained, slope
+
+
+def evaluate_ingest_alerts(checks):
+    """
+    Evaluate ingest alert checks (see ingest_alert_check) in one alert engine
+    update and queue an alert on each transition
+
+    Returns:
+        list: The alert engine decision per check
+    """
+    decisions = []
+    for (plc_id, temperature, threshold, _, slope), (decision, alarm) in zip(checks, alert_engine.evaluate_many(checks)):
+        if decision == "notify":
+            logger.warning("alert triggered plc=%s current=%s threshold=%s reason=%s slope=%s source=ingest",
+                           plc_id, temperature, threshold, alarm["reason"], slope)
+            try:
+                queue_alarm_notification(plc_id, temperature, threshold, alarm, slope)
+            except queue.Full:
+                alert_engine.notification_failed(plc_id)
+                logger.error("alert rejected plc=%s reason=queue_full source=ingest", plc_id)
+        elif decision == "cleared":
+            logger.info("alarm cleared plc=%s current=%s threshold=%s", plc_id, temperature, threshold)
+        decisions.append(decision)
+    return decisions
+
+
+@app.route('/alerts/state', methods=['GET'])
+def get_alert_state():
+    """
+    Get alarm state per PLC, including notification and suppression counts
+    """
+    return jsonify(alert_engine.snapshot()), 200
+
+
+# ============================================================================
+# SERVING
+# `python app.py` runs the development server; production runs under gunicorn
+# (see gunicorn.conf.py), which calls start_background_services in each worker
+# ============================================================================
+
+def start_background_services():
+    """
+    Start per-process background work. Only the leader (see elect_leader)
+    runs the PLC poller, writes history segments, evaluates ingest alerts
+    and sends alert digests; the other workers receive its readings
+    through the shared state store.
+    """
+    leader = elect_leader()
+    shared_state.start()
+    if POLLER_ENABLED and leader:
+        plc_poller.start()
+
+
 if __name__ == '__main__':
     port = int(os.environ.get("PORT", 5000))
-    app.run(host='0.0.0.0', port=port)
+    start_background_services()
+    app.run(host='0.0.0.0', port=port, threaded=True)
@@ -0,0 +1,360 @@
+"""
+End-to-end load test for the temperature server.
+
+Starts N simulated Modbus TCP PLCs (pymodbus server, temperature in
+register 8959), a local SendGrid stand-in and the app itself (gunicorn,
+as in the Procfile, or the Flask dev server), then drives each workload
+for a fixed time and reports throughput and p50/p99 latency per endpoint.
+
+Usage:
+    python benchmark.py                                   # all workloads, 20 PLCs, gunicorn
+    python benchmark.py --plcs 300 --workloads read-plc,plc-data --duration 20
+    python benchmark.py --server flask --json baseline.json
+    python benchmark.py --url http://localhost:5000 --workloads ingest
+
+With --url the app is not started; it must already be configured with
+the simulators (see --print-registry) and SENDGRID_API_URL.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+from pymodbus.datastore import ModbusDeviceContext, ModbusSequentialDataBlock, ModbusServerContext
+from pymodbus.server import ModbusTcpServer
+
+TEMPERATURE_REGISTER = 8959
+WORKLOADS = ("ingest", "batch", "binary", "read-plc", "plc-data", "alert")
+BINARY_RECORD = struct.Struct("<HHhq")  # same layout as app.BINARY_RECORD
+
+logging.getLogger("pymodbus").setLevel(logging.ERROR)
+
+
+# ============================================================================
+# SIMULATED PLCS
+# ============================================================================
+
+class PlcSimulators:
+    """
+    N Modbus TCP servers on consecutive ports, served from one asyncio loop
+    on a background thread. PLC i reports temperature 20 + (i % 15) in
+    register 8959 (writable setpoint/threshold registers follow it).
+    """
+
+    def __init__(self, count, base_port, host="127.0.0.1"):
+        self.count = count
+        self.base_port = base_port
+        self.host = host
+        self._servers = []
+        self._loop = None
+        self._thread = None
+        self._ready = threading.Event()
+
+    def plc_id(self, index):
+        return f"SIM{index + 1}"
+
+    def registry(self):
+        """PLC registry entries (PLC_REGISTRY_FILE format) pointing at the simulators."""
+        return {
+            self.plc_id(i): {"ip": self.host, "port": self.base_port + i, "slave_unit": 1, "index": i, "threshold": 30.0}
+            for i in range(self.count)
+        }
+
+    def start(self):
+        self._thread = threading.Thread(target=self._thread_main, name="plc-simulators", daemon=True)
+        self._thread.start()
+        if not self._ready.wait(timeout=30):
+            raise RuntimeError("Modbus simulators did not start")
+
+    def _thread_main(self):
+        self._loop = asyncio.new_event_loop()
+        self._loop.run_until_complete(self._serve())
+
+    async def _serve(self):
+        tasks = []
+        for i in range(self.count):
+            # Block address is 1-based: register 8959 is the first value
+            block = ModbusSequentialDataBlock(TEMPERATURE_REGISTER + 1, [20 + i % 15, 0, 0, 0])
+            context = ModbusServerContext(devices=ModbusDeviceContext(hr=block), single=True)
+            server = ModbusTcpServer(context, address=(self.host, self.base_port + i))
+            self._servers.append(server)
+            tasks.append(asyncio.create_task(server.serve_forever()))
+        await asyncio.sleep(0.5)
+        self._ready.set()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stop(self):
+        if self._loop is None:
+            return
+        for server in self._servers:
+            asyncio.run_coroutine_threadsafe(server.shutdown(), self._loop)
+        self._thread.join(timeout=5)
+
+
+# ============================================================================
+# SENDGRID STAND-IN
+# ============================================================================
+
+class FakeSendGrid:
+    """Accepts POST /v3/mail/send with 202 after a configurable delay and counts the emails."""
+
+    def __init__(self, port, latency):
+        self.latency = latency
+        self.received = 0
+        self._lock = threading.Lock()
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                time.sleep(fake.latency)
+                with fake._lock:
+                    fake.received += 1
+                self.send_response(202)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self.url = f"http://127.0.0.1:{self._server.server_port}/v3/mail/send"
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, name="fake-sendgrid", daemon=True).start()
+
+    def stop(self):
+        self._server.shutdown()
+
+
+# ============================================================================
+# APP UNDER TEST
+# ============================================================================
+
+def start_app(args, simulators, sendgrid, workdir):
+    """Start the app with the simulators as its registry; returns (process, base URL)."""
+    registry_file = os.path.join(workdir, "plcs.json")
+    with open(registry_file, "w") as f:
+        json.dump(simulators.registry(), f)
+
+    env = dict(os.environ)
+    env.update({
+        "PORT": str(args.port),
+        "PLC_REGISTRY_FILE": registry_file,
+        "CONFIG_DB": os.path.join(workdir, "config.db"),
+        "LOG_FILE": os.path.join(workdir, "server.log"),
+        "LOG_LEVEL": args.log_level,
+        "SENDGRID_API_KEY": "benchmark",
+        "SENDGRID_API_URL": sendgrid.url,
+        "POLLER_ENABLED": "true" if args.poller else "false",
+        "HISTORY_DIR": os.path.join(workdir, "history"),
+    })
+    if args.workers:
+        env["WEB_CONCURRENCY"] = str(args.workers)
+
+    app_dir = os.path.dirname(os.path.abspath(__file__))
+    if args.server == "gunicorn":
+        command = [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "app:app"]
+    else:
+        command = [sys.executable, "app.py"]
+    process = subprocess.Popen(command, cwd=app_dir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT)
+
+    url = f"http://127.0.0.1:{args.port}"
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"App exited with code {process.returncode} (see {env['LOG_FILE']})")
+        try:
+            if requests.get(f"{url}/", timeout=1).status_code == 200:
+                return process, url
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("App did not become ready within 30s")
+
+
+def stop_app(process):
+    process.terminate()
+    try:
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+# ============================================================================
+# WORKLOADS
+# ============================================================================
+
+def make_request(workload, session, url, plc_ids, batch_size, rng):
+    """Send one request of a workload; returns the response."""
+    plc = rng.choice(plc_ids)
+    if workload == "ingest":
+        return session.post(f"{url}/temperature", json={
+            "plc": plc, "temperature": round(rng.uniform(18, 35), 1), "register": TEMPERATURE_REGISTER
+        }, timeout=30)
+    if workload == "batch":
+        readings = [{"plc": rng.choice(plc_ids), "temperature": round(rng.uniform(18, 35), 1)}
+                    for _ in range(batch_size)]
+        return session.post(f"{url}/temperature/batch", json=readings, timeout=30)
+    if workload == "binary":
+        now_ms = int(time.time() * 1000)
+        body = b"".join(BINARY_RECORD.pack(rng.randrange(len(plc_ids)), TEMPERATURE_REGISTER, rng.randint(180, 350), now_ms)
+                        for _ in range(batch_size))
+        return session.post(f"{url}/temperature/binary", data=body, timeout=30,
+                            headers={"Content-Type": "application/octet-stream"})
+    if workload == "read-plc":
+        return session.get(f"{url}/read-plc/{plc}", timeout=30)
+    if workload == "plc-data":
+        return session.get(f"{url}/plc-data", timeout=30)
+    if workload == "alert":
+        # Swing across the threshold so alarms are raised, suppressed and cleared
+        return session.post(f"{url}/temperature/alert", json={
+            "plc": plc, "current_temperature": rng.choice((25.0, 31.0, 35.0)), "threshold_temperature": 30.0
+        }, timeout=30)
+    raise ValueError(f"Unknown workload: {workload}")
+
+
+def run_workload(workload, url, plc_ids, duration, concurrency, batch_size):
+    """
+    Drive one workload from `concurrency` client threads for `duration` seconds
+
+    Returns:
+        dict: requests, errors, throughput (req/s) and latency percentiles (ms)
+    """
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def client(seed):
+        rng = random.Random(seed)
+        session = requests.Session()
+        local_latencies = []
+        local_errors = 0
+        while time.monotonic() < deadline:
+            started = time.perf_counter()
+            try:
+                response = make_request(workload, session, url, plc_ids, batch_size, rng)
+                if response.status_code >= 500:
+                    local_errors += 1
+            except requests.RequestException:
+                local_errors += 1
+            local_latencies.append(time.perf_counter() - started)
+        with lock:
+            latencies.extend(local_latencies)
+            errors[0] += local_errors
+
+    started = time.monotonic()
+    threads = [threading.Thread(target=client, args=(seed,)) for seed in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+
+    latencies.sort()
+    return {
+        "workload": workload,
+        "requests": len(latencies),
+        "errors": errors[0],
+        "throughput": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "max_ms": round(latencies[-1] * 1000, 2) if latencies else 0.0
+    }
+
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, int(round(p / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[rank]
+
+
+def print_results(results):
+    print(f"{'workload':<10} {'requests':>9} {'errors':>7} {'req/s':>9} {'p50 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for r in results:
+        print(f"{r['workload']:<10} {r['requests']:>9} {r['errors']:>7} {r['throughput']:>9} "
+              f"{r['p50_ms']:>9} {r['p99_ms']:>9} {r['max_ms']:>9}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the temperature server against simulated PLCs")
+    parser.add_argument("--plcs", type=int, default=20, help="number of simulated PLCs")
+    parser.add_argument("--sim-port", type=int, default=15020, help="first simulator port")
+    parser.add_argument("--workloads", default=",".join(WORKLOADS), help=f"comma separated: {', '.join(WORKLOADS)}")
+    parser.add_argument("--duration", type=float, default=10, help="seconds per workload")
+    parser.add_argument("--concurrency", type=int, default=16, help="client threads per workload")
+    parser.add_argument("--batch-size", type=int, default=100, help="readings per batch or binary request")
+    parser.add_argument("--server", choices=("gunicorn", "flask"), default="gunicorn", help="how to start the app")
+    parser.add_argument("--workers", type=int, help="gunicorn workers (WEB_CONCURRENCY)")
+    parser.add_argument("--port", type=int, default=18080, help="app port when the benchmark starts it")
+    parser.add_argument("--url", help="benchmark an already running app instead of starting one")
+    parser.add_argument("--poller", action="store_true", help="enable the background poller in the app")
+    parser.add_argument("--sendgrid-port", type=int, default=0, help="SendGrid stand-in port (0 = any)")
+    parser.add_argument("--sendgrid-latency", type=float, default=0.05, help="SendGrid stand-in delay in seconds")
+    parser.add_argument("--log-level", default="WARNING", help="app LOG_LEVEL")
+    parser.add_argument("--json", help="also write the results to this file")
+    parser.add_argument("--print-registry", action="store_true", help="print the simulator registry JSON and exit")
+    args = parser.parse_args()
+
+    workloads = [w.strip() for w in args.workloads.split(",") if w.strip()]
+    unknown = set(workloads) - set(WORKLOADS)
+    if unknown:
+        parser.error(f"unknown workloads: {', '.join(sorted(unknown))}")
+
+    simulators = PlcSimulators(args.plcs, args.sim_port)
+    if args.print_registry:
+        print(json.dumps(simulators.registry(), indent=2))
+        return
+
+    sendgrid = FakeSendGrid(args.sendgrid_port, args.sendgrid_latency)
+    simulators.start()
+    sendgrid.start()
+    process = None
+    try:
+        with tempfile.TemporaryDirectory(prefix="temperature-benchmark-") as workdir:
+            if args.url:
+                url = args.url.rstrip("/")
+            else:
+                process, url = start_app(args, simulators, sendgrid, workdir)
+            print(f"app={url} plcs={args.plcs} concurrency={args.concurrency} duration={args.duration}s "
+                  f"server={'external' if args.url else args.server}")
+
+            plc_ids = [simulators.plc_id(i) for i in range(args.plcs)]
+            results = []
+            for workload in workloads:
+                result = run_workload(workload, url, plc_ids, args.duration, args.concurrency, args.batch_size)
+                results.append(result)
+                print(f"{workload}: {result['throughput']} req/s p50={result['p50_ms']}ms p99={result['p99_ms']}ms")
+            if process is not None:
+                stop_app(process)
+                process = None
+    finally:
+        if process is not None:
+            stop_app(process)
+        sendgrid.stop()
+        simulators.stop()
+
+    print()
+    print_results(results)
+    print(f"sendgrid emails received: {sendgrid.received}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"args": vars(args), "results": results, "sendgrid_received": sendgrid.received}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
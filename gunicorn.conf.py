@@ -0,0 +1,46 @@
+# Gunicorn configuration for production serving
+# Usage: gunicorn -c gunicorn.conf.py app:app
+
+import multiprocessing
+import os
+import tempfile
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+
+# Worker processes x threads per worker. Workers share readings, history, alarm
+# state and alert digests through the SQLite state store (see SharedStateStore in
+# app.py); one elected leader polls the PLCs, writes history and sends digests.
+workers = int(os.environ.get('WEB_CONCURRENCY', min(multiprocessing.cpu_count() * 2 + 1, 8)))
+# Every open /stream (SSE) dashboard holds a gthread thread for as long as it is
+# connected, so a worker needs STREAM_MAX_CLIENTS threads for streams plus headroom
+# for everything else. The app rejects streams beyond STREAM_MAX_CLIENTS with 503,
+# which keeps the headroom free for the other endpoints.
+threads = int(os.environ.get('GUNICORN_THREADS', int(os.environ.get('STREAM_MAX_CLIENTS', 200)) + 32))
+worker_class = 'gthread'
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+graceful_timeout = 20
+
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG')  # e.g. '-' for stdout; off by default
+errorlog = '-'
+
+# Workers share state through a SQLite database. Give each server run a fresh one
+# so no state leaks in from a previous deploy.
+os.environ.setdefault('SHARED_STATE', 'true')
+if 'STATE_DB' not in os.environ:
+    _state_dir = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+    os.environ['STATE_DB'] = os.path.join(_state_dir, f"temperature-server-{os.getpid()}.db")
+
+
+def post_worker_init(worker):
+    from app import start_background_services
+    start_background_services()
+
+
+def on_exit(server):
+    state_db = os.environ['STATE_DB']
+    for suffix in ('', '-wal', '-shm', '.leader.lock'):
+        try:
+            os.remove(state_db + suffix)
+        except OSError:
+            pass
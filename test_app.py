@@ -0,0 +1,200 @@
+"""
+Smoke tests for the temperature server (run with `python -m pytest`)
+"""
+import json
+import os
+import tempfile
+import time
+from datetime import datetime
+
+import pytest
+
+_tmp = tempfile.mkdtemp()
+os.environ.update({
+    "LOG_FILE": "",
+    "CONFIG_DB": os.path.join(_tmp, "config.db"),
+    "PLC_REGISTRY_FILE": os.path.join(_tmp, "plcs.json"),
+    "HISTORY_DIR": "",
+    "POLLER_ENABLED": "false",
+})
+
+import app  # noqa: E402
+
+
+def test_stream_sends_state_on_connect():
+    client = app.app.test_client()
+    response = client.get('/stream', buffered=False)
+    assert response.status_code == 200
+    first = next(iter(response.response))
+    response.close()
+    message = first.decode() if isinstance(first, bytes) else first
+    lines = dict(line.split(': ', 1) for line in message.strip().splitlines())
+    assert lines["event"] == "state"
+    payload = json.loads(lines["data"])
+    assert set(payload["plcs"]) == set(app.plc_registry.devices)
+
+
+def test_alarm_flapping_around_threshold_notifies_once():
+    engine = app.AlertEngine(hysteresis=0.5, min_notify_gap=300)
+    decisions = [engine.evaluate("PLC1", temperature, 30.0)[0] for temperature in (31, 29, 31, 29, 31, 29)]
+    assert decisions.count("notify") == 1
+    assert engine.totals["suppressed"] == 2
+
+
+def test_alert_check_rejects_unregistered_plc():
+    client = app.app.test_client()
+    response = client.post('/temperature/alert', json={
+        "plc": "NOT-A-PLC", "current_temperature": 20, "threshold_temperature": 30
+    })
+    assert response.status_code == 404
+    assert "NOT-A-PLC" not in app.alert_engine.snapshot()["plcs"]
+
+
+def test_stream_rejects_clients_over_the_limit(monkeypatch):
+    monkeypatch.setattr(app.state_broadcaster, "max_clients", app.state_broadcaster.clients)
+    response = app.app.test_client().get('/stream')
+    assert response.status_code == 503
+
+
+def test_batch_readings_use_their_own_timestamps_for_slope():
+    client = app.app.test_client()
+    response = client.post('/temperature/batch', json=[
+        {"plc": "PLC1", "temperature": 24.0},
+        {"plc": "PLC1", "temperature": 24.1},
+    ])
+    assert response.json["accepted"] == 2
+    assert app.rolling_stats["PLC1"].slope() is None  # microseconds apart: no slope yet
+
+    assert client.get('/plc-data').json["PLC2"]["stats"] is None  # cached before PLC2's readings
+    now = time.time()
+    client.post('/temperature/batch', json=[
+        {"plc": "PLC2", "temperature": 20 + i * 0.5, "timestamp": now - 600 + i * 60} for i in range(10)
+    ])
+    assert abs(app.rolling_stats["PLC2"].slope() - 0.5) < 1e-6
+
+    stats = client.get('/stats/PLC2').json["stats"]
+    assert stats["windows"]["900s"]["count"] == 10
+    assert client.get('/plc-data').json["PLC2"]["stats"] == stats
+
+
+def test_binary_readings_clamp_out_of_range_timestamps():
+    index = {plc: i for i, plc in app.plc_registry.by_index.items()}["PLC1"]
+    before = time.time()
+    body = b"".join(app.BINARY_RECORD.pack(index, 0, 215, timestamp_ms) for timestamp_ms in (2 ** 62, -1000))
+    response = app.app.test_client().post('/temperature/binary', data=body,
+                                          content_type='application/octet-stream')
+    assert response.status_code == 200
+    assert response.json["accepted"] == 2
+    values = [value for _, chunk in app.history_store["PLC1"].iter_range(before, time.time() + 1) for value in chunk]
+    assert values == [21.5, 21.5]
+    reading = app.app.test_client().get('/plc-data').json["PLC1"]
+    assert datetime.fromisoformat(reading["timestamp"]).timestamp() >= before - 1
+
+
+def test_readings_match_registered_plcs_case_insensitively():
+    client = app.app.test_client()
+    client.post('/temperature', json={"plc": "plc1", "temperature": 22.5})
+    assert client.get('/plc-data').json["PLC1"]["temperature"] == 22.5
+    response = client.post('/temperature/batch', json=[{"plc": " plc2 ", "temperature": 23.5}])
+    assert response.json["accepted"] == 1
+    assert client.get('/plc-data').json["PLC2"]["temperature"] == 23.5
+
+
+def test_sustain_rule_ignores_a_lone_spike():
+    stats = app.RollingStats((60,), 60)
+    engine = app.AlertEngine(sustain_window=60)
+    now = time.time()
+    stats.update(now, 50.0)
+    assert stats.minimum(60, 0.5) is None
+    assert engine.evaluate("PLC1", 50.0, 30.0, stats.minimum(60, 0.5))[0] == "ok"
+
+    for i in range(1, 7):
+        stats.update(now + i * 10, 50.0)
+    assert stats.minimum(60, 0.5) == 50.0
+    assert engine.evaluate("PLC1", 50.0, 30.0, stats.minimum(60, 0.5))[0] == "notify"
+
+
+def test_register_blocks_merge_within_gap_and_read_limits():
+    register_map = {
+        "temperature": {"address": 0, "type": "int16", "scale": 0.1},
+        "setpoint": {"address": 1, "type": "float32"},
+        "status": {"address": 11, "type": "uint16"},  # 8 unused registers after setpoint: merged
+        "far": {"address": 21, "type": "uint16"},  # 9 unused registers: new block
+        "edge": {"address": 145, "type": "int32"},  # within the gap but past 125 registers: new block
+    }
+    register_map.update({f"fill{address}": {"address": address, "type": "uint16"} for address in range(29, 144, 8)})
+    plan = app.plan_register_blocks(register_map, max_count=125, max_gap=8)
+    assert [(block["address"], block["count"]) for block in plan] == [(0, 12), (21, 121), (145, 2)]
+    assert all(block["count"] <= app.MODBUS_MAX_READ_COUNT for block in plan)
+
+    values = {name: 0 for name in register_map}
+    values.update({"temperature": -12.5, "setpoint": 21.25, "status": 7, "far": 65535, "edge": -100000})
+    block_registers = []
+    for block in plan:
+        registers = [0] * block["count"]
+        for name, offset, spec in block["fields"]:
+            encoded = app.encode_register_value(spec, values[name])
+            registers[offset:offset + len(encoded)] = encoded
+        block_registers.append(registers)
+    assert app.decode_register_blocks(plan, block_registers) == values
+
+
+def test_circuit_breaker_half_open_probe_and_cooldown_doubling(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(app.time, "monotonic", lambda: clock[0])
+    breaker = app.CircuitBreaker("PLC1", threshold=2, cooldown=1.0, cooldown_max=3.0)
+
+    breaker.acquire()
+    breaker.record_failure()
+    assert breaker.state == "closed"
+    breaker.record_failure()
+    assert breaker.state == "open" and breaker.open_until == 1001.0
+    with pytest.raises(app.CircuitOpenError):
+        breaker.acquire()
+
+    clock[0] = 1001.0
+    breaker.acquire()  # the single probe
+    assert breaker.state == "half_open"
+    with pytest.raises(app.CircuitOpenError):
+        breaker.acquire()
+    breaker.record_failure()
+    assert breaker.state == "open" and breaker.open_until == 1003.0  # cooldown doubled
+
+    clock[0] = 1003.0
+    breaker.acquire()
+    breaker.record_failure()
+    assert breaker.open_until == 1006.0  # capped at cooldown_max
+
+    clock[0] = 1006.0
+    breaker.acquire()
+    breaker.record_success()
+    assert breaker.state == "closed" and breaker.trips == 0
+    breaker.acquire()
+    breaker.acquire()
+    breaker.record_failure(connect_failed=True)
+    assert breaker.state == "open" and breaker.open_until == 1007.0
+
+
+def test_reading_journal_reaches_every_worker(monkeypatch):
+    path = os.path.join(_tmp, "journal.db")
+    ingesting, other = app.SharedStateStore(path), app.SharedStateStore(path)
+    other.sync_readings()
+    applied = []
+    monkeypatch.setattr(app, "apply_readings", applied.extend)
+    readings = [("PLC1", 100.0, 20.0), ("PLC2", 101.0, 21.5)]
+    ingesting.append_readings(readings)
+    assert ingesting.sync_readings() == 2
+    assert applied == readings
+    assert other.sync_readings() == 2
+    assert applied == readings * 2
+    assert other.sync_readings() == 0
+
+
+def test_alarm_state_is_shared_between_workers():
+    path = os.path.join(_tmp, "alarms.db")
+    engines = [app.AlertEngine(store=app.SharedStateStore(path)) for _ in range(2)]
+    decisions = [engine.evaluate("PLC1", 35.0, 30.0)[0] for engine in engines * 2]
+    assert decisions == ["notify", "suppressed", "suppressed", "suppressed"]
+    snapshot = engines[1].snapshot()
+    assert snapshot["totals"] == {"notified": 1, "suppressed": 3, "cleared": 0}
+    assert snapshot["plcs"]["PLC1"]["state"] == "alarming"